@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+JSON 파서 벤치마크 / 퍼징
+
+실제 출력(outputs/user_*/)과 각 단계 프롬프트의 응답 형식으로 코퍼스를 만들고,
+clean_json이 처리하는 결함을 무작위로 주입해 파서별 처리량, 지연, 복구율을 측정한다.
+
+사용법:
+    python bench_parser.py --cases 500 --seed 42
+    python bench_parser.py --parsers parse,incremental --dump-worst bench_worst
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import time
+
+from json_parser import RobustJSONParser, IncrementalJSONParser
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MALE_NAMES = ["영수", "영호", "영식", "영철", "광수", "상철"]
+FEMALE_NAMES = ["영숙", "정숙", "순자", "영자", "옥순", "현숙"]
+MBTI_TYPES = ["ISTJ", "ESTJ", "ENTJ", "INTJ", "ISFJ", "ESFP", "ENFP", "ISTP", "INFP", "ESFJ"]
+CITIES = ["서울", "부산", "대구", "인천", "광주", "대전", "수원"]
+JOBS = ["회사원", "공무원", "자영업", "의사", "변호사", "백화점 판매원", "공장 주임", "교사"]
+
+
+# ---------------------------------------------------------------------------
+# 코퍼스 생성
+# ---------------------------------------------------------------------------
+
+def load_output_samples():
+    """저장된 실제 출력 파일 로드"""
+    samples = []
+    patterns = [
+        os.path.join(BASE_DIR, 'outputs', 'user_*', '*.json'),
+        os.path.join(BASE_DIR, '..', 'outputs', 'user_*', '*.json'),
+    ]
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    samples.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return samples
+
+
+def load_reference_plots():
+    """레퍼런스 에피소드 (현실적인 한국어 줄거리 문장)"""
+    path = os.path.join(BASE_DIR, 'references/processed/lovewar.json')
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def make_stories(rng, references, count):
+    """prompt_1_plot 응답 형식"""
+    stories = []
+    for ref in rng.sample(references, count):
+        # 4~5줄 분량이 되도록 에피소드 여러 개의 문장을 이어붙임
+        lines = [ref['plot']] + [r['plot'] for r in rng.sample(references, rng.randint(2, 4))]
+        stories.append({"title": ref['title'], "plot": "\n".join(lines)})
+    return {"stories": stories}
+
+
+def make_characters(rng, count):
+    """prompt_2_character 응답 형식"""
+    names = rng.sample(MALE_NAMES, (count + 1) // 2) + rng.sample(FEMALE_NAMES, count // 2)
+    characters = {}
+    for name in names:
+        gender = "남성" if name in MALE_NAMES else "여성"
+        versions = []
+        for version in range(1, 4):
+            mbti = rng.choice(MBTI_TYPES)
+            versions.append({
+                "version": version,
+                "name": name,
+                "gender": gender,
+                "age": rng.randint(20, 60),
+                "job": rng.choice(JOBS),
+                "hometown": rng.choice(CITIES),
+                "mbti": mbti,
+                "mbti_description": f"{mbti} - 책임감이 강하고 신뢰할 수 있습니다",
+                "personality_analysis": "겉으로는 침착하지만 속으로는 불안을 삭이며 참는다. 결정적인 순간에는 냉정하게 계산한다.",
+                "trait": "원칙주의, 인내심"
+            })
+        characters[name] = versions
+    return {"characters": characters}
+
+
+def make_detail_options(rng, references, names):
+    """prompt_3_character_detail 응답 형식 (관계/비밀 섹션)"""
+    options = []
+    for number in range(1, 4):
+        if rng.random() < 0.5:
+            pairs = [f"{a}-{b}" for i, a in enumerate(names) for b in names[i+1:]]
+            options.append({
+                "option_number": number,
+                "title": "공생적 의존",
+                "description": rng.choice(references)['plot'],
+                "relationships": [{
+                    "pair": pair,
+                    "surface_relationship": "부부",
+                    "real_relationship": "가해자와 공모자",
+                    "emotional_temperature": "애증의 공존",
+                    "power_structure": "경제적 의존 vs 감정적 지배",
+                    "conflict_pattern": "폭발-후회-반복",
+                    "communication_style": "간접적 공격과 침묵"
+                } for pair in pairs]
+            })
+        else:
+            options.append({
+                "option_number": number,
+                "title": "이중생활",
+                "description": rng.choice(references)['plot'],
+                "character_secrets": [{
+                    "name": name,
+                    "biggest_secret": rng.choice(references)['plot'],
+                    "reason_for_hiding": "가족의 체면",
+                    "consequences_if_revealed": "이혼과 재산 분할",
+                    "true_desire": "인정받고 싶은 마음",
+                    "suppression_reason": "두려움",
+                    "hints_in_behavior": "휴대폰을 항상 뒤집어 둔다"
+                } for name in names]
+            })
+    return {"options": options}
+
+
+def build_corpus(rng, references):
+    """기본 코퍼스 (정상 JSON 객체 목록)"""
+    corpus = list(load_output_samples())
+    for count in (1, 3, 5, 5, 8, 10):
+        corpus.append(make_stories(rng, references, count))
+    for count in (2, 3, 4, 5):
+        corpus.append(make_characters(rng, count))
+    for count in (2, 3, 4):
+        corpus.append(make_detail_options(rng, references, rng.sample(MALE_NAMES + FEMALE_NAMES, count)))
+    return corpus
+
+
+# ---------------------------------------------------------------------------
+# 결함 주입 (clean_json이 처리하는 결함들)
+# ---------------------------------------------------------------------------
+
+def render(rng, obj):
+    """모델 출력처럼 들여쓰기된 JSON 텍스트"""
+    return json.dumps(obj, ensure_ascii=False, indent=rng.choice([2, 4]))
+
+
+def mutate_fence(rng, text):
+    prefix = rng.choice(["", "다음은 요청하신 결과입니다.\n\n", "물론입니다! "])
+    return f"{prefix}```json\n{text}\n```\n"
+
+
+def mutate_line_comment(rng, text):
+    lines = text.split('\n')
+    index = rng.randrange(1, max(2, len(lines)))
+    lines.insert(index, "    // 참고: 레퍼런스를 바탕으로 작성했습니다")
+    return '\n'.join(lines)
+
+
+def mutate_block_comment(rng, text):
+    lines = text.split('\n')
+    index = rng.randrange(1, max(2, len(lines)))
+    lines.insert(index, "    /* 추가 설명\n       여러 줄 주석 */")
+    return '\n'.join(lines)
+
+
+def mutate_trailing_comma(rng, text):
+    positions = [i for i, c in enumerate(text) if c in '}]' and i > 0]
+    if not positions:
+        return text
+    index = rng.choice(positions)
+    # 닫는 괄호 앞의 마지막 값 뒤에 쉼표 삽입
+    before = text[:index].rstrip()
+    if before.endswith((',', '{', '[')):
+        return text
+    return before + ',' + text[len(before):]
+
+
+def mutate_raw_newline(rng, text):
+    # 문자열 안의 \n 이스케이프를 실제 줄바꿈으로
+    return text.replace('\\n', '\n')
+
+
+def mutate_inner_quote(rng, text):
+    marker = '": "'
+    positions = []
+    start = text.find(marker)
+    while start != -1:
+        positions.append(start + len(marker))
+        start = text.find(marker, start + 1)
+    if not positions:
+        return text
+    index = rng.choice(positions)
+    return text[:index] + '그는 "정말 그래?"라고 물었다. ' + text[index:]
+
+
+def mutate_whitespace(rng, text):
+    text = text.replace('\n', '\r\n') if rng.random() < 0.5 else text.replace('    ', '\t')
+    return '\ufeff' + text if rng.random() < 0.3 else text
+
+
+def mutate_truncate(rng, text):
+    return text[:rng.randint(len(text) // 2, len(text) - 1)]
+
+
+# 적용 순서: 줄 단위 주입은 문자열 안 줄바꿈이 생기기 전에, 잘림은 항상 마지막에
+MUTATORS = {
+    'line_comment': mutate_line_comment,
+    'block_comment': mutate_block_comment,
+    'trailing_comma': mutate_trailing_comma,
+    'inner_quote': mutate_inner_quote,
+    'whitespace': mutate_whitespace,
+    'raw_newline': mutate_raw_newline,
+    'fence': mutate_fence,
+    'truncate': mutate_truncate,
+}
+
+
+def adversarial_cases():
+    """정규식 역추적 등 최악의 경우를 노리는 입력"""
+    return [
+        ('open_braces', '{' * 20000),
+        ('unclosed_string', '{"stories": [{"title": "' + '가' * 100000),
+        ('many_quotes', '{"plot": "' + '"a" ' * 20000 + '"}'),
+        ('deep_nesting', '{"a": ' * 2000 + '1' + '}' * 2000),
+        ('brace_soup', ('{"x": [' + '}' * 3) * 5000),
+    ]
+
+
+def build_cases(rng, corpus, count):
+    """(이름, 입력 텍스트, 기대 결과, 주입한 결함) 목록"""
+    cases = []
+    for i in range(count):
+        expected = rng.choice(corpus)
+        text = render(rng, expected)
+
+        # 결함 0~3개 주입 (잘림은 가끔만)
+        names = rng.sample([n for n in MUTATORS if n not in ('fence', 'truncate')], rng.randint(0, 3))
+        if rng.random() < 0.5:
+            names.append('fence')
+        if rng.random() < 0.1:
+            names.append('truncate')
+        names = [n for n in MUTATORS if n in names]
+        for name in names:
+            text = MUTATORS[name](rng, text)
+
+        # 따옴표 주입은 기대 결과를 바꾸므로 비교용으로 표시만 함
+        exact = 'inner_quote' not in names and 'truncate' not in names
+        cases.append((f"case_{i:04d}", text, expected if exact else None, names))
+
+    for name, text in adversarial_cases():
+        cases.append((name, text, None, ['adversarial']))
+    return cases
+
+
+# ---------------------------------------------------------------------------
+# 파서 등록 (새 파서는 여기에 추가)
+# ---------------------------------------------------------------------------
+
+def parse_recover_only(text):
+    json_str = RobustJSONParser.extract_json(text)
+    return RobustJSONParser.recover_json(json_str) if json_str else None
+
+
+def parse_incremental(text, chunk_size=256):
+    parser = IncrementalJSONParser()
+    for i in range(0, len(text), chunk_size):
+        parser.feed(text[i:i + chunk_size])
+    parser.close()
+    return parser.result()
+
+
+PARSERS = {
+    'parse': RobustJSONParser.parse,
+    'recover_json': parse_recover_only,
+    'incremental': parse_incremental,
+}
+
+
+# ---------------------------------------------------------------------------
+# 측정
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def run_parser(name, func, cases):
+    """파서 하나를 전체 케이스에 실행하고 통계 반환"""
+    timings = []
+    total_bytes = 0
+    exact_total = exact_ok = 0
+    partial_ok = 0
+    failures = []
+
+    for case_name, text, expected, mutations in cases:
+        sink = io.StringIO()
+        start = time.perf_counter()
+        try:
+            # 파서의 디버그 출력은 측정에서 제외
+            with contextlib.redirect_stdout(sink):
+                result = func(text)
+        except Exception as e:
+            result = None
+            mutations = mutations + [f"예외: {type(e).__name__}"]
+        elapsed = time.perf_counter() - start
+
+        timings.append((elapsed, case_name, len(text), mutations))
+        total_bytes += len(text.encode('utf-8'))
+
+        if expected is not None:
+            exact_total += 1
+            if result == expected:
+                exact_ok += 1
+            else:
+                failures.append((case_name, mutations))
+        elif result:
+            partial_ok += 1
+
+    times = sorted(t for t, _, _, _ in timings)
+    total_time = sum(times)
+    return {
+        'name': name,
+        'cases': len(cases),
+        'mb_per_s': total_bytes / total_time / 1e6 if total_time else 0.0,
+        'p50_ms': percentile(times, 0.5) * 1000,
+        'p99_ms': percentile(times, 0.99) * 1000,
+        'max_ms': times[-1] * 1000 if times else 0.0,
+        'recovery_rate': exact_ok / exact_total if exact_total else 0.0,
+        'exact_total': exact_total,
+        'partial_ok': partial_ok,
+        'partial_total': len(cases) - exact_total,
+        'failures': failures,
+        'worst': sorted(timings, reverse=True)[:5],
+    }
+
+
+def print_report(stats):
+    print("=" * 60)
+    print(f"[{stats['name']}] {stats['cases']}개 케이스")
+    print("=" * 60)
+    print(f"처리량: {stats['mb_per_s']:.2f} MB/s")
+    print(f"지연: p50 {stats['p50_ms']:.3f}ms / p99 {stats['p99_ms']:.3f}ms / 최대 {stats['max_ms']:.3f}ms")
+    print(f"복구율 (정확히 일치): {stats['recovery_rate'] * 100:.1f}% ({stats['exact_total']}개 중)")
+    print(f"부분 복구 (따옴표 주입/잘림/공격 입력): {stats['partial_ok']}/{stats['partial_total']}")
+
+    print("가장 느린 입력:")
+    for elapsed, case_name, size, mutations in stats['worst']:
+        print(f"  {case_name}: {elapsed * 1000:.3f}ms, {size}자, 결함={','.join(mutations) or '없음'}")
+
+    if stats['failures']:
+        print(f"복구 실패 ({len(stats['failures'])}개, 최대 5개 표시):")
+        for case_name, mutations in stats['failures'][:5]:
+            print(f"  {case_name}: 결함={','.join(mutations) or '없음'}")
+    print()
+
+
+def dump_worst(stats_list, cases, out_dir):
+    """가장 느린 입력과 실패 입력을 파일로 저장 (오프라인 분석용)"""
+    os.makedirs(out_dir, exist_ok=True)
+    by_name = {case[0]: case[1] for case in cases}
+    for stats in stats_list:
+        names = [case_name for _, case_name, _, _ in stats['worst']]
+        names += [case_name for case_name, _ in stats['failures'][:5]]
+        for case_name in names:
+            path = os.path.join(out_dir, f"{stats['name']}_{case_name}.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(by_name[case_name])
+    print(f"최악의 입력 저장 위치: {out_dir}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="RobustJSONParser 벤치마크 / 퍼징")
+    arg_parser.add_argument('--cases', type=int, default=300, help="퍼징 케이스 수")
+    arg_parser.add_argument('--seed', type=int, default=42, help="난수 시드 (같은 시드면 같은 코퍼스)")
+    arg_parser.add_argument('--parsers', default=','.join(PARSERS), help="측정할 파서 (쉼표로 구분)")
+    arg_parser.add_argument('--dump-worst', default=None, help="최악의 입력을 저장할 디렉토리")
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    references = load_reference_plots()
+    corpus = build_corpus(rng, references)
+    cases = build_cases(rng, corpus, args.cases)
+
+    print(f"코퍼스: 기본 객체 {len(corpus)}개, 케이스 {len(cases)}개 (시드 {args.seed})\n")
+
+    stats_list = []
+    for name in args.parsers.split(','):
+        name = name.strip()
+        if name not in PARSERS:
+            print(f"알 수 없는 파서: {name}")
+            continue
+        stats = run_parser(name, PARSERS[name], cases)
+        print_report(stats)
+        stats_list.append(stats)
+
+    if args.dump_worst:
+        dump_worst(stats_list, cases, args.dump_worst)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from prompt_2_character import CharacterGen
+from scheduler import GenerationScheduler
+
+
+class CharacterFanout:
+    """
+    2단계 캐릭터 분할 생성
+
+    인물 목록을 먼저 뽑고, 인물마다 3가지 버전을 별도 호출로 동시에 생성한 뒤
+    기존 응답과 같은 {"characters": {이름: [버전1, 버전2, 버전3]}} 형태로 합친다.
+    한 인물이 실패해도 나머지는 그대로 쓰고, 실패한 인물만 다시 생성할 수 있다.
+    """
+
+    def __init__(self, claude, scheduler, char_gen=None):
+        self.claude = claude
+        self.scheduler = scheduler
+        self.char_gen = char_gen or CharacterGen()
+
+    async def _submit(self, user_id, queue, prompt_data, refresh):
+        prompt_data['refresh'] = refresh
+        # 인물마다 별도 대기열 (같은 사용자의 다른 인물 요청으로 대체되지 않도록)
+        return await self.scheduler.submit(
+            (user_id, queue), lambda: self.claude.execute_prompt_async(prompt_data),
+            GenerationScheduler.INTERACTIVE
+        )
+
+    async def cast(self, user_id, plot, refresh=False):
+        """등장인물 목록 [{name, gender, role}] (실패 시 빈 목록)"""
+        response = await self._submit(user_id, 'cast', self.char_gen.generate_cast(plot), refresh)
+        cast = []
+        seen = set()
+        for member in (response or {}).get('cast', []):
+            name = str(member.get('name', '')).strip()
+            if name and name not in seen:
+                seen.add(name)
+                cast.append(dict(member, name=name))
+        return cast
+
+    async def versions(self, user_id, plot, member, cast, refresh=False):
+        """인물 한 명의 버전 목록 (실패 시 None)"""
+        name = member['name']
+        prompt_data = self.char_gen.generate_character(plot, member, cast)
+        response = await self._submit(user_id, ('character', name), prompt_data, refresh)
+        versions = (response or {}).get('versions')
+        if not versions:
+            return None
+        # 화면에서 쓰는 필드 정리 (이름 고정, 버전 번호 1부터)
+        return [dict(version, name=name, version=i) for i, version in enumerate(versions[:3], 1)]
+
+    async def generate(self, user_id, plot, refresh=False):
+        """
+        전체 캐릭터 생성
+
+        반환: {'characters': {이름: [버전...]}, 'cast': [...], 'failed': [실패한 이름]}
+              인물 목록 추출에 실패하면 None
+        """
+        cast = await self.cast(user_id, plot, refresh)
+        if not cast:
+            return None
+
+        results = await asyncio.gather(
+            *(self.versions(user_id, plot, member, cast, refresh) for member in cast),
+            return_exceptions=True
+        )
+        characters = {}
+        failed = []
+        for member, result in zip(cast, results):
+            if isinstance(result, BaseException) or not result:
+                if isinstance(result, BaseException):
+                    print(f"캐릭터 생성 실패 ({member['name']}): {result}")
+                failed.append(member['name'])
+            else:
+                characters[member['name']] = result
+        return {'characters': characters, 'cast': cast, 'failed': failed}
+
+    async def regenerate(self, user_id, plot, cast, name):
+        """인물 한 명만 다시 생성 (캐시 건너뜀, 실패 시 None)"""
+        member = next((m for m in cast if m['name'] == name), None)
+        if member is None:
+            return None
+        return await self.versions(user_id, plot, member, cast, refresh=True)
@@ -2,53 +2,60 @@
 # -*- coding: utf-8 -*-
 
 import json
-import subprocess
+import asyncio
 import os
+import random
 import sys
-from json_parser import RobustJSONParser
+import time
+from collections import deque
+from json_parser import RobustJSONParser, IncrementalJSONParser
+from response_cache import cache_key
+from prompt_budget import PromptBudget
+from llm_backend import backend_from_env, LLMTimeout
+from metrics import METRICS
 
 
-class ClaudeInterface:
-    def __init__(self):
-        self.selected_stories = {}  # 선택된 스토리 저장
-        self.keywords = []  # 키워드 리스트
-        self.tone = self._get_random_tone()  # 톤 설정 (랜덤 시작)
-        self.num_stories = 5  # 생성할 스토리 개수
-    
-    def _get_random_tone(self):
-        """랜덤 톤 선택"""
-        import random
-        tones = ["기본", "자극적", "현실적", "충격적", "선정적"]
-        return random.choice(tones)
-        
-    def execute_prompt(self, prompt_data):
-        """Claude Code로 프롬프트 자동 실행"""
-        print("\n재생성 중...")
-        print("="*60)
-        
-        # 프롬프트 출력
-        print("\n[생성된 프롬프트]")
-        print("-" * 60)
-        print(prompt_data['prompt'])
-        print("-" * 60)
-        
-        # 추가 랜덤 요소
-        import random
-        creativity_hints = [
-            "\n※ 기존과 완전히 다른 새로운 스토리를 만들어주세요.",
-            "\n★ 독창적이고 예상치 못한 전개를 포함해주세요.",
-            "\n◆ 이전에 없던 신선한 설정으로 작성해주세요.",
-            "\n▶ 창의적이고 독특한 이야기를 만들어주세요."
-        ]
-        prompt_data['prompt'] += random.choice(creativity_hints)
-        
-        # 재생성 시 30% 확률로 톤 자동 변경
-        if random.random() < 0.3 and not hasattr(self, '_tone_locked'):
-            self.tone = self._get_random_tone()
-            print(f"톤 자동 변경: {self.tone}")
-        
-        # 이름 제한 및 캐릭터 매칭 가이드 추가
-        name_restriction = """\n
+# 매 요청마다 덧붙이는 창의성 문구 (캐시 키 계산 시 제외)
+CREATIVITY_HINTS = [
+    "\n※ 기존과 완전히 다른 새로운 스토리를 만들어주세요.",
+    "\n★ 독창적이고 예상치 못한 전개를 포함해주세요.",
+    "\n◆ 이전에 없던 신선한 설정으로 작성해주세요.",
+    "\n▶ 창의적이고 독특한 이야기를 만들어주세요."
+]
+
+
+# 단계별 시도 한 번의 마감 시간 (초, 넘기면 claude 프로세스를 종료하고 재시도)
+STAGE_DEADLINES = {
+    'plot': 240,
+    'character': 240,
+    'character_one': 150,
+    'cast': 90,
+    'detail': 150
+}
+DEFAULT_DEADLINE = 180
+# 요청 전체(재시도 포함)는 마감 시간의 이 배수 안에서 끝냄
+TOTAL_DEADLINE_FACTOR = 2.0
+# 남은 시간이 이보다 짧으면 새 시도를 시작하지 않음 (초)
+MIN_ATTEMPT_SECONDS = 5.0
+# 재시도 대기 (full jitter 지수 백오프, 초)
+RETRY_BACKOFF = 1.0
+RETRY_BACKOFF_MAX = 10.0
+# 헤징 기준 p95를 계산할 최근 소요 시간 수와 최소 표본 수
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+
+class RetryableFailure(Exception):
+    """재시도할 수 있는 생성 실패 (timeout, exit, empty, parse)"""
+
+    def __init__(self, reason, stdout=''):
+        super().__init__(reason)
+        self.reason = reason
+        self.stdout = stdout or ''
+
+
+# 등장인물 이름 제한 및 캐릭터 매칭 가이드 (모든 프롬프트 뒤에 추가)
+NAME_GUIDE = """\n
 중요: 등장인물 이름은 캐릭터의 성격과 역할에 맞게 다음 중에서만 선택하세요 (성 없이 이름만):
 
 【남성 이름 가이드】
@@ -88,11 +95,56 @@ class ClaudeInterface:
 - 돈 때문에 범죄 저지르는 남자 → "영철"
 
 반드시 캐릭터의 성격과 역할에 맞는 이름을 선택하세요!"""
-        prompt_data['prompt'] += name_restriction
+
+
+class ClaudeInterface:
+    def __init__(self, cache=None, seed=None, budget=None, backend=None, deadlines=None, retries=2, hedge=True):
+        self.selected_stories = {}  # 선택된 스토리 저장
+        self.keywords = []  # 키워드 리스트
+        self.tone = self._get_random_tone()  # 톤 설정 (랜덤 시작)
+        self.num_stories = 5  # 생성할 스토리 개수
+        self.cache = cache  # ResponseCache (None이면 캐시 사용 안 함)
+        self.seed = seed  # 재현 모드 시드 (같은 시드+톤+키워드면 캐시된 결과 재사용)
+        self.budget = budget or PromptBudget()  # 프롬프트 토큰 예산
+        # LLM 실행 방식 (기본은 요청마다 새 claude 프로세스, SCENARIO_LLM_BACKEND로 pool/fake/record/replay 선택)
+        self.backend = backend or backend_from_env(ignore=CREATIVITY_HINTS)
+        self.deadlines = dict(STAGE_DEADLINES, **(deadlines or {}))  # 단계별 시도 마감 시간 (초)
+        self.retries = retries  # 재시도할 수 있는 실패의 최대 재시도 횟수
+        self.hedge = hedge  # p95를 넘긴 요청에 같은 요청을 하나 더 보낼지
+        self._latencies = {}  # 단계 -> 최근 성공한 시도의 소요 시간
+    
+    def _get_random_tone(self):
+        """랜덤 톤 선택"""
+        import random
+        tones = ["기본", "자극적", "현실적", "충격적", "선정적"]
+        return random.choice(tones)
+        
+    def _build_command(self, prompt_data):
+        """프롬프트 데이터로 Claude 명령어 구성"""
+        print("\n재생성 중...")
+        print("="*60)
+        
+        # 프롬프트 출력
+        print("\n[생성된 프롬프트]")
+        print("-" * 60)
+        print(prompt_data['prompt'])
+        print("-" * 60)
         
-        # 키워드가 있으면 프롬프트에 추가
-        if self.keywords:
-            keyword_str = f"\n\n특히 다음 키워드들을 포함해주세요: {', '.join(self.keywords)}"
+        # 추가 랜덤 요소 (시드가 있으면 재현 가능하게 고정)
+        import random
+        seed = prompt_data.get('seed')
+        rng = random.Random(seed) if seed is not None else random
+        prompt_data['prompt'] += rng.choice(CREATIVITY_HINTS)
+        
+        # 재생성 시 30% 확률로 톤 자동 변경 (재현 모드나 요청별 톤이 있으면 고정)
+        if seed is None and 'tone' not in prompt_data and random.random() < 0.3 and not hasattr(self, '_tone_locked'):
+            self.tone = self._get_random_tone()
+            print(f"톤 자동 변경: {self.tone}")
+        
+        # 키워드가 있으면 프롬프트에 추가 (요청별 키워드가 있으면 우선)
+        keywords = prompt_data.get('keywords', self.keywords)
+        if keywords:
+            keyword_str = f"\n\n특히 다음 키워드들을 포함해주세요: {', '.join(keywords)}"
             prompt_data['prompt'] = prompt_data['prompt'].replace("생성해주세요.", f"생성해주세요.{keyword_str}")
         
         # 톤 설정 추가
@@ -102,130 +154,488 @@ class ClaudeInterface:
             "충격적": "\n\n톤: 반전이 있고 충격적인 결말로 작성해주세요.",
             "기본": ""
         }
-        if self.tone in tone_map:
-            prompt_data['prompt'] = prompt_data['prompt'].replace("생성해주세요.", f"생성해주세요.{tone_map[self.tone]}")
+        tone = prompt_data.get('tone') or self.tone
+        METRICS.label(tone=tone)
+        if tone in tone_map:
+            prompt_data['prompt'] = prompt_data['prompt'].replace("생성해주세요.", f"생성해주세요.{tone_map[tone]}")
         
-        # Claude Code 명령어 구성
-        # 캐릭터 생성인 경우 프롬프트만 전달
-        if "캐릭터" in prompt_data['prompt'] or "character" in prompt_data['prompt']:
-            claude_command = prompt_data['prompt']
-        else:
-            # 줄거리 생성인 경우 레퍼런스 포함
-            claude_command = f"""다음 프롬프트를 실행해주세요:
+        # Claude Code 명령어 구성 (프롬프트 예산 안으로 레퍼런스 조정)
+        claude_command, breakdown = self.compose_command(prompt_data)
+        prompt_data['budget_breakdown'] = breakdown
+        if breakdown.get('cut') and 'reference_ids' in prompt_data:
+            # 예산 때문에 뒤에서 잘린 레퍼런스는 보내지 않았으므로 보낸 목록에서 제외 (다음에 다시 뽑힐 수 있도록)
+            sent = len(prompt_data['references']) - breakdown['cut']
+            prompt_data['reference_ids'] = prompt_data['reference_ids'][:sent]
+        
+        # 명령어 길이 체크
+        print(f"Claude 명령어 길이: {len(claude_command)} 문자 (추정 {breakdown['total']} 토큰)")
+        
+        # 디버깅용: 명령어 첫 부분 출력
+        print(f"명령어 시작: {claude_command[:200]}...")
+        
+        # 프롬프트가 너무 길면 경고
+        if len(claude_command) > 20000:
+            print("경고: 프롬프트가 매우 깁니다.")
+        
+        return claude_command
+    
+    def _stage(self, prompt_data):
+        """프롬프트 단계 (plot, character, detail)"""
+        if 'stage' in prompt_data:
+            return prompt_data['stage']
+        # 단계 정보가 없는 예전 형식: 레퍼런스 유무로 판단
+        return 'plot' if prompt_data.get('references') else 'character'
+    
+    def compose_command(self, prompt_data):
+        """
+        최종 명령어와 구성 요소별 토큰 추정치 반환 (출력/랜덤 요소 없음)
+        
+        줄거리 단계에서는 레퍼런스를 예산에 맞게 줄여서 포함
+        """
+        stage = self._stage(prompt_data)
+        instructions = prompt_data['prompt']
+        components = {
+            'instructions': instructions,
+            'name_guide': NAME_GUIDE,
+        }
+        for name, text in prompt_data.get('components', {}).items():
+            # 프롬프트에 이미 포함된 부분은 지시문에서 빼고 따로 집계
+            if text:
+                components['instructions'] = components['instructions'].replace(text, '', 1)
+            components[name] = text
+        
+        if stage != 'plot':
+            # 캐릭터/디테일 생성인 경우 프롬프트만 전달
+            claude_command = instructions + NAME_GUIDE
+            return claude_command, self.budget.breakdown(stage, components)
+        
+        # 줄거리 생성인 경우 레퍼런스 포함
+        references = prompt_data.get('references', [])
+        references, references_text = self.budget.fit_references(stage, components, references)
+        components['references'] = references_text
+        
+        claude_command = f"""다음 프롬프트를 실행해주세요:
 
-{prompt_data['prompt']}
+{instructions}{NAME_GUIDE}
 
-레퍼런스 데이터 (사랑과 전쟁에서 랜덤 선택한 {len(prompt_data.get('references', []))}개 에피소드):
-{json.dumps(prompt_data.get('references', []), ensure_ascii=False, indent=2) if prompt_data.get('references') else ""}
+레퍼런스 데이터 (사랑과 전쟁에서 선택한 {len(references)}개 에피소드):
+{references_text}
 
 위 레퍼런스를 참고하여 프롬프트에서 요청한 대로 새로운 이야기를 생성해주세요."""
         
-        # Claude Code 실행
-        try:
-            # 명령어 길이 체크
-            print(f"Claude 명령어 길이: {len(claude_command)} 문자")
-            
-            # 디버깅용: 명령어 첫 부분 출력
-            print(f"명령어 시작: {claude_command[:200]}...")
-            
-            # 프롬프트가 너무 길면 경고
-            if len(claude_command) > 20000:
-                print("경고: 프롬프트가 매우 깁니다.")
-            
-            process = subprocess.Popen(
-                ['claude'],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8'
-            )
-            
-            stdout, stderr = process.communicate(input=claude_command)
-            
-            # 디버깅: stdout과 stderr 모두 출력
-            if stderr:
-                print(f"Claude stderr: {stderr}")
+        return claude_command, self.budget.breakdown(stage, components)
+    
+    def _cache_key(self, prompt_data, claude_command):
+        """캐시 키 계산 (캐시 대상이 아니면 None)"""
+        if self.cache is None:
+            return None
+        # 시드가 지정된 재현 모드이거나, 같은 입력에 같은 결과를 써도 되는 프롬프트만 캐시
+        if prompt_data.get('seed') is None and not prompt_data.get('cacheable'):
+            return None
+        # 가짜/재생 백엔드의 응답이 실제 생성 결과로 쓰이지 않도록 백엔드별로 키 분리
+        return cache_key(
+            claude_command, seed=prompt_data.get('seed'), ignore=CREATIVITY_HINTS,
+            namespace=self.backend.cache_namespace
+        )
+    
+    def _cache_lookup(self, prompt_data, key):
+        """캐시 조회 (refresh 요청이면 건너뜀)"""
+        if key is None or prompt_data.get('refresh'):
+            return None
+        cached = self.cache.get(key)
+        if cached is not None:
+            print(f"캐시 적중: {key[:12]}")
+        return cached
+    
+    def _cache_store(self, key, result):
+        """파싱에 성공한 결과만 캐시에 저장"""
+        if key is not None and result:
+            self.cache.put(key, result)
+    
+    async def _cache_lookup_async(self, prompt_data, key):
+        """캐시 조회 (파일 읽기가 이벤트 루프를 막지 않도록 스레드에서 실행)"""
+        if key is None or prompt_data.get('refresh'):
+            return None
+        return await asyncio.to_thread(self._cache_lookup, prompt_data, key)
+    
+    async def _cache_store_async(self, key, result):
+        """캐시 저장 (파일 쓰기와 크기 정리가 이벤트 루프를 막지 않도록 스레드에서 실행)"""
+        if key is not None and result:
+            await asyncio.to_thread(self._cache_store, key, result)
+    
+    def execute_prompt(self, prompt_data):
+        """Claude Code로 프롬프트 자동 실행"""
+        stage = self._stage(prompt_data)
+        with METRICS.request(stage):
+            with METRICS.span('prompt_build'):
+                claude_command = self._build_command(prompt_data)
+            key = self._cache_key(prompt_data, claude_command)
+            cached = self._cache_lookup(prompt_data, key)
+            if cached is not None:
+                METRICS.label(outcome='ok', cached=True)
+                return cached
             
-            if process.returncode != 0:
-                print(f"Claude Code 실행 오류 (return code: {process.returncode})")
-                print(f"stderr: {stderr}")
-                print(f"stdout: {stdout[:500]}")
+            # Claude Code 실행 (마감 시간 안에서 재시도)
+            try:
+                deadline, give_up_at = self._deadline(stage)
+                failure = None
+                for attempt in range(self.retries + 1):
+                    timeout = self._attempt_timeout(stage, attempt, failure, deadline, give_up_at)
+                    if timeout is None:
+                        break
+                    if attempt:
+                        time.sleep(timeout[1])
+                    try:
+                        result = self._attempt(claude_command, stage, timeout[0])
+                    except RetryableFailure as e:
+                        failure = e
+                        continue
+                    self._cache_store(key, result)
+                    return self._finish_response(result, None, stage, False)
+                return self._give_up(failure, stage, prompt_data.get('allow_dummy', False))
+                    
+            except FileNotFoundError:
+                print("Claude Code가 설치되어 있지 않습니다.")
                 return None
-            
-            # 빈 출력 체크
-            if not stdout or stdout.strip() == "":
-                print("Claude가 빈 응답을 반환했습니다.")
+            except Exception as e:
+                print(f"오류 발생: {e}")
                 return None
+    
+    async def execute_prompt_async(self, prompt_data, on_item=None, on_reset=None):
+        """
+        Claude Code로 프롬프트 비동기 실행 (이벤트 루프를 막지 않음)
+        
+        on_item: 지정하면 출력을 읽는 도중 완성된 항목마다 on_item(item, path)로 호출
+                 (path 예: ('stories',), ('characters', '영수'), ('options',))
+        on_reset: 항목을 전달하던 시도가 실패하면 재시도(또는 포기) 전에 호출
+                  (그때까지 받은 항목은 버려야 함, 재시도는 처음 항목부터 다시 전달)
+        """
+        stage = self._stage(prompt_data)
+        with METRICS.request(stage):
+            with METRICS.span('prompt_build'):
+                claude_command = self._build_command(prompt_data)
+            key = self._cache_key(prompt_data, claude_command)
+            cached = await self._cache_lookup_async(prompt_data, key)
+            if cached is not None:
+                METRICS.label(outcome='ok', cached=True)
+                if on_item:
+                    for path, item in self._iter_cached_items(cached):
+                        await self._emit_item(on_item, item, path)
+                return cached
             
-            # 출력에서 JSON 추출 - RobustJSONParser 사용
-            result = RobustJSONParser.parse(stdout)
+            # Claude Code 실행 (마감 시간 안에서 재시도, 느리면 헤징)
+            try:
+                deadline, give_up_at = self._deadline(stage)
+                failure = None
+                for attempt in range(self.retries + 1):
+                    timeout = self._attempt_timeout(stage, attempt, failure, deadline, give_up_at)
+                    if timeout is None:
+                        break
+                    if attempt:
+                        await asyncio.sleep(timeout[1])
+                    try:
+                        result = await self._hedged_attempt(claude_command, stage, timeout[0], on_item, on_reset)
+                    except RetryableFailure as e:
+                        failure = e
+                        continue
+                    await self._cache_store_async(key, result)
+                    return self._finish_response(result, None, stage, False)
+                return self._give_up(failure, stage, prompt_data.get('allow_dummy', False))
             
-            if result:
-                return result
-            else:
-                print("JSON 파싱 실패")
-                print("전체 출력:")
-                print(stdout[:1000])  # 첫 1000자만 출력
-                
-                # 더미 데이터 반환 (stories 또는 characters)
-                if "캐릭터" in claude_command or "character" in claude_command:
-                    return {
-                        "characters": {
-                            "영수": [
-                                {
-                                    "version": 1,
-                                    "name": "영수",
-                                    "gender": "남성",
-                                    "age": 35,
-                                    "job": "회사원",
-                                    "hometown": "서울",
-                                    "mbti": "ISTJ",
-                                    "mbti_description": "현실주의자형 - 책임감이 강하고 신뢰할 수 있습니다",
-                                    "personality_analysis": "임시 성격 분석입니다.",
-                                    "trait": "성실함"
-                                },
-                                {
-                                    "version": 2,
-                                    "name": "영수",
-                                    "gender": "남성",
-                                    "age": 40,
-                                    "job": "공무원",
-                                    "hometown": "부산",
-                                    "mbti": "ESTJ",
-                                    "mbti_description": "경영자형 - 리더십이 강합니다",
-                                    "personality_analysis": "임시 성격 분석 2입니다.",
-                                    "trait": "리더십"
-                                },
-                                {
-                                    "version": 3,
-                                    "name": "영수",
-                                    "gender": "남성",
-                                    "age": 38,
-                                    "job": "자영업",
-                                    "hometown": "대구",
-                                    "mbti": "ENTJ",
-                                    "mbti_description": "통솔자형 - 야망이 있습니다",
-                                    "personality_analysis": "임시 성격 분석 3입니다.",
-                                    "trait": "야심"
-                                }
-                            ]
-                        }
-                    }
-                else:
-                    return {
-                        "stories": [
-                            {"title": f"임시 제목 {i+1}", "plot": f"임시 줄거리 {i+1}"} 
-                            for i in range(self.num_stories)
-                        ]
-                    }
-                
-        except FileNotFoundError:
-            print("Claude Code가 설치되어 있지 않습니다.")
+            except FileNotFoundError:
+                print("Claude Code가 설치되어 있지 않습니다.")
+                return None
+            except Exception as e:
+                print(f"오류 발생: {e}")
+                return None
+    
+    def _deadline(self, stage):
+        """단계의 시도별 마감 시간과 전체 포기 시각"""
+        deadline = self.deadlines.get(stage, DEFAULT_DEADLINE)
+        return deadline, time.monotonic() + deadline * TOTAL_DEADLINE_FACTOR
+    
+    def _attempt_timeout(self, stage, attempt, failure, deadline, give_up_at):
+        """
+        다음 시도의 (마감 시간, 대기 시간) (전체 마감을 넘으면 None)
+        
+        재시도 대기는 full jitter 지수 백오프: 0 ~ min(최대, 기본 * 2^(시도-1)) 사이 무작위
+        """
+        delay = 0.0
+        if attempt:
+            delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** (attempt - 1)))
+        remaining = give_up_at - time.monotonic() - delay
+        if remaining < MIN_ATTEMPT_SECONDS:
+            print(f"전체 마감 시간 초과로 재시도 중단 ({stage})")
+            return None
+        if attempt:
+            METRICS.count('retries_total', stage=stage, reason=failure.reason)
+            print(f"재시도 {attempt}/{self.retries} ({failure.reason}), {delay:.1f}초 후")
+        return min(deadline, remaining), delay
+    
+    def _attempt(self, claude_command, stage, timeout):
+        """시도 한 번 (재시도할 수 있는 실패는 RetryableFailure)"""
+        started = time.monotonic()
+        try:
+            with METRICS.span('generate'):
+                returncode, stdout, stderr = self.backend.run(claude_command, stage, timeout=timeout)
+        except LLMTimeout as e:
+            self.budget.observe(stage, time.monotonic() - started)
+            raise self._failure(stage, 'timeout', str(e))
+        self.budget.observe(stage, time.monotonic() - started)
+        
+        with METRICS.span('parse'):
+            result, parse_path = self._parse_output(returncode, stdout, stderr, stage)
+        return self._accept(result, parse_path, stdout, stage, time.monotonic() - started)
+    
+    async def _attempt_async(self, claude_command, stage, timeout, on_chunk):
+        """비동기 시도 한 번 (재시도할 수 있는 실패는 RetryableFailure)"""
+        started = time.monotonic()
+        try:
+            with METRICS.span('generate'):
+                returncode, stdout, stderr = await self.backend.run_async(
+                    claude_command, stage, on_chunk, timeout=timeout
+                )
+        except LLMTimeout as e:
+            self.budget.observe(stage, time.monotonic() - started)
+            raise self._failure(stage, 'timeout', str(e))
+        self.budget.observe(stage, time.monotonic() - started)
+        
+        # 큰 출력의 JSON 파싱은 스레드에서 처리 (루프 블로킹 방지)
+        with METRICS.span('parse'):
+            result, parse_path = await asyncio.to_thread(
+                self._parse_output, returncode, stdout, stderr, stage
+            )
+        return self._accept(result, parse_path, stdout, stage, time.monotonic() - started)
+    
+    def _parse_output(self, returncode, stdout, stderr, stage):
+        """출력 확인 후 JSON 추출 (반환: (결과, 파싱 경로))"""
+        if not self._check_output(returncode, stdout, stderr):
+            raise self._failure(stage, 'exit' if returncode != 0 else 'empty', stdout=stdout)
+        # 출력에서 JSON 추출 - RobustJSONParser 사용
+        return RobustJSONParser.parse_with_path(stdout)
+    
+    def _accept(self, result, parse_path, stdout, stage, elapsed):
+        """파싱 결과 확인 (성공한 시도의 소요 시간은 헤징 기준에 반영)"""
+        METRICS.label(parse_path=parse_path)
+        if not result:
+            raise self._failure(stage, 'parse', stdout=stdout)
+        self._latencies.setdefault(stage, deque(maxlen=LATENCY_WINDOW)).append(elapsed)
+        return result
+    
+    def _failure(self, stage, reason, message=None, stdout=''):
+        """재시도할 수 있는 실패 기록"""
+        if message:
+            print(message)
+        METRICS.count('attempt_failures_total', stage=stage, reason=reason)
+        return RetryableFailure(reason, stdout)
+    
+    def _give_up(self, failure, stage, allow_dummy):
+        """재시도를 모두 실패한 경우 (파싱 실패이고 allow_dummy면 더미 데이터, 아니면 None)"""
+        reason = failure.reason if failure else 'deadline'
+        print(f"생성 실패 ({stage}, 마지막 원인: {reason})")
+        if failure and failure.reason == 'parse':
+            return self._finish_response(None, failure.stdout, stage, allow_dummy)
+        return None
+    
+    def _hedge_delay(self, stage):
+        """헤징 요청을 보낼 시점 (최근 성공한 시도의 p95, 표본이 부족하면 None)"""
+        samples = self._latencies.get(stage)
+        if not self.hedge or not samples or len(samples) < HEDGE_MIN_SAMPLES:
             return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    
+    async def _hedged_attempt(self, claude_command, stage, timeout, on_item, on_reset=None):
+        """
+        시도 한 번 (p95가 지나도록 출력이 없으면 같은 요청을 하나 더 보내 먼저 성공한 쪽 사용)
+        
+        스트리밍(on_item)은 먼저 출력을 낸 시도만 전달하고 나머지는 취소한다.
+        스트리밍하던 시도가 실패하면 on_reset으로 받는 쪽이 전달받은 항목을 버리게 한다.
+        취소된 시도의 claude 프로세스는 백엔드가 종료한다.
+        """
+        attempts = []
+        owner = []  # 스트리밍 출력을 전달하는 시도 번호
+        
+        def launch(index, attempt_timeout):
+            on_chunk = self._make_on_chunk(index, attempts, owner, on_item)
+            attempts.append(asyncio.ensure_future(
+                self._attempt_async(claude_command, stage, attempt_timeout, on_chunk)
+            ))
+        
+        launch(0, timeout)
+        try:
+            delay = self._hedge_delay(stage)
+            if delay is not None and delay < timeout - MIN_ATTEMPT_SECONDS:
+                await asyncio.wait(attempts, timeout=delay)
+                if not attempts[0].done() and not owner:
+                    print(f"응답 지연 ({delay:.1f}초 초과), 헤징 요청 시작 ({stage})")
+                    METRICS.count('hedges_total', stage=stage)
+                    launch(1, timeout - delay)
+            
+            pending = set(attempts)
+            failure = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is None:
+                        if len(attempts) > 1:
+                            winner = 'primary' if task is attempts[0] else 'hedge'
+                            METRICS.count('hedge_wins_total', stage=stage, winner=winner)
+                        return task.result()
+                    failure = task.exception()
+            raise failure or RetryableFailure('cancelled')
+        except Exception:
+            if owner and on_reset:
+                await self._emit_reset(on_reset)
+            raise
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+    
+    def _make_on_chunk(self, index, attempts, owner, on_item):
+        """시도별 출력 콜백 (첫 출력 시간 기록, 완성된 항목 전달)"""
+        parser = IncrementalJSONParser() if on_item else None
+        started = time.monotonic()
+        first_chunk = []
+        
+        async def on_chunk(text):
+            # 첫 출력까지 걸린 시간
+            if not first_chunk:
+                first_chunk.append(True)
+                METRICS.observe('ttfb', time.monotonic() - started)
+            if parser is None:
+                return
+            if not owner:
+                # 먼저 출력을 낸 시도가 스트리밍을 맡고 다른 시도는 취소
+                owner.append(index)
+                for i, task in enumerate(attempts):
+                    if i != index:
+                        task.cancel()
+            if owner[0] != index:
+                return
+            # 출력을 받는 대로 완성된 항목 전달
+            for path, item in parser.feed(text):
+                await self._emit_item(on_item, item, path)
+        
+        return on_chunk
+    
+    def _iter_cached_items(self, cached):
+        """캐시된 응답을 스트리밍과 같은 (경로, 항목) 순서로 나열"""
+        for story in cached.get('stories', []):
+            yield ('stories',), story
+        for name, versions in cached.get('characters', {}).items():
+            for version in versions:
+                yield ('characters', name), version
+        for option in cached.get('options', []):
+            yield ('options',), option
+    
+    async def _emit_item(self, on_item, item, path):
+        """항목 콜백 호출 (콜백 오류는 생성에 영향 주지 않음)"""
+        try:
+            result = on_item(item, path)
+            if asyncio.iscoroutine(result):
+                await result
         except Exception as e:
-            print(f"오류 발생: {e}")
+            print(f"항목 콜백 오류: {e}")
+    
+    async def _emit_reset(self, on_reset):
+        """스트리밍 취소 콜백 호출 (콜백 오류는 생성에 영향 주지 않음)"""
+        try:
+            result = on_reset()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            print(f"항목 취소 콜백 오류: {e}")
+    
+    def _check_output(self, returncode, stdout, stderr):
+        """프로세스 종료 코드와 출력 확인"""
+        # 디버깅: stdout과 stderr 모두 출력
+        if stderr:
+            print(f"Claude stderr: {stderr}")
+        
+        if returncode != 0:
+            print(f"Claude Code 실행 오류 (return code: {returncode})")
+            print(f"stderr: {stderr}")
+            print(f"stdout: {stdout[:500]}")
+            return False
+        
+        # 빈 출력 체크
+        if not stdout or stdout.strip() == "":
+            print("Claude가 빈 응답을 반환했습니다.")
+            return False
+        
+        return True
+    
+    def _finish_response(self, result, stdout, stage, allow_dummy=False):
+        """파싱 결과 반환 (실패 시 allow_dummy면 더미 데이터, 아니면 None)"""
+        if result:
+            METRICS.label(outcome='ok')
+            return result
+        
+        print("JSON 파싱 실패")
+        print("전체 출력:")
+        print(stdout[:1000])  # 첫 1000자만 출력
+        
+        if not allow_dummy:
             return None
+        
+        METRICS.label(outcome='dummy')
+        # 더미 데이터 반환 (stories 또는 characters)
+        # (명령어에 항상 들어가는 이름 가이드에 '캐릭터'가 있으므로 단계로 판단)
+        if stage != 'plot':
+            return {
+                "characters": {
+                    "영수": [
+                        {
+                            "version": 1,
+                            "name": "영수",
+                            "gender": "남성",
+                            "age": 35,
+                            "job": "회사원",
+                            "hometown": "서울",
+                            "mbti": "ISTJ",
+                            "mbti_description": "현실주의자형 - 책임감이 강하고 신뢰할 수 있습니다",
+                            "personality_analysis": "임시 성격 분석입니다.",
+                            "trait": "성실함"
+                        },
+                        {
+                            "version": 2,
+                            "name": "영수",
+                            "gender": "남성",
+                            "age": 40,
+                            "job": "공무원",
+                            "hometown": "부산",
+                            "mbti": "ESTJ",
+                            "mbti_description": "경영자형 - 리더십이 강합니다",
+                            "personality_analysis": "임시 성격 분석 2입니다.",
+                            "trait": "리더십"
+                        },
+                        {
+                            "version": 3,
+                            "name": "영수",
+                            "gender": "남성",
+                            "age": 38,
+                            "job": "자영업",
+                            "hometown": "대구",
+                            "mbti": "ENTJ",
+                            "mbti_description": "통솔자형 - 야망이 있습니다",
+                            "personality_analysis": "임시 성격 분석 3입니다.",
+                            "trait": "야심"
+                        }
+                    ]
+                }
+            }
+        else:
+            return {
+                "stories": [
+                    {"title": f"임시 제목 {i+1}", "plot": f"임시 줄거리 {i+1}"} 
+                    for i in range(self.num_stories)
+                ]
+            }
     
     def display_stories(self, stories):
         """스토리 목록 표시"""
@@ -313,6 +723,8 @@ class ClaudeInterface:
         prompt_data = plot_gen.generate()
         
         current_stories = []
+        generation_round = 0
+        seen_references = []  # 이미 보낸 레퍼런스 (재생성 시 제외)
         
         while True:
             # 재생성이 필요한 위치 확인
@@ -323,9 +735,16 @@ class ClaudeInterface:
             
             # 필요한 만큼만 생성
             if positions_to_generate:
-                plot_gen = PlotGen(num=len(positions_to_generate))
-                prompt_data = plot_gen.generate()
+                plot_gen = PlotGen(num=len(positions_to_generate), keywords=self.keywords, exclude=seen_references)
+                # 재현 모드: 라운드마다 시드를 파생해 같은 실행을 그대로 재현
+                round_seed = f"{self.seed}-{generation_round}" if self.seed is not None else None
+                generation_round += 1
+                prompt_data = plot_gen.generate(seed=round_seed)
                 response = self.execute_prompt(prompt_data)
+                # 실제로 프롬프트에 들어간 레퍼런스만 기록 (예산 때문에 빠진 것은 execute_prompt가 제외)
+                if prompt_data['references_reset']:
+                    seen_references.clear()
+                seen_references.extend(prompt_data['reference_ids'])
                 
                 if response and 'stories' in response:
                     # 생성된 스토리를 빈 위치에 채우기
@@ -394,7 +813,16 @@ class ClaudeInterface:
 
 if __name__ == "__main__":
     # Claude 인터페이스 실행
-    claude = ClaudeInterface()
+    # 재현 모드: python claude_interface.py --seed 값 (같은 시드면 캐시된 결과 재사용)
+    seed = None
+    if "--seed" in sys.argv and sys.argv.index("--seed") + 1 < len(sys.argv):
+        seed = sys.argv[sys.argv.index("--seed") + 1]
+    
+    if seed is not None:
+        from response_cache import ResponseCache
+        claude = ClaudeInterface(cache=ResponseCache(), seed=seed)
+    else:
+        claude = ClaudeInterface()
     final_stories = claude.run_interactive()
     
     print("\n" + "="*60)
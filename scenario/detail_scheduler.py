@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import json
+from collections import Counter, defaultdict
+
+from prompt_3_character_detail import CharacterDetailGen, SECTION_DEPENDENCIES
+from scheduler import GenerationScheduler
+
+
+class DetailSectionScheduler:
+    """
+    3단계(캐릭터 상세) 섹션 생성 스케줄러
+
+    섹션 간 의존 관계(SECTION_DEPENDENCIES)에 따라 선행 섹션이 모두 선택된 섹션은 바로 생성하고,
+    서로 의존하지 않는 섹션은 동시에 생성한다.
+    speculate=True면 선행 섹션의 옵션만 나온 상태에서도 가장 많이 선택되는 옵션을 가정해
+    후속 섹션을 백그라운드 우선순위로 미리 생성하고, 사용자가 다른 옵션을 고르면 버린다.
+    가정은 옵션 번호가 아니라 내용으로 비교하고, 버린 생성을 가정한 후속 생성도 함께 버린다.
+    가정이 맞으면 아직 대기 중인 생성은 사용자 요청 우선순위로 올린다.
+    """
+
+    # 섹션별 옵션 선택 횟수 (프로세스 전체 공유, 추측 생성 시 가장 많이 고른 번호 사용)
+    choice_counts = defaultdict(Counter)
+
+    def __init__(self, claude, scheduler, user_id, plot, characters, detail_gen=None, speculate=True):
+        self.claude = claude
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.plot = plot
+        self.characters = characters
+        self.detail_gen = detail_gen or CharacterDetailGen(budget=claude.budget)
+        self.speculate = speculate
+        self.sections = list(self.detail_gen.section_types)
+        self.selections = {}  # 섹션 -> 선택한 옵션
+        self._tasks = {}  # 섹션 -> (가정한 선행 선택, 생성 작업)
+        self.speculative_hits = 0
+        self.speculative_misses = 0
+        self._closed = False
+
+    @staticmethod
+    def _fingerprint(option):
+        """옵션 내용 해시 (다시 생성된 옵션은 번호가 같아도 다르게 구분)"""
+        text = json.dumps(option, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+    def _basis_key(self, basis):
+        """가정한 선행 선택 비교용 키 (섹션, 옵션 내용 해시)"""
+        return tuple(sorted((section, self._fingerprint(option)) for section, option in basis.items()))
+
+    def _confirmed(self, key):
+        """가정한 선행 선택이 모두 실제 선택과 같은지"""
+        return all(
+            section in self.selections and self._fingerprint(self.selections[section]) == fingerprint
+            for section, fingerprint in key
+        )
+
+    def _discard(self, section):
+        """섹션 생성 취소 (그 결과를 가정하고 시작한 후속 섹션 생성도 모두 취소)"""
+        entry = self._tasks.pop(section, None)
+        if entry is None:
+            return
+        entry[1].cancel()
+        for other, (key, _) in list(self._tasks.items()):
+            if other not in self.selections and section in dict(key):
+                self._discard(other)
+
+    def _queue_key(self, section):
+        """섹션별 스케줄러 대기열 (같은 사용자의 다른 섹션으로 대체되지 않도록)"""
+        return (self.user_id, 'detail', section)
+
+    def _options_ready(self, section):
+        """생성이 끝난 섹션의 옵션 목록 (없으면 None)"""
+        entry = self._tasks.get(section)
+        if entry is None or not entry[1].done() or entry[1].cancelled() or entry[1].exception():
+            return None
+        return entry[1].result()
+
+    def _predict(self, section, options):
+        """가장 많이 선택된 번호의 옵션 (기록이 없으면 첫 번째)"""
+        counts = self.choice_counts[section]
+        for number, _ in counts.most_common():
+            for option in options:
+                if option.get('option_number') == number:
+                    return option
+        return options[0]
+
+    def _basis(self, section):
+        """
+        섹션 생성에 쓸 선행 선택 (반환: (선택 dict, 추측 포함 여부), 아직 불가능하면 (None, False))
+        """
+        basis = {}
+        speculative = False
+        for dep in SECTION_DEPENDENCIES.get(section, []):
+            if dep in self.selections:
+                basis[dep] = self.selections[dep]
+                continue
+            options = self._options_ready(dep) if self.speculate else None
+            if not options:
+                return None, False
+            basis[dep] = self._predict(dep, options)
+            speculative = True
+        return basis, speculative
+
+    def schedule(self):
+        """생성 가능한 섹션 모두 시작 (이미 같은 가정으로 생성 중이면 그대로 둠)"""
+        if self._closed:
+            return
+        for section in self.sections:
+            if section in self.selections:
+                continue
+            basis, speculative = self._basis(section)
+            if basis is None:
+                continue
+            current = self._tasks.get(section)
+            if current is not None:
+                current_key, task = current
+                if current_key == self._basis_key(basis):
+                    continue
+                self._discard(section)
+            task = asyncio.ensure_future(self._generate(section, basis))
+            task.add_done_callback(lambda _: self.schedule())
+            self._tasks[section] = (self._basis_key(basis), task)
+            if speculative:
+                print(f"상세 섹션 미리 생성: {section} (가정: {self._basis_key(basis)})")
+
+    async def _generate(self, section, basis):
+        """섹션 하나 생성 (반환: 옵션 목록)"""
+        prompt_data = await asyncio.to_thread(
+            self.detail_gen.generate_section, section, self.plot, self.characters, basis
+        )
+        prompt_data['allow_dummy'] = False  # 실패 시 더미 캐릭터 대신 None
+        # 추측이 남아 있으면 백그라운드 우선순위 (프롬프트를 만드는 동안 확정되었을 수 있으므로 제출 시점에 판단)
+        if self._confirmed(self._basis_key(basis)):
+            priority = GenerationScheduler.INTERACTIVE
+        else:
+            priority = GenerationScheduler.BACKGROUND
+        response = await self.scheduler.submit(
+            self._queue_key(section),
+            lambda: self.claude.execute_prompt_async(prompt_data),
+            priority
+        )
+        options = (response or {}).get('options')
+        if not options:
+            raise RuntimeError(f"{section} 섹션 생성 실패")
+        return options
+
+    async def options(self, section):
+        """섹션 옵션 (현재 선택과 맞는 생성 결과가 나올 때까지 대기)"""
+        while True:
+            self.schedule()
+            entry = self._tasks.get(section)
+            if entry is None:
+                missing = [dep for dep in SECTION_DEPENDENCIES.get(section, []) if dep not in self.selections]
+                raise ValueError(f"{section} 섹션은 먼저 선택이 필요합니다: {', '.join(missing)}")
+            key, task = entry
+            try:
+                options = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if task.cancelled():
+                    # 선택이 바뀌어 다시 생성됨
+                    continue
+                raise
+            if self._tasks.get(section, (None,))[0] == key:
+                return options
+
+    def select(self, section, option):
+        """
+        옵션 선택 (추측으로 미리 생성한 후속 섹션은 선택이 다르면 취소 후 다시 생성, 같으면 우선순위를 올림)
+
+        취소하면 스케줄러가 실행 중인 claude 프로세스도 종료하므로 버린 추측은 슬롯을 차지하지 않는다.
+        """
+        self.selections[section] = option
+        self.choice_counts[section][option.get('option_number')] += 1
+        fingerprint = self._fingerprint(option)
+        for other, (key, task) in list(self._tasks.items()):
+            if other in self.selections or other not in self._tasks:
+                continue
+            assumed = dict(key)
+            if section not in assumed:
+                continue
+            if assumed[section] == fingerprint:
+                self.speculative_hits += 1
+                if self._confirmed(key):
+                    # 추측이 모두 맞았으면 사용자가 기다리는 요청으로 처리
+                    self.scheduler.promote(self._queue_key(other))
+            else:
+                self.speculative_misses += 1
+                self._discard(other)
+        self.schedule()
+
+    def ready(self):
+        """옵션 생성이 끝났고 아직 선택하지 않은 섹션 (선행 선택과 맞는 것만)"""
+        result = []
+        for section in self.sections:
+            if section in self.selections:
+                continue
+            basis, speculative = self._basis(section)
+            if basis is None or speculative:
+                continue
+            entry = self._tasks.get(section)
+            if entry and entry[0] == self._basis_key(basis) and self._options_ready(section):
+                result.append(section)
+        return result
+
+    async def run(self, choose, on_select=None):
+        """
+        모든 섹션을 생성하고 선택 (자동 선택/일괄 생성용)
+
+        choose(section, options): 선택할 옵션을 반환하는 함수
+        on_select(section, option): 선택할 때마다 호출 (중간 저장용)
+        반환: 섹션 -> 선택한 옵션
+        """
+        self.schedule()
+        while len(self.selections) < len(self.sections):
+            # 선행 선택이 끝난 섹션 중 먼저 준비된 것부터 선택
+            pending = [s for s in self.sections if s not in self.selections and self._basis(s)[0] is not None
+                       and not self._basis(s)[1]]
+            if not pending:
+                raise RuntimeError("선택 가능한 섹션이 없습니다")
+            waiters = {asyncio.ensure_future(self.options(s)): s for s in pending}
+            done, rest = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in rest:
+                waiter.cancel()
+            for waiter in done:
+                section = waiters[waiter]
+                option = choose(section, waiter.result())
+                self.select(section, option)
+                if on_select:
+                    on_select(section, option)
+        return {section: self.selections[section] for section in self.sections}
+
+    def cancel(self):
+        """남은 생성 작업 취소"""
+        self._closed = True
+        for _, task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
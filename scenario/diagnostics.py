@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+
+def admin_ids_from_env():
+    """SCENARIO_ADMIN_IDS (쉼표로 구분한 텔레그램 사용자 ID)"""
+    ids = set()
+    for value in os.environ.get('SCENARIO_ADMIN_IDS', '').split(','):
+        value = value.strip()
+        if value:
+            try:
+                ids.add(int(value))
+            except ValueError:
+                print(f"잘못된 관리자 ID 무시: {value}")
+    return ids
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    지정한 스레드의 스택을 주기적으로 샘플링
+
+    함수 호출마다 기록하는 cProfile과 달리 샘플링 스레드만 돌기 때문에 운영 중에도 부하가 작다.
+    결과는 flamegraph 도구에서 읽을 수 있는 folded 형식(스택;스택 횟수)으로 내보낸다.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval  # 샘플링 간격 (초)
+        self.samples = Counter()  # folded 스택 -> 횟수
+        self.started_at = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.elapsed = time.monotonic() - self.started_at
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    @property
+    def total(self):
+        return sum(self.samples.values())
+
+    def folded(self):
+        """flamegraph용 folded 스택"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def top(self, limit=30):
+        """함수별 (포함 샘플 수, 자체 샘플 수) 상위 목록"""
+        inclusive = Counter()
+        own = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for label in set(frames):
+                inclusive[label] += count
+        return [(label, count, own[label]) for label, count in inclusive.most_common(limit)]
+
+
+class Diagnostics:
+    """
+    운영 중인 봇 진단 (관리자 전용 명령에서 사용)
+
+    - CPU: 다음 N번의 핸들러 실행 동안 이벤트 루프 스레드를 샘플링
+    - 메모리: tracemalloc 스냅샷의 상위 할당 위치와 이전/처음 스냅샷 대비 증가량
+    - 작업: 이벤트 루프의 asyncio 작업 목록과 스택
+    결과는 out_dir에 파일로 남기고, 명령에는 요약과 파일 경로만 돌려준다.
+    """
+
+    def __init__(self, out_dir=None, admin_ids=None, interval=0.005, tracemalloc_frames=10):
+        if out_dir is None:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+            out_dir = os.path.join(base_dir, 'diagnostics')
+        self.out_dir = out_dir
+        self.admin_ids = admin_ids if admin_ids is not None else admin_ids_from_env()
+        self.interval = interval
+        self.tracemalloc_frames = tracemalloc_frames  # 할당 위치별로 보관할 스택 깊이
+
+        self._profiler = None
+        self._armed = 0  # 앞으로 측정할 핸들러 실행 수
+        self._profiled_active = 0  # 측정 중인 핸들러 실행 수
+        self._handler_times = []  # (핸들러 이름, 소요 시간)
+        self._baseline = None  # 처음 메모리 스냅샷
+        self._previous = None  # 직전 메모리 스냅샷
+
+    def is_admin(self, user_id):
+        return user_id in self.admin_ids
+
+    def _path(self, kind, ext='txt'):
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return os.path.join(self.out_dir, f"{kind}_{stamp}.{ext}")
+
+    # CPU 프로파일링
+
+    def profile_handlers(self, count):
+        """다음 count번의 핸들러 실행 동안 CPU 샘플링 (이미 측정 중이면 횟수 추가)"""
+        self._armed += max(1, count)
+        return self._armed
+
+    def wrap(self, name, handler):
+        """핸들러 감싸기 (측정 대상이면 샘플링 시작/종료)"""
+        async def wrapped(update, context):
+            profiled = self._handler_started()
+            started = time.monotonic()
+            try:
+                return await handler(update, context)
+            finally:
+                if profiled:
+                    # 버튼 콜백은 어떤 버튼인지 함께 기록
+                    query = getattr(update, 'callback_query', None)
+                    label = f"{name}:{query.data}" if query is not None and query.data else name
+                    self._handler_finished(label, time.monotonic() - started)
+        return wrapped
+
+    def _handler_started(self):
+        if self._armed <= 0:
+            return False
+        self._armed -= 1
+        self._profiled_active += 1
+        if self._profiler is None:
+            self._profiler = SamplingProfiler(interval=self.interval)
+            self._handler_times = []
+            self._profiler.start()
+        return True
+
+    def _handler_finished(self, name, elapsed):
+        self._handler_times.append((name, elapsed))
+        self._profiled_active -= 1
+        if self._armed <= 0 and self._profiled_active <= 0:
+            profiler, self._profiler = self._profiler, None
+            profiler.stop()
+            path = self._write_profile(profiler, self._handler_times)
+            print(f"CPU 프로파일 저장: {path}")
+
+    def _write_profile(self, profiler, handler_times):
+        path = self._path('cpu')
+        with open(path.replace('.txt', '.folded'), 'w', encoding='utf-8') as f:
+            f.write(profiler.folded())
+
+        total = profiler.total or 1
+        lines = [
+            f"CPU 샘플링: {profiler.elapsed:.2f}초, 샘플 {profiler.total}개 (간격 {profiler.interval * 1000:.0f}ms)",
+            f"folded 스택: {os.path.basename(path.replace('.txt', '.folded'))}",
+            "",
+            "핸들러 실행 시간 (초):"
+        ]
+        for name, elapsed in sorted(handler_times, key=lambda item: -item[1]):
+            lines.append(f"  {elapsed:8.3f}  {name}")
+        lines += ["", f"{'포함':>7} {'자체':>7}  함수"]
+        for label, inclusive, own in profiler.top(40):
+            lines.append(f"{inclusive / total:7.1%} {own / total:7.1%}  {label}")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    def profile_status(self):
+        if self._profiler is None and self._armed <= 0:
+            return "CPU 프로파일링 꺼짐"
+        return f"CPU 프로파일링: 측정 중 {self._profiled_active}건, 남은 핸들러 {self._armed}건"
+
+    # 메모리
+
+    def memory_snapshot(self, top=25, sizes=None):
+        """
+        tracemalloc 스냅샷 저장 (반환: (파일 경로, 요약))
+
+        처음 호출하면 추적을 시작하고 기준 스냅샷만 남긴다.
+        sizes: 함께 기록할 구조별 크기 {이름: 개수}
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+            self._baseline = self._previous = self._take_snapshot()
+            return None, "메모리 추적 시작 (다음 실행부터 증가량 비교)"
+
+        snapshot = self._take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        mb = 1024 * 1024
+
+        lines = [f"추적 중인 메모리: 현재 {current / mb:.1f}MB, 최대 {peak / mb:.1f}MB", ""]
+        if sizes:
+            lines.append("구조별 크기:")
+            for name, size in sizes.items():
+                lines.append(f"  {name}: {size}")
+            lines.append("")
+
+        lines.append(f"상위 할당 위치 {top}개:")
+        for stat in snapshot.statistics('lineno')[:top]:
+            lines.append(f"  {stat.size / 1024:10.1f}KB {stat.count:8}개  {stat.traceback}")
+
+        for title, base in (("직전 스냅샷 대비", self._previous), ("처음 스냅샷 대비", self._baseline)):
+            lines += ["", f"{title} 증가량 상위 {top}개:"]
+            for stat in snapshot.compare_to(base, 'lineno')[:top]:
+                lines.append(f"  {stat.size_diff / 1024:+10.1f}KB {stat.count_diff:+8}개  {stat.traceback}")
+
+        lines += ["", "가장 큰 할당 위치의 호출 스택:"]
+        for stat in snapshot.statistics('traceback')[:3]:
+            lines.append(f"  {stat.size / 1024:.1f}KB, {stat.count}개")
+            lines += [f"    {line}" for line in stat.traceback.format()]
+
+        self._previous = snapshot
+        path = self._path('memory')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path, lines[0]
+
+    def _take_snapshot(self):
+        # 추적 자체와 모듈 로딩에 쓰인 메모리는 제외
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+
+    def memory_stop(self):
+        """메모리 추적 종료 (추적 중에는 할당마다 부하가 있음)"""
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._baseline = self._previous = None
+
+    # asyncio 작업
+
+    def dump_tasks(self, stack_limit=15):
+        """이벤트 루프 작업 목록과 스택 저장 (반환: (파일 경로, 요약))"""
+        tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+        kinds = Counter()
+        lines = [f"asyncio 작업 {len(tasks)}개", ""]
+        for task in tasks:
+            coro = task.get_coro()
+            name = getattr(coro, '__qualname__', repr(coro))
+            kinds[name] += 1
+            lines.append(f"[{task.get_name()}] {name} ({'완료' if task.done() else '실행 중'})")
+            buffer = io.StringIO()
+            task.print_stack(limit=stack_limit, file=buffer)
+            lines += [f"    {line}" for line in buffer.getvalue().splitlines()]
+            lines.append("")
+
+        summary = [f"asyncio 작업 {len(tasks)}개"]
+        summary += [f"  {count:5}  {name}" for name, count in kinds.most_common(10)]
+        lines = summary + [""] + lines[2:]
+
+        path = self._path('tasks')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path, '\n'.join(summary)
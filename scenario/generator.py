@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+
+from claude_interface import ClaudeInterface
+from prompt_1_plot import PlotGen
+from character_fanout import CharacterFanout
+from detail_scheduler import DetailSectionScheduler
+from metrics import METRICS
+from response_cache import ResponseCache
+from scheduler import GenerationScheduler
+
+
+def _first(options, rng):
+    return options[0]
+
+
+def _random(options, rng):
+    return rng.choice(options)
+
+
+def _longest(options, rng):
+    # 내용이 가장 풍부한 옵션
+    return max(options, key=lambda option: len(json.dumps(option, ensure_ascii=False)))
+
+
+# 자동 선택 정책: (옵션 목록, rng) -> 선택한 옵션
+SELECTION_POLICIES = {
+    'first': _first,
+    'random': _random,
+    'longest': _longest,
+}
+
+# 캐릭터 상세 프롬프트가 사용하는 필드
+CHARACTER_FIELDS = ['name', 'gender', 'age', 'job', 'mbti', 'trait', 'personality_analysis']
+
+
+def job_identity(job, keywords=None, tone=None):
+    """작업 내용 식별값 (시드, 지정 줄거리 해시, 키워드, 톤; 체크포인트가 같은 작업의 것인지 확인)"""
+    plot = job.get('plot')
+    plot_hash = None
+    if plot:
+        encoded = json.dumps(plot, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        plot_hash = hashlib.sha256(encoded).hexdigest()
+    return {
+        'seed': job.get('seed'),
+        'plot_hash': plot_hash,
+        'keywords': sorted(keywords or []),
+        'tone': tone
+    }
+
+
+class Checkpoint:
+    """
+    시나리오 하나의 단계별 진행 상황 파일 (단계가 끝날 때마다 원자적으로 저장)
+
+    identity를 지정하면 저장된 식별값이 다른 체크포인트(다른 시드/줄거리로 만든 같은 ID)는
+    버리고 처음부터 다시 진행한다.
+    """
+
+    def __init__(self, path, identity=None):
+        self.path = path
+        self.data = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        if identity is not None:
+            if self.data and self.data.get('identity') != identity:
+                print(f"체크포인트가 현재 작업과 다름 (시드/줄거리/키워드/톤 변경), 처음부터 다시 생성: {path}")
+                self.data = {}
+            self.data['identity'] = identity
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.data['updated_at'] = time.time()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def done(self):
+        return self.data.get('status') == 'done'
+
+
+class ScenarioGenerator:
+    """
+    사용자 입력 없이 줄거리 → 캐릭터 → 캐릭터 상세 단계를 자동 선택으로 진행
+
+    단계가 끝날 때마다 체크포인트에 저장하므로 중단된 시나리오는 남은 단계부터 다시 진행한다.
+    """
+
+    def __init__(self, claude=None, scheduler=None, policy='first', keywords=None, tone=None, num_plots=3):
+        if policy not in SELECTION_POLICIES:
+            raise ValueError(f"Unknown selection policy: {policy}")
+        self.claude = claude or ClaudeInterface(cache=ResponseCache())
+        self.scheduler = scheduler or GenerationScheduler()
+        self.policy = SELECTION_POLICIES[policy]
+        self.keywords = keywords or []
+        self.tone = tone
+        self.num_plots = num_plots  # 줄거리 후보 수 (정책으로 하나 선택)
+        self.fanout = CharacterFanout(self.claude, self.scheduler)
+
+    async def _plot(self, job, rng):
+        """줄거리 후보 생성 후 하나 선택"""
+        plot_gen = await asyncio.to_thread(PlotGen, num=self.num_plots, keywords=self.keywords)
+        prompt_data = plot_gen.generate(seed=job.get('seed'))
+        if self.tone:
+            prompt_data['tone'] = self.tone
+        prompt_data['allow_dummy'] = False
+        response = await self.scheduler.submit(
+            (job['id'], 'plot'), lambda: self.claude.execute_prompt_async(prompt_data)
+        )
+        stories = (response or {}).get('stories')
+        if not stories:
+            raise RuntimeError("줄거리 생성 실패")
+        return self.policy(stories, rng)
+
+    async def _characters(self, job, plot, rng):
+        """인물별 분할 생성 후 인물마다 버전 하나 선택"""
+        response = await self.fanout.generate(job['id'], plot)
+        if response is None or response['failed']:
+            # 실패한 인물만 한 번 더 시도
+            if response is not None:
+                for name in list(response['failed']):
+                    versions = await self.fanout.regenerate(job['id'], plot, response['cast'], name)
+                    if versions:
+                        response['characters'][name] = versions
+                        response['failed'].remove(name)
+            if response is None or response['failed']:
+                failed = ', '.join(response['failed']) if response else '인물 목록'
+                raise RuntimeError(f"캐릭터 생성 실패: {failed}")
+
+        characters = []
+        for name, versions in response['characters'].items():
+            character = dict(self.policy(versions, rng))
+            for field in CHARACTER_FIELDS:
+                character.setdefault(field, '')
+            characters.append(character)
+        return characters
+
+    async def run(self, job, checkpoint):
+        """
+        시나리오 하나 생성
+
+        job: {'id': 식별자, 'seed': 시드, 'plot': 지정 줄거리(선택)}
+        """
+        data = checkpoint.data
+        data.setdefault('id', job['id'])
+        data['status'] = 'running'
+        rng = random.Random(job.get('seed'))
+
+        if 'plot' not in data:
+            data['plot'] = job.get('plot') or await self._plot(job, rng)
+            checkpoint.save()
+
+        if 'characters' not in data:
+            data['characters'] = await self._characters(job, data['plot'], rng)
+            checkpoint.save()
+
+        details = data.setdefault('details', {})
+        detail = DetailSectionScheduler(
+            self.claude, self.scheduler, job['id'], data['plot'], data['characters']
+        )
+        # 이미 선택한 섹션 복원
+        for section, option in details.items():
+            detail.select(section, option)
+
+        def on_select(section, option):
+            details[section] = option
+            checkpoint.save()
+
+        try:
+            await detail.run(lambda section, options: self.policy(options, rng), on_select)
+        finally:
+            detail.cancel()
+
+        data['status'] = 'done'
+        data.pop('error', None)
+        checkpoint.save()
+        return data
+
+
+def run_batch(jobs, out_dir, options):
+    """
+    작업 묶음 실행 (프로세스 풀의 작업자 하나에서 호출)
+
+    options: policy, keywords, tone, concurrency(claude 동시 실행 수), scenarios(동시 진행 시나리오 수),
+             cache_dir(응답 캐시 디렉터리, None이면 캐시 사용 안 함)
+    반환: [(작업 id, 'done' 또는 오류 메시지)]
+    
+    시나리오마다 단계별 소요 시간 추적을 <작업 id>.trace.json으로, 작업자 전체 지표를
+    metrics_<pid>.prom(Prometheus 텍스트)으로 저장한다.
+    """
+    async def main():
+        scheduler = GenerationScheduler(max_concurrency=options.get('concurrency', 3))
+        cache_dir = options.get('cache_dir')
+        generator = ScenarioGenerator(
+            claude=ClaudeInterface(cache=ResponseCache(cache_dir) if cache_dir else None),
+            scheduler=scheduler,
+            policy=options.get('policy', 'first'),
+            keywords=options.get('keywords'),
+            tone=options.get('tone')
+        )
+        limit = asyncio.Semaphore(options.get('scenarios', 4))
+
+        async def one(job):
+            async with limit:
+                checkpoint = Checkpoint(os.path.join(out_dir, f"{job['id']}.json"), job['identity'])
+                if checkpoint.done:
+                    return job['id'], 'done'
+                METRICS.bind_session(job['id'])
+                try:
+                    await generator.run(job, checkpoint)
+                    print(f"[{job['id']}] 완료")
+                    return job['id'], 'done'
+                except Exception as e:
+                    checkpoint.data['status'] = 'failed'
+                    checkpoint.data['error'] = str(e)
+                    checkpoint.save()
+                    print(f"[{job['id']}] 실패: {e}")
+                    return job['id'], str(e)
+                finally:
+                    METRICS.dump_trace(job['id'], os.path.join(out_dir, f"{job['id']}.trace.json"))
+
+        await generator.claude.backend.start()
+        try:
+            return await asyncio.gather(*(one(job) for job in jobs))
+        finally:
+            await generator.claude.backend.close()
+
+    results = asyncio.run(main())
+    with open(os.path.join(out_dir, f"metrics_{os.getpid()}.prom"), 'w', encoding='utf-8') as f:
+        f.write(METRICS.prometheus())
+    return results
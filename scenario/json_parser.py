@@ -10,97 +10,66 @@ class RobustJSONParser:
     
     @staticmethod
     def extract_json(text):
-        """텍스트에서 JSON 추출 및 정제"""
+        """텍스트에서 JSON 추출 (첫 {부터 마지막 }까지, 선형 시간)"""
         
-        # 1. JSON 블록 찾기 (여러 패턴 시도)
-        json_patterns = [
-            r'\{[\s\S]*\}',  # 가장 바깥쪽 중괄호
-            r'```json\s*([\s\S]*?)\s*```',  # 마크다운 코드 블록
-            r'```\s*([\s\S]*?)\s*```',  # 일반 코드 블록
-        ]
-        
-        json_str = None
-        for pattern in json_patterns:
-            match = re.search(pattern, text, re.DOTALL)
-            if match:
-                json_str = match.group(1) if match.groups() else match.group(0)
-                break
-        
-        if not json_str:
-            # 마지막 시도: 첫 {부터 마지막 }까지
-            start = text.find('{')
-            end = text.rfind('}')
-            if start != -1 and end != -1 and end > start:
-                json_str = text[start:end+1]
-            else:
-                return None
+        # 정규식 대신 find/rfind로 가장 바깥쪽 중괄호 범위를 찾음
+        # (코드 블록 표시나 앞뒤 설명문은 이 범위 밖에 있으므로 함께 제거됨)
+        start = text.find('{')
+        end = text.rfind('}')
+        if start != -1 and end != -1 and end > start:
+            return text[start:end+1]
         
-        return json_str
+        return None
     
     @staticmethod
     def clean_json(json_str):
-        """JSON 문자열 정제"""
-        
-        # 1. 주석 제거 (//와 /* */ 스타일 모두)
-        # 한 줄 주석 제거
-        json_str = re.sub(r'//.*$', '', json_str, flags=re.MULTILINE)
-        # 여러 줄 주석 제거
-        json_str = re.sub(r'/\*[\s\S]*?\*/', '', json_str)
-        
-        # 2. 마지막 쉼표 제거
-        # 배열의 마지막 쉼표
-        json_str = re.sub(r',\s*\]', ']', json_str)
-        # 객체의 마지막 쉼표
-        json_str = re.sub(r',\s*\}', '}', json_str)
-        
-        # 3. 제어 문자 제거
-        json_str = json_str.replace('\t', '    ')  # 탭을 공백으로
-        json_str = json_str.replace('\r\n', '\n')  # Windows 줄바꿈
-        json_str = json_str.replace('\r', '\n')    # Mac 줄바꿈
-        
-        # 4. 문자열 내부의 이스케이프되지 않은 따옴표 처리
-        # 문자열 내부의 따옴표를 찾아서 이스케이프
-        def escape_quotes(match):
-            content = match.group(1)
-            # 이미 이스케이프된 것은 제외하고 처리
-            content = re.sub(r'(?<!\\)"', r'\"', content)
-            return f'"{content}"'
-        
-        # "..." 패턴의 문자열 찾기 (multiline 지원)
-        json_str = re.sub(r'"((?:[^"\\]|\\.)*)?"', escape_quotes, json_str, flags=re.DOTALL)
-        
-        # 5. 줄바꿈 처리
-        # JSON 문자열 내부의 실제 줄바꿈을 \n으로 변환
-        def fix_newlines(match):
-            content = match.group(1)
-            content = content.replace('\n', '\\n')
-            return f'"{content}"'
+        """
+        JSON 문자열 정제 (한 번의 스캔으로 처리)
         
-        json_str = re.sub(r'"([^"]*)"', fix_newlines, json_str)
-        
-        # 6. BOM 제거
-        json_str = json_str.lstrip('\ufeff')
-        
-        # 7. 앞뒤 공백 제거
-        json_str = json_str.strip()
-        
-        return json_str
+        - 루트 객체 앞뒤의 텍스트 제거 (BOM, 코드 블록 표시 포함)
+        - 주석 제거 (//와 /* */ 스타일 모두, 문자열 내부는 유지)
+        - 마지막 쉼표 제거
+        - 문자열 내부의 실제 줄바꿈/탭 이스케이프
+        - 문자열 내부의 이스케이프되지 않은 따옴표 이스케이프
+        """
+        parser = IncrementalJSONParser(targets=())
+        parser.feed(json_str)
+        parser.close()
+        return parser.text().strip()
     
     @staticmethod
     def parse(text):
         """텍스트에서 JSON을 추출하고 파싱"""
+        return RobustJSONParser.parse_with_path(text)[0]
+    
+    @staticmethod
+    def parse_with_path(text):
+        """
+        파싱 결과와 거친 경로 반환
+        
+        경로: direct(바로 파싱), cleaned(정제 후 파싱), salvaged(완성된 항목만 복구),
+              regex(정규식 복구), failed(실패)
+        """
+        
+        # 0. 빠른 경로: 이미 유효한 JSON이면 정제 없이 바로 반환
+        stripped = text.strip()
+        if stripped.startswith('{'):
+            try:
+                return json.loads(stripped), 'direct'
+            except ValueError:
+                pass
         
         # 1. JSON 추출
         json_str = RobustJSONParser.extract_json(text)
         if not json_str:
-            return None
+            return None, 'failed'
         
         # 2. JSON 정제
         json_str = RobustJSONParser.clean_json(json_str)
         
         # 3. 파싱 시도
         try:
-            return json.loads(json_str)
+            return json.loads(json_str), 'cleaned'
         except json.JSONDecodeError as e:
             # 오류 위치 근처 출력 (디버깅용)
             error_line = e.lineno
@@ -119,13 +88,23 @@ class RobustJSONParser:
                     print(f"{marker}{i+1}: {lines[i]}")
             
             # 추가 복구 시도
-            return RobustJSONParser.recover_json(json_str)
+            return RobustJSONParser.recover_json_with_path(json_str)
     
     @staticmethod
     def recover_json(json_str):
         """JSON 복구 시도"""
+        return RobustJSONParser.recover_json_with_path(json_str)[0]
+    
+    @staticmethod
+    def recover_json_with_path(json_str):
+        """JSON 복구 시도 (결과, 경로)"""
+        
+        # 1. 완성된 항목만 건져내기 (출력이 중간에 잘린 경우 등)
+        salvaged = RobustJSONParser.salvage_items(json_str)
+        if salvaged:
+            return salvaged, 'salvaged'
         
-        # 1. 가장 간단한 형태로 시도
+        # 2. 가장 간단한 형태로 시도
         try:
             # stories 배열만 추출
             stories_match = re.search(r'"stories"\s*:\s*\[([\s\S]*?)\]', json_str)
@@ -145,11 +124,351 @@ class RobustJSONParser:
                     })
                 
                 if stories:
-                    return {"stories": stories}
+                    return {"stories": stories}, 'regex'
         except:
             pass
         
-        return None
+        return None, 'failed'
+    
+    @staticmethod
+    def salvage_items(json_str):
+        """전체 파싱이 안 될 때 닫힌 항목(stories, characters, options)만 모아서 반환"""
+        parser = IncrementalJSONParser()
+        events = parser.feed(json_str)
+        events += parser.close()
+        
+        salvaged = {}
+        for path, item in events:
+            if path == ('stories',) or path == ('options',):
+                salvaged.setdefault(path[0], []).append(item)
+            elif path[0] == 'characters':
+                salvaged.setdefault('characters', {}).setdefault(path[1], []).append(item)
+        
+        return salvaged or None
+
+
+class IncrementalJSONParser:
+    """
+    청크 단위로 입력받아 배열 항목이 닫히는 즉시 내보내는 푸시 방식 파서
+
+    clean_json이 처리하는 결함(주석, 마지막 쉼표, 문자열 내 줄바꿈,
+    이스케이프되지 않은 따옴표)을 읽는 동안 바로 정제하고,
+    정제된 텍스트로 각 항목을 파싱한다. 모든 처리는 입력 길이에 선형이다.
+    """
+
+    # 항목을 내보낼 배열 경로 ('*'는 임의의 키)
+    DEFAULT_TARGETS = (
+        ('stories',),
+        ('characters', '*'),
+        ('options',),
+    )
+
+    # 문자열 안에서 특별히 처리해야 하는 문자
+    _STRING_SPECIAL = re.compile(r'[\\"\x00-\x1f]')
+
+    # 문자열 안의 제어 문자 이스케이프
+    _CONTROL_ESCAPES = {'\n': '\\n', '\t': '\\t', '\r': ''}
+
+    def __init__(self, targets=DEFAULT_TARGETS):
+        self.targets = [tuple(t) for t in targets]
+        self._out = []  # 정제된 출력 조각
+        self._stack = []  # 열린 컨테이너: {'type', 'key', 'expect', 'start'}
+        self._started = False  # 루트 '{'를 만났는지
+        self.finished = False  # 루트 객체가 닫혔는지
+
+        self._in_string = False
+        self._escape = False
+        self._key_start = None  # 키 문자열 시작 위치 (출력 기준)
+
+        self._comment = None  # None, 'line', 'block'
+        self._pending_slash = False  # 문자열 밖에서 '/'를 읽고 다음 문자 대기
+        self._pending_star = False  # 블록 주석 안에서 '*'를 읽고 다음 문자 대기
+        self._pending_comma = None  # 보류 중인 쉼표 뒤 공백 (None이면 보류 없음)
+
+        # 문자열 안에서 따옴표를 만났을 때 닫는 따옴표인지 판단하기 위한 상태
+        self._quote_state = None  # None, 'after_quote', 'after_comma'
+        self._quote_buffer = ''  # 판단을 위해 미리 읽은 문자
+
+        self.items_emitted = 0
+
+    def feed(self, chunk):
+        """청크를 추가하고 새로 완성된 (경로, 항목) 목록 반환"""
+        events = []
+        pos = 0
+        length = len(chunk)
+
+        while pos < length and not self.finished:
+            if self._quote_state is not None:
+                decision = self._quote_lookahead(chunk[pos])
+                if decision is None:
+                    self._quote_buffer += chunk[pos]
+                    pos += 1
+                    continue
+
+                # 판단 결과에 따라 따옴표를 처리한 뒤 미리 읽은 문자(공백, 쉼표)를 다시 처리
+                # (남은 청크를 복사하지 않아야 따옴표가 많아도 선형 시간 유지)
+                rest = self._quote_buffer
+                self._quote_state = None
+                self._quote_buffer = ''
+                if decision:
+                    self._end_string()
+                else:
+                    self._out.append('\\"')
+                if rest:
+                    events += self.feed(rest)
+                continue
+
+            if self._in_string:
+                pos = self._consume_string(chunk, pos)
+                continue
+
+            c = chunk[pos]
+            pos += 1
+
+            if not self._started:
+                # 루트 객체 이전의 설명문, 코드 블록 표시 등은 무시
+                if c == '{':
+                    self._started = True
+                    self._open('{')
+                continue
+
+            if self._comment is not None:
+                self._consume_comment(c)
+                continue
+
+            if self._pending_slash:
+                self._pending_slash = False
+                if c == '/':
+                    self._comment = 'line'
+                    continue
+                if c == '*':
+                    self._comment = 'block'
+                    continue
+                self._write('/')
+
+            if c == '/':
+                self._pending_slash = True
+                continue
+
+            if c in ' \t\r\n':
+                if self._pending_comma is not None:
+                    self._pending_comma += c
+                else:
+                    self._out.append(c)
+                continue
+
+            # 의미 있는 문자: 보류 중인 쉼표 처리 (닫는 괄호 앞이면 버림)
+            if self._pending_comma is not None:
+                whitespace = self._pending_comma
+                self._pending_comma = None
+                if c not in '}]':
+                    self._out.append(',')
+                self._out.append(whitespace)
+
+            if c == ',':
+                self._pending_comma = ''
+                if self._stack and self._stack[-1]['type'] == '{':
+                    self._stack[-1]['expect'] = 'key'
+                continue
+
+            if c == ':':
+                self._out.append(c)
+                if self._stack:
+                    self._stack[-1]['expect'] = 'value'
+                continue
+
+            if c == '"':
+                self._start_string()
+                continue
+
+            if c in '{[':
+                self._open(c)
+                continue
+
+            if c in '}]':
+                event = self._close(c)
+                if event:
+                    events.append(event)
+                continue
+
+            self._out.append(c)
+
+        return events
+
+    def _write(self, text):
+        """보류 중인 쉼표를 먼저 내보낸 뒤 쓰기"""
+        if self._pending_comma is not None:
+            self._out.append(',' + self._pending_comma)
+            self._pending_comma = None
+        self._out.append(text)
+
+    def _consume_comment(self, c):
+        """주석 내용 건너뛰기"""
+        if self._comment == 'line':
+            if c == '\n':
+                self._comment = None
+                self._out.append(c)
+        else:
+            if self._pending_star and c == '/':
+                self._comment = None
+            self._pending_star = (c == '*')
+
+    def _start_string(self):
+        """문자열 시작 (객체에서 키 자리면 키 위치 기록)"""
+        top = self._stack[-1] if self._stack else None
+        if top is not None and top['type'] == '{' and top['expect'] == 'key':
+            self._key_start = len(self._out)
+        else:
+            self._key_start = None
+        self._out.append('"')
+        self._in_string = True
+        self._escape = False
+
+    def _consume_string(self, chunk, pos):
+        """문자열 내용 처리, 다음 위치 반환"""
+        if self._escape:
+            self._escape = False
+            self._out.append(chunk[pos])
+            return pos + 1
+
+        # 특수 문자가 나올 때까지는 한 번에 복사
+        match = self._STRING_SPECIAL.search(chunk, pos)
+        end = match.start() if match else len(chunk)
+        if end > pos:
+            self._out.append(chunk[pos:end])
+        if not match:
+            return end
+
+        c = chunk[end]
+        if c == '\\':
+            self._escape = True
+            self._out.append(c)
+        elif c == '"':
+            # 닫는 따옴표인지 문자열 안의 따옴표인지는 뒤따르는 문자로 판단
+            self._quote_state = 'after_quote'
+        else:
+            # 문자열 안의 실제 줄바꿈, 탭 등 제어 문자
+            self._out.append(self._CONTROL_ESCAPES.get(c, '\\u%04x' % ord(c)))
+        return end + 1
+
+    def _quote_lookahead(self, c):
+        """
+        문자열 안의 따옴표 뒤 문자로 닫는 따옴표 여부 판단
+
+        True: 닫는 따옴표, False: 문자열 안의 따옴표, None: 더 읽어야 함
+        """
+        if c in ' \t\r\n':
+            return None
+
+        is_key = self._key_start is not None
+        in_object = self._stack and self._stack[-1]['type'] == '{'
+
+        if self._quote_state == 'after_quote':
+            if c == ':':
+                return is_key
+            if c in '}]/':
+                return True
+            if c == ',' and not is_key:
+                self._quote_state = 'after_comma'
+                return None
+            return False
+
+        # 쉼표 뒤: 다음 키/값이나 주석이 시작되면 닫는 따옴표
+        if c == '/':
+            return True
+        if in_object:
+            return c in '"}'
+        return c in '"{[]-0123456789tfn'
+
+    def _end_string(self):
+        """문자열 종료 (키였으면 현재 키로 기록)"""
+        self._out.append('"')
+        self._in_string = False
+        if self._key_start is not None:
+            raw = ''.join(self._out[self._key_start:])
+            try:
+                self._stack[-1]['key'] = json.loads(raw)
+            except ValueError:
+                self._stack[-1]['key'] = raw.strip('"')
+            self._key_start = None
+
+    def _open(self, c):
+        """컨테이너 열기"""
+        self._stack.append({
+            'type': c,
+            'key': None,
+            'expect': 'key' if c == '{' else 'value',
+            'start': len(self._out)
+        })
+        self._out.append(c)
+
+    def _close(self, c):
+        """컨테이너 닫기, 대상 배열의 항목이면 (경로, 항목) 반환"""
+        self._out.append(c)
+        if not self._stack:
+            return None
+
+        container = self._stack.pop()
+        if not self._stack:
+            self.finished = True
+            return None
+
+        if not self.targets:
+            return None
+
+        # 대상 배열 바로 아래의 객체만 항목으로 취급
+        if c != '}' or self._stack[-1]['type'] != '[':
+            return None
+
+        path = self._array_path()
+        if not self._matches(path):
+            return None
+
+        try:
+            item = json.loads(''.join(self._out[container['start']:]))
+        except ValueError:
+            return None
+
+        self.items_emitted += 1
+        return path, item
+
+    def _array_path(self):
+        """현재 배열까지의 키 경로 (배열 단계는 건너뜀)"""
+        return tuple(
+            entry['key'] for entry in self._stack[:-1]
+            if entry['type'] == '{'
+        )
+
+    def _matches(self, path):
+        for target in self.targets:
+            if len(target) == len(path) and all(t == '*' or t == p for t, p in zip(target, path)):
+                return True
+        return False
+
+    def close(self):
+        """입력 종료 처리 (판단 보류 중인 따옴표는 닫는 따옴표로 처리)"""
+        events = []
+        if self._quote_state is not None:
+            rest = self._quote_buffer
+            self._quote_state = None
+            self._quote_buffer = ''
+            self._end_string()
+            events = self.feed(rest)
+        self._pending_comma = None
+        return events
+
+    def text(self):
+        """지금까지 정제된 JSON 텍스트"""
+        return ''.join(self._out)
+
+    def result(self):
+        """루트 객체가 완성되었으면 전체 파싱 결과, 아니면 None"""
+        if not self.finished:
+            return None
+        try:
+            return json.loads(self.text())
+        except ValueError:
+            return None
 
 
 # claude_interface.py에 통합할 함수
@@ -0,0 +1,692 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import codecs
+import contextvars
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import time
+from collections import deque
+
+from metrics import METRICS
+from response_cache import cache_key
+
+
+class LLMTimeout(Exception):
+    """마감 시간 안에 끝나지 않아 중단된 실행"""
+
+
+class LLMBackend:
+    """
+    LLM 실행 방식 공통 인터페이스
+
+    run/run_async 모두 (종료 코드, stdout, stderr)를 반환한다.
+    run_async의 on_chunk를 지정하면 stdout을 받는 대로 await on_chunk(text)로 전달한다.
+    stage는 plot, character, cast, character_one, detail 중 하나 (가짜 응답 선택 등에 사용)
+    timeout(초)을 넘기면 실행을 중단하고 LLMTimeout을 발생시킨다.
+    cache_namespace: 실제 claude 응답이 아니면 응답 캐시 키를 분리할 이름 (None이면 실제 응답)
+    """
+
+    name = 'base'
+    cache_namespace = None
+
+    def run(self, command, stage=None, timeout=None):
+        raise NotImplementedError
+
+    async def run_async(self, command, stage=None, on_chunk=None, timeout=None):
+        raise NotImplementedError
+
+    async def start(self):
+        """이벤트 루프 시작 후 준비 (미리 띄워 둘 프로세스 등)"""
+
+    async def close(self):
+        """종료 시 정리"""
+
+
+def _timeout_error(stage, timeout):
+    return LLMTimeout(f"{stage or 'LLM'} 응답 시간 초과 ({timeout:.0f}초)")
+
+
+class CLIBackend(LLMBackend):
+    """claude CLI 실행 (프롬프트는 stdin으로 전달)"""
+
+    name = 'cli'
+
+    def __init__(self, executable='claude', args=()):
+        self.executable = executable
+        self.args = list(args)
+
+    def run(self, command, stage=None, timeout=None):
+        with METRICS.span('spawn'):
+            process = subprocess.Popen(
+                [self.executable] + self.args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding='utf-8'
+            )
+        try:
+            stdout, stderr = process.communicate(input=command, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # 멈춘 프로세스는 종료하고 파이프 정리
+            process.kill()
+            process.communicate()
+            raise _timeout_error(stage, timeout)
+        return process.returncode, stdout, stderr
+
+    async def run_async(self, command, stage=None, on_chunk=None, timeout=None):
+        with METRICS.span('spawn'):
+            process = await asyncio.create_subprocess_exec(
+                self.executable, *self.args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        try:
+            return await asyncio.wait_for(self._communicate(process, command, on_chunk), timeout)
+        except asyncio.TimeoutError:
+            raise _timeout_error(stage, timeout)
+        finally:
+            # 마감 초과 또는 취소(헤지 요청에서 진 쪽 등)면 프로세스 종료
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+
+    async def _communicate(self, process, command, on_chunk):
+        if on_chunk is None:
+            stdout_bytes, stderr_bytes = await process.communicate(input=command.encode('utf-8'))
+            return (
+                process.returncode,
+                stdout_bytes.decode('utf-8', errors='replace'),
+                stderr_bytes.decode('utf-8', errors='replace')
+            )
+
+        # stdout을 조금씩 읽으면서 바로 전달
+        process.stdin.write(command.encode('utf-8'))
+        await process.stdin.drain()
+        process.stdin.close()
+
+        # stderr는 별도로 읽어서 파이프가 가득 차 멈추는 것을 방지
+        stderr_task = asyncio.ensure_future(process.stderr.read())
+        try:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            chunks = []
+            while True:
+                data = await process.stdout.read(4096)
+                if not data:
+                    break
+                text = decoder.decode(data)
+                chunks.append(text)
+                await on_chunk(text)
+            chunks.append(decoder.decode(b'', final=True))
+
+            await process.wait()
+            stderr_bytes = await stderr_task
+        finally:
+            stderr_task.cancel()
+        return process.returncode, "".join(chunks), stderr_bytes.decode('utf-8', errors='replace')
+
+
+# 워커 한 줄 출력 최대 크기 (result 이벤트에 전체 응답이 한 줄로 들어옴)
+WORKER_LINE_LIMIT = 16 * 1024 * 1024
+
+
+class _Worker:
+    """대기 중인 claude 프로세스 하나"""
+
+    def __init__(self, process):
+        self.process = process
+        self.requests = 0  # 처리한 프롬프트 수
+        self.idle_since = time.monotonic()
+        self.stderr = deque(maxlen=50)  # 최근 stderr 줄
+        self.stderr_task = asyncio.ensure_future(self._drain_stderr())
+
+    async def _drain_stderr(self):
+        # 파이프가 가득 차 멈추지 않도록 계속 읽어 둠
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                return
+            self.stderr.append(line.decode('utf-8', errors='replace'))
+
+    @property
+    def alive(self):
+        return self.process.returncode is None and not self.process.stdin.is_closing()
+
+    async def close(self):
+        if self.alive:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+        await self.process.wait()
+        self.stderr_task.cancel()
+
+
+class WorkerPoolBackend(LLMBackend):
+    """
+    미리 띄워 둔 claude 프로세스로 실행 (요청마다 프로세스 시작/인증/설정 로딩을 기다리지 않음)
+
+    워커는 stream-json 입출력으로 프롬프트를 받고 한 줄씩 이벤트를 내보낸다.
+    사용 중인 워커도 size에 포함하고, 교체된 워커의 빈자리만 바로 다시 띄워 둔다
+    (동시 요청이 size를 넘을 때만 요청 시점에 새로 띄움).
+    요청을 마친 워커는 /clear로 대화를 비우고, 그 응답(result 이벤트)이 reset_timeout 안에 와야
+    대기열로 돌아간다 (앞 프롬프트가 다음 생성에 섞이지 않고, 멈춘 워커는 재사용하지 않음).
+    워커는 max_requests를 채우거나, 오류/시간 초과/취소가 나거나, 비우기에 실패하거나,
+    max_idle 이상 놀았거나, 죽어 있으면 교체한다.
+    동기 run은 이벤트 루프 밖이므로 매번 새 프로세스로 실행한다.
+    """
+
+    name = 'pool'
+
+    def __init__(self, size=2, max_requests=50, max_idle=600, reset_timeout=10.0,
+                 executable='claude', args=()):
+        self.size = size  # 미리 띄워 둘 워커 수
+        self.max_requests = max_requests  # 워커 하나가 처리할 최대 프롬프트 수
+        self.max_idle = max_idle  # 이보다 오래 논 워커는 교체 (초)
+        self.reset_timeout = reset_timeout  # /clear 응답 대기 시간 (초)
+        self.executable = executable
+        self.args = list(args)
+        self._oneshot = CLIBackend(executable, args)
+        self._idle = []  # 대기 중인 워커
+        self._starting = 0  # 띄우는 중인 워커 수
+        self._resetting = set()  # 대화를 비우는 중인 워커
+        self._busy = 0  # 요청을 처리 중인 워커 수
+        self._loop = None
+
+    def _command(self):
+        return [
+            self.executable, '-p',
+            '--input-format', 'stream-json',
+            '--output-format', 'stream-json',
+            '--include-partial-messages',
+            '--verbose'
+        ] + self.args
+
+    async def _spawn(self):
+        process = await asyncio.create_subprocess_exec(
+            *self._command(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=WORKER_LINE_LIMIT
+        )
+        METRICS.count('llm_workers_started_total')
+        return _Worker(process)
+
+    async def start(self):
+        """빈자리만큼 워커 띄우기"""
+        self._check_loop()
+        missing = self.size - len(self._idle) - self._starting - len(self._resetting) - self._busy
+        for _ in range(max(0, missing)):
+            self._starting += 1
+            # 요청 추적에 섞이지 않도록 빈 컨텍스트에서 실행
+            contextvars.Context().run(asyncio.ensure_future, self._start_one())
+
+    async def _start_one(self):
+        try:
+            self._idle.append(await self._spawn())
+        except Exception as e:
+            print(f"LLM 워커 시작 실패: {e}")
+        finally:
+            self._starting -= 1
+
+    def _check_loop(self):
+        # 다른 이벤트 루프(asyncio.run을 다시 호출한 경우 등)의 워커는 쓸 수 없음
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            for worker in self._idle + list(self._resetting):
+                try:
+                    worker.process.kill()
+                except (ProcessLookupError, RuntimeError):
+                    pass
+            self._idle = []
+            self._starting = 0
+            self._resetting = set()
+            self._busy = 0
+            self._loop = loop
+
+    async def _acquire(self):
+        """쓸 수 있는 워커 가져오기 (대기 중인 워커가 없으면 새로 띄움)"""
+        self._check_loop()
+        while self._idle:
+            worker = self._idle.pop()
+            if not worker.alive:
+                self._recycle(worker, 'dead')
+            elif time.monotonic() - worker.idle_since > self.max_idle:
+                self._recycle(worker, 'idle')
+            else:
+                METRICS.count('llm_worker_acquires_total', warm='true')
+                self._busy += 1
+                return worker
+        METRICS.count('llm_worker_acquires_total', warm='false')
+        with METRICS.span('spawn'):
+            worker = await self._spawn()
+        self._busy += 1
+        return worker
+
+    def _release(self, worker, reusable):
+        """요청을 마친 워커 반납 (재사용할 수 없으면 종료)"""
+        self._busy -= 1
+        if not worker.alive:
+            self._recycle(worker, 'dead')
+        elif not reusable:
+            self._recycle(worker, 'error')
+        elif worker.requests >= self.max_requests:
+            self._recycle(worker, 'max_requests')
+        else:
+            self._resetting.add(worker)
+            contextvars.Context().run(asyncio.ensure_future, self._reset(worker))
+
+    async def _reset(self, worker):
+        """대화를 비우고 응답을 확인한 워커만 대기열로 돌려놓기"""
+        try:
+            cleared = await asyncio.wait_for(self._clear(worker), self.reset_timeout)
+        except asyncio.TimeoutError:
+            cleared = False
+        finally:
+            self._resetting.discard(worker)
+
+        if worker.process.returncode is not None and not cleared:
+            self._recycle(worker, 'dead')
+        elif not cleared:
+            self._recycle(worker, 'reset')
+        elif len(self._idle) >= self.size:
+            # 사용 중에 빈자리를 새로 띄워 두었으므로 남는 워커
+            self._recycle(worker, 'surplus')
+        else:
+            worker.idle_since = time.monotonic()
+            self._idle.append(worker)
+
+    async def _clear(self, worker):
+        """/clear를 보내고 result 이벤트까지 읽기 (성공하면 True)"""
+        message = {'type': 'user', 'message': {'role': 'user', 'content': '/clear'}}
+        try:
+            worker.process.stdin.write((json.dumps(message) + '\n').encode('utf-8'))
+            await worker.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            return False
+        while True:
+            line = await worker.process.stdout.readline()
+            if not line:
+                return False
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get('type') == 'result':
+                return not event.get('is_error')
+
+    def _recycle(self, worker, reason):
+        if reason not in ('max_requests', 'surplus'):
+            print(f"LLM 워커 교체 ({reason}, {worker.requests}건 처리)")
+        METRICS.count('llm_worker_recycles_total', reason=reason)
+        contextvars.Context().run(asyncio.ensure_future, worker.close())
+        if reason != 'surplus':
+            # 빈자리 다시 띄우기
+            contextvars.Context().run(asyncio.ensure_future, self.start())
+
+    async def close(self):
+        idle, self._idle = self._idle + list(self._resetting), []
+        self._resetting = set()
+        await asyncio.gather(*(worker.close() for worker in idle), return_exceptions=True)
+
+    def run(self, command, stage=None, timeout=None):
+        return self._oneshot.run(command, stage, timeout)
+
+    async def run_async(self, command, stage=None, on_chunk=None, timeout=None):
+        worker = await self._acquire()
+        reusable = False
+        try:
+            result = await asyncio.wait_for(self._request(worker, command, on_chunk), timeout)
+            reusable = result[0] == 0
+            return result
+        except asyncio.TimeoutError:
+            raise _timeout_error(stage, timeout)
+        finally:
+            # 시간 초과/취소된 워커는 응답 도중이라 재사용하지 않음
+            self._release(worker, reusable)
+
+    async def _request(self, worker, command, on_chunk):
+        """프롬프트 한 줄을 보내고 result 이벤트까지 읽기"""
+        worker.requests += 1
+        message = {'type': 'user', 'message': {'role': 'user', 'content': command}}
+        try:
+            worker.process.stdin.write((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+            await worker.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            await worker.process.wait()
+            return 1, "", "LLM 워커가 종료되어 있습니다.\n" + "".join(worker.stderr)
+
+        chunks = []
+        partial = False  # 부분 출력(stream_event)을 받았으면 assistant 전체 메시지는 무시
+        while True:
+            line = await worker.process.stdout.readline()
+            if not line:
+                # 응답 도중 워커 종료
+                await worker.process.wait()
+                return worker.process.returncode or 1, "".join(chunks), "".join(worker.stderr)
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+
+            kind = event.get('type')
+            text = None
+            if kind == 'stream_event':
+                delta = event.get('event', {}).get('delta', {})
+                if delta.get('type') == 'text_delta':
+                    partial = True
+                    text = delta.get('text', '')
+            elif kind == 'assistant' and not partial:
+                content = event.get('message', {}).get('content', [])
+                text = "".join(block.get('text', '') for block in content if block.get('type') == 'text')
+            elif kind == 'result':
+                result = event.get('result')
+                stdout = result if isinstance(result, str) else "".join(chunks)
+                if event.get('is_error') or event.get('subtype') != 'success':
+                    return 1, stdout, f"LLM 워커 오류: {event.get('subtype')}\n" + "".join(worker.stderr)
+                return 0, stdout, ""
+
+            if text:
+                chunks.append(text)
+                if on_chunk:
+                    await on_chunk(text)
+
+
+def _canned_stories(command, rng):
+    match = re.search(r'이야기 (\d+)개', command)
+    count = int(match.group(1)) if match else 5
+    return {"stories": [
+        {"title": f"가짜 제목 {rng.randint(1000, 9999)}",
+         "plot": f"영수와 옥순의 갈등을 그린 가짜 줄거리 {i + 1}. 테스트용으로 생성된 내용입니다."}
+        for i in range(count)
+    ]}
+
+
+def _canned_version(name, gender, version, rng):
+    mbti = rng.choice(["ISTJ", "ESTJ", "ENFP", "INFP", "ESFP", "INTJ"])
+    return {
+        "version": version,
+        "name": name,
+        "gender": gender,
+        "age": rng.randint(25, 60),
+        "job": rng.choice(["회사원", "교사", "자영업", "간호사", "공무원"]),
+        "hometown": rng.choice(["서울", "부산", "대구", "광주"]),
+        "mbti": mbti,
+        "mbti_description": f"{mbti} 가짜 설명",
+        "personality_analysis": "테스트용 성격 분석입니다.",
+        "trait": "테스트용 특징"
+    }
+
+
+def _canned_cast(command, rng):
+    return {"cast": [
+        {"name": "영수", "gender": "남성", "role": "남편"},
+        {"name": "옥순", "gender": "여성", "role": "아내"}
+    ]}
+
+
+def _canned_character_one(command, rng):
+    match = re.search(r"'([^']+)'의 설정", command)
+    name = match.group(1) if match else "영수"
+    return {"versions": [_canned_version(name, "", i, rng) for i in range(1, 4)]}
+
+
+def _canned_characters(command, rng):
+    return {"characters": {
+        name: [_canned_version(name, gender, i, rng) for i in range(1, 4)]
+        for name, gender in (("영수", "남성"), ("옥순", "여성"))
+    }}
+
+
+def _canned_options(command, rng):
+    return {"options": [
+        {"option_number": i, "title": f"가짜 옵션 {i}", "description": "테스트용 옵션 설명"}
+        for i in range(1, 4)
+    ]}
+
+
+# 단계별 기본 가짜 응답 (command, rng) -> dict
+CANNED_OUTPUTS = {
+    'plot': _canned_stories,
+    'cast': _canned_cast,
+    'character_one': _canned_character_one,
+    'character': _canned_characters,
+    'detail': _canned_options,
+}
+
+
+def _malform(text, rng):
+    """JSON 깨뜨리기 (일부는 복구 가능, 일부는 불가능)"""
+    kind = rng.choice(['truncate', 'trailing_comma', 'prose', 'comment', 'newline'])
+    if kind == 'truncate':
+        return text[:rng.randint(1, max(1, len(text) - 1))]
+    if kind == 'trailing_comma':
+        return text.replace('}]', '},]', 1)
+    if kind == 'prose':
+        return f"다음은 요청하신 결과입니다:\n```json\n{text}\n```\n도움이 되었으면 좋겠습니다."
+    if kind == 'comment':
+        return text.replace('[', '[ // 결과 목록\n', 1)
+    return text.replace('. ', '.\n', 1)
+
+
+# 멈춘 프로세스를 흉내 낼 때의 응답 시간 (초)
+HANG_SECONDS = 24 * 3600
+
+
+class FakeBackend(LLMBackend):
+    """
+    네트워크 없이 동작하는 가짜 LLM (성능 측정/테스트용)
+
+    latency: 응답 시간 중앙값 (초), latency_sigma: 로그정규분포 폭
+    failure_rate: 종료 코드 1로 실패할 확률, malformed_rate: JSON을 깨뜨릴 확률
+    hang_rate: 응답 없이 멈출 확률 (timeout이 있으면 그 시간 뒤 LLMTimeout)
+    outputs: 단계별 응답 (문자열, dict, 또는 (command, rng) -> dict 함수), 없으면 CANNED_OUTPUTS
+    """
+
+    name = 'fake'
+    cache_namespace = 'fake'
+
+    def __init__(self, latency=1.0, latency_sigma=0.3, ttfb_ratio=0.3, failure_rate=0.0,
+                 malformed_rate=0.0, outputs=None, seed=None, chunk_size=80, hang_rate=0.0):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.ttfb_ratio = ttfb_ratio  # 전체 응답 시간 중 첫 출력까지의 비율
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.hang_rate = hang_rate
+        self.outputs = dict(CANNED_OUTPUTS)
+        self.outputs.update(outputs or {})
+        self.rng = random.Random(seed)
+        self.chunk_size = chunk_size
+        self.calls = 0
+
+    def _plan(self, command, stage):
+        """(응답 시간, 종료 코드, stdout, stderr)"""
+        self.calls += 1
+        rng = self.rng
+        if self.latency > 0:
+            latency = rng.lognormvariate(math.log(self.latency), self.latency_sigma)
+        else:
+            latency = 0.0
+        if rng.random() < self.hang_rate:
+            latency = HANG_SECONDS
+        if rng.random() < self.failure_rate:
+            return latency, 1, "", "fake backend: injected failure"
+
+        output = self.outputs.get(stage or 'plot', _canned_options)
+        if callable(output):
+            output = output(command, rng)
+        text = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False, indent=2)
+        if rng.random() < self.malformed_rate:
+            text = _malform(text, rng)
+        return latency, 0, text, ""
+
+    def run(self, command, stage=None, timeout=None):
+        latency, returncode, stdout, stderr = self._plan(command, stage)
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise _timeout_error(stage, timeout)
+        time.sleep(latency)
+        return returncode, stdout, stderr
+
+    async def run_async(self, command, stage=None, on_chunk=None, timeout=None):
+        latency, returncode, stdout, stderr = self._plan(command, stage)
+        try:
+            return await asyncio.wait_for(
+                self._respond(latency, returncode, stdout, stderr, on_chunk), timeout
+            )
+        except asyncio.TimeoutError:
+            raise _timeout_error(stage, timeout)
+
+    async def _respond(self, latency, returncode, stdout, stderr, on_chunk):
+        if on_chunk is None or not stdout:
+            await asyncio.sleep(latency)
+            return returncode, stdout, stderr
+
+        # 첫 출력까지 기다린 뒤 나머지 시간 동안 조금씩 전달
+        await asyncio.sleep(latency * self.ttfb_ratio)
+        chunks = [stdout[i:i + self.chunk_size] for i in range(0, len(stdout), self.chunk_size)]
+        interval = latency * (1 - self.ttfb_ratio) / len(chunks)
+        for chunk in chunks:
+            await on_chunk(chunk)
+            await asyncio.sleep(interval)
+        return returncode, stdout, stderr
+
+
+class RecordReplayBackend(LLMBackend):
+    """
+    실제 응답을 파일로 기록하고 그대로 재생
+
+    mode: 'record' (항상 inner 실행 후 기록), 'replay' (기록만 사용, 없으면 실패),
+          'auto' (기록이 있으면 재생, 없으면 실행 후 기록)
+    키는 랜덤 조각(ignore, 시드/변형코드 등)을 제거한 프롬프트 기준이라 매 실행 같은 기록을 찾는다.
+    """
+
+    name = 'replay'
+    cache_namespace = 'replay'
+
+    def __init__(self, inner, fixtures_dir, mode='auto', ignore=(), replay_latency=False):
+        if mode not in ('record', 'replay', 'auto'):
+            raise ValueError(f"Unknown record/replay mode: {mode}")
+        self.inner = inner
+        self.fixtures_dir = fixtures_dir
+        self.mode = mode
+        self.ignore = ignore
+        self.replay_latency = replay_latency  # 재생 시 기록된 응답 시간만큼 대기
+        os.makedirs(fixtures_dir, exist_ok=True)
+
+    async def start(self):
+        await self.inner.start()
+
+    async def close(self):
+        await self.inner.close()
+
+    def _path(self, command):
+        key = cache_key(command, ignore=self.ignore)
+        return os.path.join(self.fixtures_dir, key[:2], f"{key}.json")
+
+    def _load(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, path, stage, latency, returncode, stdout, stderr):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'stage': stage,
+                'latency': latency,
+                'returncode': returncode,
+                'stdout': stdout,
+                'stderr': stderr
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def _missing(self, path):
+        return 1, "", f"replay: 기록 없음 ({os.path.basename(path)})"
+
+    def run(self, command, stage=None, timeout=None):
+        path = self._path(command)
+        if self.mode != 'record':
+            fixture = self._load(path)
+            if fixture is not None:
+                if self.replay_latency:
+                    latency = fixture.get('latency', 0)
+                    if timeout is not None and latency > timeout:
+                        time.sleep(timeout)
+                        raise _timeout_error(stage, timeout)
+                    time.sleep(latency)
+                return fixture['returncode'], fixture['stdout'], fixture['stderr']
+            if self.mode == 'replay':
+                return self._missing(path)
+
+        started = time.monotonic()
+        returncode, stdout, stderr = self.inner.run(command, stage, timeout)
+        self._save(path, stage, time.monotonic() - started, returncode, stdout, stderr)
+        return returncode, stdout, stderr
+
+    async def run_async(self, command, stage=None, on_chunk=None, timeout=None):
+        path = self._path(command)
+        if self.mode != 'record':
+            fixture = await asyncio.to_thread(self._load, path)
+            if fixture is not None:
+                if self.replay_latency:
+                    latency = fixture.get('latency', 0)
+                    if timeout is not None and latency > timeout:
+                        await asyncio.sleep(timeout)
+                        raise _timeout_error(stage, timeout)
+                    await asyncio.sleep(latency)
+                if on_chunk and fixture['stdout']:
+                    await on_chunk(fixture['stdout'])
+                return fixture['returncode'], fixture['stdout'], fixture['stderr']
+            if self.mode == 'replay':
+                return self._missing(path)
+
+        started = time.monotonic()
+        returncode, stdout, stderr = await self.inner.run_async(command, stage, on_chunk, timeout)
+        await asyncio.to_thread(
+            self._save, path, stage, time.monotonic() - started, returncode, stdout, stderr
+        )
+        return returncode, stdout, stderr
+
+
+def backend_from_env(ignore=()):
+    """
+    환경변수로 백엔드 선택
+
+    SCENARIO_LLM_BACKEND: cli (기본, 요청마다 새 프로세스), pool (미리 띄워 둔 claude 프로세스),
+                          fake, record, replay, auto
+    SCENARIO_LLM_WORKERS: pool에서 미리 띄워 둘 워커 수 (기본 2)
+    SCENARIO_LLM_WORKER_REQUESTS: pool 워커 하나가 처리할 프롬프트 수 (기본 50, 요청 사이에 대화를 비움)
+    SCENARIO_FIXTURES: 기록 디렉터리 (기본 scenario/fixtures/llm)
+    SCENARIO_FAKE_LATENCY: 가짜 백엔드 응답 시간 중앙값 (초)
+    """
+    kind = os.environ.get('SCENARIO_LLM_BACKEND', 'cli')
+    if kind == 'pool':
+        return WorkerPoolBackend(
+            size=int(os.environ.get('SCENARIO_LLM_WORKERS', '2')),
+            max_requests=int(os.environ.get('SCENARIO_LLM_WORKER_REQUESTS', '50'))
+        )
+    if kind == 'cli':
+        return CLIBackend()
+    if kind == 'fake':
+        return FakeBackend(latency=float(os.environ.get('SCENARIO_FAKE_LATENCY', '1.0')))
+    if kind in ('record', 'replay', 'auto'):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        fixtures_dir = os.environ.get('SCENARIO_FIXTURES', os.path.join(base_dir, 'fixtures/llm'))
+        return RecordReplayBackend(CLIBackend(), fixtures_dir, mode=kind, ignore=ignore)
+    raise ValueError(f"Unknown SCENARIO_LLM_BACKEND: {kind}")
@@ -0,0 +1,558 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+from types import SimpleNamespace
+
+from llm_backend import FakeBackend
+from metrics import METRICS
+from tg_interface import TelegramScenarioBot
+
+
+# python-telegram-bot의 concurrent_updates(True) 기본 동시 처리 수
+PTB_UPDATE_LIMIT = 256
+
+# 텔레그램 전송 제한 (채팅당 초당 1건, 전체 초당 30건 정도를 넘으면 429가 나기 시작함)
+PER_CHAT_LIMIT = 1
+GLOBAL_LIMIT = 30
+
+# 키워드를 입력하는 사용자가 보내는 메시지
+KEYWORD_INPUTS = ["불륜, 복수", "재벌, 이혼", "고부갈등", "사기, 배신, 재혼"]
+
+
+def percentile(values, p):
+    """정렬된 목록의 백분위 값 (비어 있으면 0)"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def rss_bytes():
+    """현재 프로세스 RSS (리눅스가 아니면 최대 RSS)"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class FakeTelegramAPI:
+    """
+    텔레그램 Bot API 대신 쓰는 로컬 가짜 (메시지 보관, 호출 수/지연/전송 제한 초과 기록)
+    """
+
+    def __init__(self, latency=0.05, latency_sigma=0.5, seed=None):
+        self.latency = latency  # API 왕복 시간 중앙값 (초)
+        self.latency_sigma = latency_sigma
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.error_messages = 0  # 사용자에게 보낸 오류/실패 안내 수
+        self.per_chat_bursts = 0  # 채팅당 초당 제한을 넘은 전송 수
+        self.global_bursts = 0  # 전체 초당 제한을 넘은 전송 수
+        self._message_ids = itertools.count(1)
+        self._chat_sends = defaultdict(deque)
+        self._global_sends = deque()
+
+    def _track(self, recent, now, limit):
+        recent.append(now)
+        while recent and now - recent[0] > 1.0:
+            recent.popleft()
+        return len(recent) > limit
+
+    async def call(self, method, chat_id=None, text=None):
+        self.calls[method] += 1
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'deleteMessage'):
+            now = time.monotonic()
+            if self._track(self._chat_sends[chat_id], now, PER_CHAT_LIMIT):
+                self.per_chat_bursts += 1
+            if self._track(self._global_sends, now, GLOBAL_LIMIT):
+                self.global_bursts += 1
+        if text and (text.startswith('❌') or '실패' in text):
+            self.error_messages += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.rng.lognormvariate(math.log(self.latency), self.latency_sigma))
+
+    def next_message_id(self):
+        return next(self._message_ids)
+
+
+class FakeMessage:
+    """telegram.Message 중 핸들러가 쓰는 부분"""
+
+    def __init__(self, api, chat, message_id, text, reply_markup=None):
+        self.api = api
+        self.chat = chat
+        self.message_id = message_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.deleted = False
+
+    @property
+    def chat_id(self):
+        return self.chat.id
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        return await self.chat.send_message(text, reply_markup=reply_markup, **kwargs)
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        await self.api.call('editMessageText', self.chat.id, text)
+        # 텔레그램과 같이 버튼을 지정하지 않고 수정하면 버튼이 사라짐
+        self.text = text
+        self.reply_markup = reply_markup
+        return self
+
+    async def edit_reply_markup(self, reply_markup=None, **kwargs):
+        await self.api.call('editMessageReplyMarkup', self.chat.id)
+        self.reply_markup = reply_markup
+        return self
+
+    async def delete(self):
+        await self.api.call('deleteMessage', self.chat.id)
+        self.deleted = True
+        return True
+
+
+class FakeChat:
+    """telegram.Chat 중 핸들러가 쓰는 부분 (보낸 메시지 보관)"""
+
+    def __init__(self, api, chat_id, max_messages=50):
+        self.api = api
+        self.id = chat_id
+        self.messages = deque(maxlen=max_messages)
+
+    async def send_message(self, text, reply_markup=None, **kwargs):
+        await self.api.call('sendMessage', self.id, text)
+        message = FakeMessage(self.api, self, self.api.next_message_id(), text, reply_markup)
+        self.messages.append(message)
+        return message
+
+    def screen(self):
+        """사용자가 보고 있는 화면 (버튼이 있는 가장 최근 메시지)"""
+        for message in reversed(self.messages):
+            if not message.deleted and message.reply_markup is not None:
+                return message
+        return None
+
+
+class FakeCallbackQuery:
+    def __init__(self, api, data, message):
+        self.api = api
+        self.data = data
+        self.message = message
+
+    async def answer(self, *args, **kwargs):
+        await self.api.call('answerCallbackQuery', self.message.chat_id)
+        return True
+
+
+class JourneyError(Exception):
+    """시나리오대로 진행할 수 없음 (필요한 버튼이 화면에 없음 등)"""
+
+
+class SimulatedUser:
+    """
+    한 사용자의 정해진 여정 실행
+
+    /start(줄거리 생성) → (키워드 입력) → 줄거리 선택 → 선택 안 된 것만 재생성 → 나머지 선택 → 완료 →
+    캐릭터 생성 → (실패 인물 재생성) → 인물별 버전 선택 → 확정
+    """
+
+    def __init__(self, harness, user_id, rng):
+        self.harness = harness
+        self.bot = harness.bot
+        self.api = harness.api
+        self.user_id = user_id
+        self.rng = rng
+        self.chat = FakeChat(self.api, user_id)
+        self.context = SimpleNamespace(user_data={})  # PTB와 같이 사용자별 user_data
+
+    def _update(self, message=None, callback_query=None):
+        return SimpleNamespace(
+            effective_user=SimpleNamespace(id=self.user_id),
+            effective_chat=self.chat,
+            message=message,
+            callback_query=callback_query
+        )
+
+    async def _think(self):
+        """화면을 읽고 누르기까지의 시간"""
+        think = self.harness.think
+        if think > 0:
+            await asyncio.sleep(self.rng.uniform(0.5, 1.5) * think)
+
+    async def command(self, name, handler, text):
+        message = FakeMessage(self.api, self.chat, self.api.next_message_id(), text)
+        await self.harness.handle(name, handler, self._update(message=message), self.context)
+
+    def buttons(self, prefix=''):
+        """현재 화면의 버튼 [(텍스트, callback_data)]"""
+        screen = self.chat.screen()
+        if screen is None:
+            return []
+        return [
+            (button.text, button.callback_data)
+            for row in screen.reply_markup.inline_keyboard
+            for button in row
+            if button.callback_data and button.callback_data.startswith(prefix)
+        ]
+
+    async def click(self, data, timeout=2.0):
+        # 디바운스된 화면 수정이 아직 반영되지 않았을 수 있으므로 버튼이 나타날 때까지 잠시 대기
+        deadline = time.monotonic() + timeout
+        while data not in [d for _, d in self.buttons()]:
+            if time.monotonic() >= deadline:
+                raise JourneyError(f"버튼 없음: {data}")
+            await asyncio.sleep(0.05)
+        screen = self.chat.screen()
+        query = FakeCallbackQuery(self.api, data, screen)
+        action = data
+        for prefix in ('toggle_', 'regen_char_', 'char_', 'page_'):
+            if data.startswith(prefix):
+                action = prefix.rstrip('_')
+                break
+        await self.harness.handle(action, self.bot.button_callback, self._update(callback_query=query), self.context)
+
+    async def journey(self):
+        await self.command('start', self.bot.start, '/start')
+        toggles = self.buttons('toggle_')
+        if not toggles:
+            raise JourneyError("줄거리 화면 없음")
+
+        # 일부 사용자는 키워드 입력 (새 키워드 조합은 풀에 없어 새로 생성됨)
+        if self.rng.random() < self.harness.keyword_ratio:
+            await self._think()
+            await self.click('set_keywords')
+            await self._think()
+            await self.command('keywords', self.bot.handle_message, self.rng.choice(KEYWORD_INPUTS))
+
+        # 일부만 고르고 나머지 재생성
+        for _, data in toggles[:2]:
+            await self._think()
+            await self.click(data)
+        await self._think()
+        await self.click('regen_unselected')
+
+        # 디바운스된 화면이 반영된 뒤 선택 안 된 것 모두 선택
+        await self._think()
+        await asyncio.sleep(self.bot.renderer.quiet_window)
+        for text, data in self.buttons('toggle_'):
+            if text.startswith('❌'):
+                await self.click(data)
+        await asyncio.sleep(self.bot.renderer.quiet_window)
+        await self._think()
+        await self.click('complete_plot')
+
+        await self._think()
+        await self.click('select_plot_for_character')
+
+        # 생성에 실패한 인물은 다시 생성
+        for _, data in self.buttons('regen_char_'):
+            await self._think()
+            await self.click(data)
+
+        names = []
+        for _, data in self.buttons('char_'):
+            name = data.rsplit('_', 1)[0][len('char_'):]
+            if name not in names:
+                names.append(name)
+        if not names:
+            raise JourneyError("캐릭터 화면 없음")
+        for name in names:
+            await self._think()
+            await self.click(f"char_{name}_{self.rng.randint(1, 3)}")
+
+        await asyncio.sleep(self.bot.renderer.quiet_window)
+        await self._think()
+        await self.click('confirm_characters')
+
+
+class LoopMonitor:
+    """이벤트 루프 지연(예정보다 늦게 깨어난 시간)과 RSS 주기적 측정"""
+
+    def __init__(self, interval=0.05, rss_interval=1.0):
+        self.interval = interval
+        self.rss_interval = rss_interval
+        self.lags = []
+        self.rss = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_rss = 0.0
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            self.lags.append(max(0.0, now - started - self.interval))
+            if now - last_rss >= self.rss_interval:
+                self.rss.append(rss_bytes())
+                last_rss = now
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class LoadTest:
+    """
+    가짜 텔레그램 API + 가짜 LLM으로 실제 봇 핸들러(start, button_callback, handle_message)에 부하를 줌
+
+    핸들러는 PTB의 concurrent_updates와 같이 동시 처리 수 제한 안에서 실행하고,
+    핸들러 지연(동작별 p50/p95/p99), 이벤트 루프 지연, 처리량, 메모리 증가를 보고한다.
+    """
+
+    def __init__(self, users=50, ramp=10.0, think=1.0, llm_latency=1.0, llm_sigma=0.3,
+                 failure_rate=0.0, malformed_rate=0.0, api_latency=0.05, max_concurrency=3,
+                 update_limit=PTB_UPDATE_LIMIT, keyword_ratio=0.2, warm=True, cache=False, seed=0, keep=False):
+        self.users = users
+        self.ramp = ramp  # 모든 사용자가 시작할 때까지 걸리는 시간 (초)
+        self.think = think  # 버튼 사이 평균 대기 시간 (초)
+        self.keyword_ratio = keyword_ratio  # 키워드를 입력하는 사용자 비율
+        self.warm = warm
+        self.seed = seed
+        self.keep = keep
+        self.workdir = tempfile.mkdtemp(prefix='scenario_loadtest_')
+
+        self.bot = TelegramScenarioBot(
+            'loadtest',
+            max_concurrency=max_concurrency,
+            state_path=os.path.join(self.workdir, 'user_states.db'),
+            session_path=os.path.join(self.workdir, 'sessions.db')
+        )
+        if not cache:
+            # 가짜 응답은 모두 같아서 캐시가 켜져 있으면 실제보다 빠르게 나옴
+            self.bot.claude.cache = None
+        self.bot.claude.backend = FakeBackend(
+            latency=llm_latency, latency_sigma=llm_sigma, failure_rate=failure_rate,
+            malformed_rate=malformed_rate, seed=seed
+        )
+        self.api = FakeTelegramAPI(latency=api_latency, seed=seed)
+        self.update_limit = asyncio.Semaphore(update_limit)
+        self.monitor = LoopMonitor()
+
+        self.latencies = defaultdict(list)  # 동작 -> 핸들러 지연 목록
+        self.handler_errors = Counter()  # 동작 -> 예외 수
+        self.journey_times = []
+        self.journey_failures = Counter()  # 실패 사유 -> 수
+
+    async def handle(self, action, handler, update, context):
+        """핸들러 하나 실행 (동시 처리 수 제한 대기 포함 지연 기록)"""
+        started = time.monotonic()
+        try:
+            async with self.update_limit:
+                await handler(update, context)
+        except Exception as e:
+            # PTB는 핸들러 예외를 기록만 하고 다음 업데이트를 계속 처리함
+            self.handler_errors[action] += 1
+            print(f"[{action}] 핸들러 예외: {e}")
+            raise JourneyError(f"{action} 예외: {type(e).__name__}")
+        finally:
+            self.latencies[action].append(time.monotonic() - started)
+
+    async def _user(self, index):
+        await asyncio.sleep(self.ramp * index / max(1, self.users))
+        user = SimulatedUser(self, 10000 + index, random.Random(self.seed * 100003 + index))
+        started = time.monotonic()
+        try:
+            await user.journey()
+            self.journey_times.append(time.monotonic() - started)
+        except JourneyError as e:
+            self.journey_failures[str(e)] += 1
+
+    async def run(self):
+        gc.collect()
+        rss_start = rss_bytes()
+        self.monitor.start()
+        if self.warm:
+            await self.bot._post_init(None)
+        started = time.monotonic()
+        await asyncio.gather(*(self._user(i) for i in range(self.users)))
+        elapsed = time.monotonic() - started
+
+        # 남은 디바운스 렌더링이 끝날 때까지 대기
+        await asyncio.sleep(self.bot.renderer.quiet_window * 2)
+        await self.monitor.stop()
+        gc.collect()
+        rss_end = rss_bytes()
+        report = self.report(elapsed, rss_start, rss_end)
+        await self.bot._post_shutdown(None)
+        if not self.keep:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        return report
+
+    def report(self, elapsed, rss_start, rss_end):
+        handlers = {}
+        total_calls = 0
+        for action, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            total_calls += len(values)
+            handlers[action] = {
+                'count': len(values),
+                'errors': self.handler_errors[action],
+                'p50': percentile(values, 0.5),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+                'max': values[-1] if values else 0.0
+            }
+        lags = sorted(self.monitor.lags)
+        journeys = sorted(self.journey_times)
+        rss_peak = max(self.monitor.rss + [rss_start, rss_end])
+        return {
+            'users': self.users,
+            'elapsed': elapsed,
+            'journeys': {
+                'completed': len(journeys),
+                'failed': dict(self.journey_failures),
+                'p50': percentile(journeys, 0.5),
+                'p95': percentile(journeys, 0.95),
+                'per_minute': len(journeys) / elapsed * 60 if elapsed else 0.0
+            },
+            'handlers': handlers,
+            'handler_throughput': total_calls / elapsed if elapsed else 0.0,
+            'loop_lag': {
+                'p50': percentile(lags, 0.5),
+                'p95': percentile(lags, 0.95),
+                'p99': percentile(lags, 0.99),
+                'max': lags[-1] if lags else 0.0
+            },
+            'memory': {
+                'rss_start': rss_start,
+                'rss_peak': rss_peak,
+                'rss_end': rss_end,
+                'growth_per_user': (rss_end - rss_start) / max(1, self.users)
+            },
+            'telegram': {
+                'calls': dict(self.api.calls),
+                'error_messages': self.api.error_messages,
+                'per_chat_bursts': self.api.per_chat_bursts,
+                'global_bursts': self.api.global_bursts
+            },
+            'llm_calls': self.bot.claude.backend.calls,
+            'scheduler': self.bot.scheduler.stats(),
+            'story_pool': self.bot.story_pool.stats(),
+            'renderer': {
+                'renders_coalesced': self.bot.renderer.renders_coalesced,
+                'edits_skipped': self.bot.renderer.edits_skipped,
+                'markup_only_edits': self.bot.renderer.markup_only_edits
+            }
+        }
+
+
+def print_report(report):
+    mb = 1024 * 1024
+    journeys = report['journeys']
+    print(f"\n동시 사용자 {report['users']}명, 소요 {report['elapsed']:.1f}초")
+    print(f"여정: 완료 {journeys['completed']}, 실패 {sum(journeys['failed'].values())} "
+          f"(분당 {journeys['per_minute']:.1f}건, p50 {journeys['p50']:.1f}초, p95 {journeys['p95']:.1f}초)")
+    for reason, count in sorted(journeys['failed'].items()):
+        print(f"  실패 {reason}: {count}")
+
+    print(f"\n핸들러 지연 (초, 처리량 {report['handler_throughput']:.1f}건/초)")
+    print(f"  {'동작':<28}{'건수':>6}{'오류':>6}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+    for action, row in report['handlers'].items():
+        print(f"  {action:<28}{row['count']:>6}{row['errors']:>6}"
+              f"{row['p50']:>8.3f}{row['p95']:>8.3f}{row['p99']:>8.3f}{row['max']:>8.3f}")
+
+    lag = report['loop_lag']
+    print(f"\n이벤트 루프 지연 (ms): p50 {lag['p50'] * 1000:.1f}, p95 {lag['p95'] * 1000:.1f}, "
+          f"p99 {lag['p99'] * 1000:.1f}, max {lag['max'] * 1000:.1f}")
+
+    memory = report['memory']
+    print(f"메모리 RSS (MB): 시작 {memory['rss_start'] / mb:.1f}, 최대 {memory['rss_peak'] / mb:.1f}, "
+          f"끝 {memory['rss_end'] / mb:.1f} (사용자당 {memory['growth_per_user'] / 1024:.1f}KB)")
+
+    telegram = report['telegram']
+    calls = ', '.join(f"{method} {count}" for method, count in sorted(telegram['calls'].items()))
+    print(f"텔레그램 API: {calls}")
+    print(f"  오류 안내 {telegram['error_messages']}건, 채팅당 초당 {PER_CHAT_LIMIT}건 초과 {telegram['per_chat_bursts']}건, "
+          f"전체 초당 {GLOBAL_LIMIT}건 초과 {telegram['global_bursts']}건")
+
+    scheduler = report['scheduler']
+    print(f"LLM 호출 {report['llm_calls']}건, 대기 시간 p50 {scheduler['wait_p50']:.2f}초, "
+          f"p95 {scheduler['wait_p95']:.2f}초, max {scheduler['wait_max']:.2f}초")
+    print(f"줄거리 풀 적중률 {report['story_pool']['hit_rate']:.0%}, 렌더링 병합 {report['renderer']['renders_coalesced']}건, "
+          f"수정 생략 {report['renderer']['edits_skipped']}건, 버튼만 수정 {report['renderer']['markup_only_edits']}건")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="텔레그램 봇 동시 사용자 부하 테스트 (가짜 텔레그램 API + 가짜 LLM)")
+    parser.add_argument('--users', type=int, default=50, help="동시 사용자 수")
+    parser.add_argument('--ramp', type=float, default=10.0, help="모든 사용자가 시작할 때까지 걸리는 시간 (초)")
+    parser.add_argument('--think', type=float, default=1.0, help="버튼 사이 평균 대기 시간 (초)")
+    parser.add_argument('--llm-latency', type=float, default=1.0, help="LLM 응답 시간 중앙값 (초)")
+    parser.add_argument('--llm-sigma', type=float, default=0.3, help="LLM 응답 시간 로그정규분포 폭")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="LLM 호출 실패 확률")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="깨진 JSON 응답 확률")
+    parser.add_argument('--api-latency', type=float, default=0.05, help="텔레그램 API 왕복 시간 중앙값 (초)")
+    parser.add_argument('--concurrency', type=int, default=3, help="claude 동시 실행 수")
+    parser.add_argument('--update-limit', type=int, default=PTB_UPDATE_LIMIT, help="동시 처리 업데이트 수")
+    parser.add_argument('--keyword-ratio', type=float, default=0.2, help="키워드를 입력하는 사용자 비율")
+    parser.add_argument('--no-warm', action='store_true', help="시작 시 줄거리 풀을 채우지 않음")
+    parser.add_argument('--cache', action='store_true', help="응답 캐시 사용")
+    parser.add_argument('--seed', type=int, default=0, help="난수 시드")
+    parser.add_argument('--json', help="결과를 JSON 파일로 저장")
+    parser.add_argument('--metrics', help="단계별 지표를 Prometheus 텍스트 파일로 저장")
+    parser.add_argument('--traces', help="사용자별 추적 JSON을 저장할 디렉터리")
+    parser.add_argument('--keep', action='store_true', help="상태/세션 DB 디렉터리를 지우지 않음")
+    parser.add_argument('--verbose', action='store_true', help="봇 로그 출력")
+    args = parser.parse_args()
+
+    async def run():
+        test = LoadTest(
+            users=args.users, ramp=args.ramp, think=args.think,
+            llm_latency=args.llm_latency, llm_sigma=args.llm_sigma,
+            failure_rate=args.failure_rate, malformed_rate=args.malformed_rate,
+            api_latency=args.api_latency, max_concurrency=args.concurrency,
+            update_limit=args.update_limit, keyword_ratio=args.keyword_ratio, warm=not args.no_warm, cache=args.cache,
+            seed=args.seed, keep=args.keep
+        )
+        if args.keep:
+            print(f"작업 디렉터리: {test.workdir}")
+        return await test.run()
+
+    print(f"사용자 {args.users}명 부하 테스트 시작...")
+    if args.verbose:
+        report = asyncio.run(run())
+    else:
+        # 봇의 프롬프트/진행 로그는 버림 (출력 자체도 부하에 포함됨)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            report = asyncio.run(run())
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n결과 저장: {args.json}")
+    if args.metrics:
+        with open(args.metrics, 'w', encoding='utf-8') as f:
+            f.write(METRICS.prometheus())
+        print(f"지표 저장: {args.metrics}")
+    if args.traces:
+        os.makedirs(args.traces, exist_ok=True)
+        for session in METRICS.sessions():
+            METRICS.dump_trace(session, os.path.join(args.traces, f"{session}.json"))
+        print(f"추적 저장: {args.traces}")
+    return 1 if report['journeys']['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from generator import SELECTION_POLICIES, Checkpoint, job_identity, run_batch
+
+
+def load_plots(path):
+    """줄거리 파일 읽기 ([{title, plot}] 또는 {"stories": [...]} 형식)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('stories', [])
+    return [plot for plot in data if plot.get('plot')]
+
+
+def build_jobs(args, keywords):
+    """작업 목록 (지정 줄거리가 있으면 줄거리마다, 없으면 count개)"""
+    plots = load_plots(args.plots) if args.plots else []
+    count = len(plots) if plots else args.count
+    jobs = []
+    for i in range(count):
+        job = {'id': f"scenario_{i + 1:04d}", 'seed': args.seed + i}
+        if plots:
+            job['plot'] = plots[i]
+        # 같은 ID라도 시드/줄거리가 다르면 체크포인트를 이어 쓰지 않음
+        job['identity'] = job_identity(job, keywords, args.tone)
+        jobs.append(job)
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="시나리오 일괄 생성 (줄거리 → 캐릭터 → 캐릭터 상세)")
+    parser.add_argument('--count', type=int, default=10, help="생성할 시나리오 수 (--plots가 없을 때)")
+    parser.add_argument('--plots', help="줄거리 JSON 파일 (지정하면 줄거리 생성 단계를 건너뜀)")
+    parser.add_argument('--out', default='outputs/batch', help="결과/체크포인트 디렉터리")
+    parser.add_argument('--workers', type=int, default=2, help="작업자 프로세스 수")
+    parser.add_argument('--concurrency', type=int, default=3, help="작업자별 claude 동시 실행 수")
+    parser.add_argument('--scenarios', type=int, default=4, help="작업자별 동시 진행 시나리오 수")
+    parser.add_argument('--policy', choices=sorted(SELECTION_POLICIES), default='first', help="자동 선택 정책")
+    parser.add_argument('--keywords', default='', help="줄거리 키워드 (쉼표로 구분)")
+    parser.add_argument('--tone', default=None, help="톤 (기본, 자극적, 현실적, 충격적, 선정적)")
+    parser.add_argument('--seed', type=int, default=0, help="시작 시드 (시나리오마다 1씩 증가)")
+    parser.add_argument('--cache', default=None,
+                        help="응답 캐시 디렉터리 (기본: <out>/cache, 'none'이면 사용 안 함; 봇의 캐시와 분리)")
+    args = parser.parse_args()
+
+    keywords = [k.strip() for k in args.keywords.split(',') if k.strip()]
+    jobs = build_jobs(args, keywords)
+    os.makedirs(args.out, exist_ok=True)
+
+    # 이미 끝난 시나리오는 건너뜀 (중단 후 다시 실행하면 남은 것만 진행)
+    pending = [
+        job for job in jobs
+        if not Checkpoint(os.path.join(args.out, f"{job['id']}.json"), job['identity']).done
+    ]
+    print(f"시나리오 {len(jobs)}개 중 {len(jobs) - len(pending)}개 완료됨, {len(pending)}개 진행")
+    if not pending:
+        return 0
+
+    cache_dir = args.cache or os.path.join(args.out, 'cache')
+    options = {
+        'policy': args.policy,
+        'keywords': keywords,
+        'tone': args.tone,
+        'cache_dir': None if cache_dir == 'none' else cache_dir,
+        'concurrency': args.concurrency,
+        'scenarios': args.scenarios
+    }
+
+    # 작업자별로 나눠서 실행 (작업자 안에서는 비동기로 동시 진행)
+    workers = max(1, min(args.workers, len(pending)))
+    chunks = [pending[i::workers] for i in range(workers)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_batch, chunk, args.out, options) for chunk in chunks]
+        for future in as_completed(futures):
+            results.extend(future.result())
+
+    failed = [(job_id, status) for job_id, status in results if status != 'done']
+    print(f"\n완료: {len(results) - len(failed)}개, 실패: {len(failed)}개")
+    for job_id, error in failed:
+        print(f"  {job_id}: {error}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
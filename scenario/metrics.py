@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import bisect
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# 히스토그램 구간 (초): 렌더링/파싱(ms 단위)부터 LLM 생성(분 단위)까지
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# 현재 세션 (텔레그램 사용자 ID 또는 일괄 생성 작업 ID)
+_session = ContextVar('metrics_session', default=None)
+# 현재 LLM 요청 (구간을 모았다가 요청이 끝나면 결과 라벨을 붙여 기록)
+_request = ContextVar('metrics_request', default=None)
+# 스케줄러 대기 시간 (작업 실행 직전에 설정, 요청이 시작되면 가져감)
+_queue_wait = ContextVar('metrics_queue_wait', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in items) + '}'
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 마지막은 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    생성 파이프라인 단계별 지표와 세션별 추적
+
+    LLM 요청 하나(request) 안의 구간(프롬프트 구성, 대기열, 프로세스 시작, 첫 출력, 생성, 파싱)은
+    요청이 끝날 때 stage/tone/outcome 라벨을 붙여 히스토그램에 기록하고,
+    요청 밖의 구간(텔레그램 렌더링 등)은 지정한 라벨로 바로 기록한다.
+    모든 구간은 현재 세션(bind_session)의 추적에도 남아 느린 세션의 원인(LLM/파서/텔레그램)을 확인할 수 있다.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_sessions=1000, max_spans=500):
+        self.buckets = tuple(buckets)
+        self.max_sessions = max_sessions  # 추적을 보관할 최대 세션 수
+        self.max_spans = max_spans  # 세션별 최대 구간 수
+        self._lock = threading.Lock()
+        self._histograms = {}  # (이름, 라벨) -> _Histogram
+        self._counters = {}  # (이름, 라벨) -> 값
+        self._traces = OrderedDict()  # 세션 -> deque(구간)
+        self._request_ids = itertools.count(1)
+
+    def bind_session(self, session_id):
+        """현재 작업(과 여기서 시작하는 작업)의 세션 지정"""
+        _session.set(session_id)
+
+    def queued(self, seconds):
+        """스케줄러 대기 시간 (다음에 시작하는 요청의 queue_wait 구간이 됨)"""
+        _queue_wait.set(seconds)
+
+    @contextmanager
+    def request(self, stage, tone=None):
+        """
+        LLM 요청 하나 (끝날 때 outcome이 정해지지 않았으면 failure)
+
+        outcome: ok(파싱 성공), dummy(더미 데이터로 대체), failure(실패)
+        """
+        started = time.monotonic()
+        request = {
+            'id': next(self._request_ids),
+            'stage': stage,
+            'tone': tone or '',
+            'outcome': None,
+            'parse_path': None,
+            'cached': False,
+            'started_at': time.time(),
+            'spans': []
+        }
+        wait = _queue_wait.get()
+        if wait is not None:
+            _queue_wait.set(None)
+            request['spans'].append(('queue_wait', wait, request['started_at'] - wait, {}))
+        token = _request.set(request)
+        try:
+            yield request
+        finally:
+            _request.reset(token)
+            self._finish(request, time.monotonic() - started)
+
+    def label(self, **labels):
+        """현재 요청의 라벨/속성 지정 (tone, outcome, parse_path, cached)"""
+        request = _request.get()
+        if request is not None:
+            request.update(labels)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """
+        구간 측정
+
+        요청 안이면 요청이 끝날 때 함께 기록하고, 밖이면 labels에 outcome(ok/failure)을 붙여 바로 기록
+        """
+        started_at = time.time()
+        started = time.monotonic()
+        outcome = 'failure'
+        try:
+            yield
+            outcome = 'ok'
+        finally:
+            elapsed = time.monotonic() - started
+            if _request.get() is not None:
+                self.observe(name, elapsed, started_at, **labels)
+            else:
+                self.observe(name, elapsed, started_at, outcome=outcome, **labels)
+
+    def observe(self, name, seconds, started_at=None, **labels):
+        """완료된 구간 기록"""
+        if started_at is None:
+            started_at = time.time() - seconds
+        request = _request.get()
+        if request is not None:
+            request['spans'].append((name, seconds, started_at, labels))
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._histogram(name, key).observe(seconds)
+            self._trace(name, seconds, started_at, labels, None)
+
+    def count(self, name, value=1, **labels):
+        """카운터 증가"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def _histogram(self, name, key):
+        histogram = self._histograms.get((name, key))
+        if histogram is None:
+            histogram = self._histograms[(name, key)] = _Histogram(self.buckets)
+        return histogram
+
+    def _trace(self, name, seconds, started_at, labels, request_id):
+        session = _session.get()
+        if session is None:
+            return
+        spans = self._traces.get(session)
+        if spans is None:
+            spans = self._traces[session] = deque(maxlen=self.max_spans)
+            while len(self._traces) > self.max_sessions:
+                self._traces.popitem(last=False)
+        else:
+            self._traces.move_to_end(session)
+        spans.append({
+            'name': name,
+            'start': round(started_at, 6),
+            'duration': round(seconds, 6),
+            'labels': labels,
+            'request': request_id
+        })
+
+    def _finish(self, request, total):
+        outcome = request['outcome'] or 'failure'
+        labels = {'stage': request['stage'], 'tone': request['tone'], 'outcome': outcome}
+        key = tuple(sorted(labels.items()))
+        spans = request['spans'] + [('request', total, request['started_at'], {})]
+        with self._lock:
+            for name, seconds, started_at, extra in spans:
+                self._histogram(name, key).observe(seconds)
+                self._trace(name, seconds, started_at, dict(labels, **extra), request['id'])
+        self.count('requests_total', stage=request['stage'], tone=request['tone'], outcome=outcome)
+        if request['parse_path']:
+            self.count('parse_path_total', stage=request['stage'], path=request['parse_path'])
+        if request['cached']:
+            self.count('cache_hits_total', stage=request['stage'])
+
+    def prometheus(self, prefix='scenario_'):
+        """Prometheus 텍스트 형식으로 내보내기"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        current = None
+        for (name, labels), histogram in histograms:
+            metric = f"{prefix}{name}_seconds"
+            if metric != current:
+                lines.append(f"# TYPE {metric} histogram")
+                current = metric
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{metric}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+
+        for (name, labels), value in counters:
+            metric = f"{prefix}{name}"
+            if metric != current:
+                lines.append(f"# TYPE {metric} counter")
+                current = metric
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def sessions(self):
+        """추적이 남아 있는 세션 목록 (오래된 것부터)"""
+        with self._lock:
+            return list(self._traces)
+
+    def trace(self, session_id):
+        """세션 추적 JSON (없으면 None)"""
+        with self._lock:
+            spans = self._traces.get(session_id)
+            if spans is None:
+                # HTTP 경로 등 문자열로 받은 세션 ID
+                spans = next((v for k, v in self._traces.items() if str(k) == str(session_id)), None)
+            if spans is None:
+                return None
+            spans = list(spans)
+        return {'session': session_id, 'spans': spans}
+
+    def dump_trace(self, session_id, path):
+        """세션 추적을 JSON 파일로 저장 (추적이 없으면 False)"""
+        trace = self.trace(session_id)
+        if trace is None:
+            return False
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, ensure_ascii=False, indent=2)
+        return True
+
+    async def serve(self, host='127.0.0.1', port=9108):
+        """
+        HTTP로 내보내기 (/metrics: Prometheus, /traces: 세션 목록, /trace/<세션>: 추적 JSON)
+        """
+        async def handle(reader, writer):
+            try:
+                request_line = await reader.readline()
+                # 나머지 헤더는 읽고 버림
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                parts = request_line.decode('latin-1').split()
+                path = parts[1] if len(parts) > 1 else '/'
+                status, content_type, body = '404 Not Found', 'text/plain', 'not found\n'
+                if path == '/metrics':
+                    status, content_type, body = '200 OK', 'text/plain; version=0.0.4', self.prometheus()
+                elif path == '/traces':
+                    status, content_type = '200 OK', 'application/json'
+                    body = json.dumps([str(s) for s in self.sessions()], ensure_ascii=False)
+                elif path.startswith('/trace/'):
+                    trace = self.trace(path[len('/trace/'):])
+                    if trace is not None:
+                        status, content_type = '200 OK', 'application/json'
+                        body = json.dumps(trace, ensure_ascii=False)
+                data = body.encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        print(f"지표 서버 시작: http://{host}:{port}/metrics")
+        return server
+
+
+# 프로세스 전체에서 공유하는 지표
+METRICS = Metrics()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import itertools
+
+from metrics import METRICS
+from prompt_1_plot import PlotGen
+from scheduler import GenerationScheduler, RequestSuperseded
+
+
+class PlotBatcher:
+    """
+    줄거리 생성 요청 묶음 처리
+
+    짧은 시간(window) 안에 들어온 요청 중 톤과 키워드가 같은 것을 모아
+    필요한 개수를 합쳐 claude를 한 번만 호출하고, 결과를 요청 순서대로 나눠준다.
+    """
+
+    def __init__(self, claude, scheduler, window=0.3, max_stories=10):
+        self.claude = claude
+        self.scheduler = scheduler
+        self.window = window  # 요청을 모으는 시간 (초)
+        self.max_stories = max_stories  # 한 번에 생성할 최대 스토리 수
+        self._open = {}  # (톤, 키워드) -> 모으는 중인 묶음
+        self._batch_ids = itertools.count(1)
+        self.requests = 0  # 받은 요청 수
+        self.calls = 0  # 실제 claude 호출 수
+
+    @staticmethod
+    def batch_key(tone, keywords):
+        """묶을 수 있는 요청 기준 (같은 톤 + 같은 키워드 집합)"""
+        return (tone, tuple(sorted(set(k.strip() for k in keywords or [] if k.strip()))))
+
+    async def request(self, user_id, num, keywords=None, tone=None, exclude=None, on_story=None,
+                      on_reset=None):
+        """
+        스토리 num개 요청 후 결과 대기
+
+        on_story: 스트리밍으로 스토리가 도착할 때마다 호출
+        on_reset: 생성 시도가 실패해 그때까지 전달한 스토리를 버려야 할 때 호출
+
+        반환: {'stories': [...], 'reference_ids': [...], 'references_reset': bool}
+        """
+        loop = asyncio.get_running_loop()
+        key = self.batch_key(tone, keywords)
+        member = {
+            'user_id': user_id,
+            'num': num,
+            'exclude': exclude or [],
+            'on_story': on_story,
+            'on_reset': on_reset,
+            'future': loop.create_future()
+        }
+        self.requests += 1
+
+        batch = self._open.get(key)
+        if batch is not None and batch['total'] + num > self.max_stories:
+            # 묶음이 가득 차면 먼저 보냄
+            self._close(key)
+            batch = None
+        if batch is None:
+            batch = {
+                'key': key,
+                'keywords': list(keywords or []),
+                'tone': tone,
+                'members': [],
+                'total': 0
+            }
+            batch['timer'] = loop.call_later(self.window, self._close, key)
+            self._open[key] = batch
+
+        # 같은 사용자가 아직 모으는 중인 요청이 있으면 새 요청으로 대체
+        for old in batch['members']:
+            if old['user_id'] == user_id and not old['future'].done():
+                old['future'].set_exception(RequestSuperseded())
+                batch['members'].remove(old)
+                batch['total'] -= old['num']
+                break
+
+        batch['members'].append(member)
+        batch['total'] += num
+        if batch['total'] >= self.max_stories:
+            self._close(key)
+
+        # 묶음 생성 구간은 묶음을 연 사용자 세션에만 남으므로 사용자별 대기 시간을 따로 기록
+        with METRICS.span('plot_batch', tone=tone or ''):
+            return await member['future']
+
+    def _close(self, key):
+        """모으기를 끝내고 묶음 실행"""
+        batch = self._open.pop(key, None)
+        if batch is None:
+            return
+        batch['timer'].cancel()
+        if batch['members']:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        """묶음 하나를 claude 한 번으로 생성 후 요청별로 분배"""
+        members = batch['members']
+        try:
+            exclude = set()
+            for member in members:
+                exclude.update(member['exclude'])
+
+            plot_gen = await asyncio.to_thread(
+                PlotGen,
+                num=batch['total'],
+                keywords=batch['keywords'],
+                exclude=exclude
+            )
+            prompt_data = plot_gen.generate()
+            prompt_data['tone'] = batch['tone']
+
+            if len(members) > 1:
+                print(f"줄거리 요청 {len(members)}건을 한 번에 생성 (총 {batch['total']}개, 톤: {batch['tone']})")
+                # 묶음마다 별도 대기열 (개별 사용자의 재요청으로 대체되지 않도록)
+                owner = ('batch', next(self._batch_ids))
+            else:
+                owner = members[0]['user_id']
+
+            # 프롬프트 콘솔 출력
+            print("\n" + "="*60)
+            print("[1단계 줄거리 생성 프롬프트]")
+            print("="*60)
+            print(prompt_data['prompt'])
+            print("="*60 + "\n")
+
+            on_item, on_reset = self._make_splitter(members)
+            self.calls += 1
+            response = await self.scheduler.submit(
+                owner, lambda: self.claude.execute_prompt_async(
+                    prompt_data, on_item=on_item, on_reset=on_reset
+                ),
+                GenerationScheduler.INTERACTIVE
+            )
+        except Exception as e:
+            for member in members:
+                if not member['future'].done():
+                    member['future'].set_exception(e)
+            return
+
+        stories = (response or {}).get('stories', [])
+        start = 0
+        for member in members:
+            if not member['future'].done():
+                member['future'].set_result({
+                    'stories': stories[start:start + member['num']],
+                    'reference_ids': prompt_data['reference_ids'],
+                    'references_reset': prompt_data['references_reset']
+                })
+            start += member['num']
+
+    def _make_splitter(self, members):
+        """스트리밍으로 도착한 스토리를 요청 순서대로 각 사용자 콜백에 전달 (on_item, on_reset 반환)"""
+        counts = [0] * len(members)
+
+        async def on_item(item, path):
+            if path != ('stories',):
+                return
+            for i, member in enumerate(members):
+                if counts[i] < member['num']:
+                    counts[i] += 1
+                    if member['on_story'] and not member['future'].done():
+                        await member['on_story'](item, path)
+                    return
+
+        async def on_reset():
+            # 실패한 시도가 보낸 스토리는 버리고 재시도는 처음부터 다시 나눔
+            for i, member in enumerate(members):
+                if counts[i] and member['on_reset'] and not member['future'].done():
+                    await member['on_reset']()
+                counts[i] = 0
+
+        return on_item, on_reset
@@ -2,40 +2,58 @@
 # -*- coding: utf-8 -*-
 
 import json
+from reference_store import ReferenceStore
 
 
 class PlotGen:
-    def __init__(self, num=5):
+    def __init__(self, num=5, keywords=None, exclude=None, num_refs=None):
+        """
+        num: 생성할 스토리 개수
+        keywords: 사용자 키워드 (일치하는 레퍼런스를 우선 선택)
+        exclude: 이미 보낸 레퍼런스 ID (재생성 시 같은 에피소드 재전송 방지)
+        num_refs: 레퍼런스 개수 (기본: 키워드가 있으면 20개, 없으면 30개)
+        """
         self.num = num
-        import os
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        ref_path = os.path.join(base_dir, 'references/processed/lovewar.json')
-        with open(ref_path, 'r', encoding='utf-8') as f:
-            self.references = json.load(f)
+        self.keywords = keywords or []
+        self.exclude = exclude or []
+        if num_refs is None:
+            num_refs = 20 if self.keywords else 30
+        self.num_refs = num_refs
+        # 레퍼런스는 프로세스 전체에서 공유 (생성할 때마다 파일을 다시 읽지 않음)
+        self.store = ReferenceStore.get()
+        self.references = self.store.references
     
-    def generate(self):
+    def generate(self, seed=None):
+        """
+        줄거리 생성 프롬프트 생성
+        
+        seed: 지정하면 변형 요소와 레퍼런스 선택이 고정됨 (재현 모드)
+        """
         import random
         import string
         
+        rng = random.Random(seed) if seed is not None else random
+        
         # 랜덤 시드 문자열 생성 (매번 다른 응답 유도)
-        seed = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+        nonce = ''.join(rng.choices(string.ascii_letters + string.digits, k=8))
         
         # 랜덤 변형 요소들
         variations = [
-            f"[시드: {seed}]",
-            f"(변형코드: {random.randint(1000, 9999)})",
-            f"#버전{random.randint(1, 100)}",
-            f"※ 고유번호: {random.randint(100000, 999999)}",
-            f"∞ 변화값: {random.random():.6f}"
+            f"[시드: {nonce}]",
+            f"(변형코드: {rng.randint(1000, 9999)})",
+            f"#버전{rng.randint(1, 100)}",
+            f"※ 고유번호: {rng.randint(100000, 999999)}",
+            f"∞ 변화값: {rng.random():.6f}"
         ]
         
         # 랜덤하게 1-2개 선택
-        selected_variations = random.sample(variations, random.randint(1, 2))
+        selected_variations = rng.sample(variations, rng.randint(1, 2))
         variation_text = ' '.join(selected_variations)
         
-        # 레퍼런스에서 랜덤하게 30개 선택
-        num_refs = min(30, len(self.references))
-        selected_references = random.sample(self.references, num_refs)
+        # 레퍼런스 선택 (키워드 일치 우선 + 태그별 층화, 이미 보낸 것은 제외)
+        reference_ids, selected_references, references_reset = self.store.sample_references(
+            self.num_refs, keywords=self.keywords, exclude=self.exclude, rng=rng
+        )
         
         prompt = f"""첨부된 JSON 파일을 참고하여 새로운 이야기 {self.num}개를 4~5줄 분량으로 제목과 함께 생성해주세요.
 
@@ -58,10 +76,17 @@ class PlotGen:
 - 문자열 내의 따옴표는 \\"로 이스케이프
 - 총 {self.num}개의 스토리 생성"""
         
-        return {
+        result = {
             "prompt": prompt,
-            "references": selected_references  # 30개만 전달
+            "stage": "plot",
+            "references": selected_references,  # 선택된 레퍼런스만 전달
+            "reference_ids": reference_ids,  # 프롬프트 예산 때문에 잘리면 실행 시 보낸 것만 남음
+            "references_reset": references_reset,  # True면 exclude를 비우고 다시 뽑음
+            "seed": seed
         }
+        if self.keywords:
+            result["keywords"] = self.keywords
+        return result
 
 
 if __name__ == "__main__":
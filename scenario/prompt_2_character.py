@@ -7,6 +7,24 @@ import re
 from collections import defaultdict
 
 
+# '나는 솔로' 이름 선택 가이드 (전체 생성/인물 목록 추출 프롬프트 공용)
+NAME_SELECTION_GUIDE = """【이름 선택 가이드】
+남성: 영수, 영호, 영식, 영철, 광수, 상철
+여성: 영숙, 정숙, 순자, 영자, 옥순, 현숙
+
+※ 중요: 줄거리에 이미 나온 이름(예: 광수, 옥순 등)은 그대로 사용하세요!
+
+【MBTI별 이름 매칭 참고】
+- 영수/영숙: ESTJ, ISTJ, ENTJ (리더형, 책임감)
+- 영호/정숙: ENFP, ESFP, ENTP (활발, 사교적)  
+- 영식/순자: ISFJ, ISFP, INFP (순수, 선량)
+- 영철/영자: ESTP, ISTP, ESTJ (강인함)
+- 광수/옥순: INTJ, ENTJ, ISTJ (엘리트) / ESFP, ENFP (매력적)
+- 상철/현숙: ISFJ, ISTJ, ESFJ (평범) / INTJ, ENTJ (세련됨)
+
+"""
+
+
 class CharacterGen:
     def __init__(self):
         # 나는 솔로 이름 풀
@@ -189,21 +207,7 @@ class CharacterGen:
 3. 각 인물의 행동과 상황을 분석하여 MBTI를 추론하세요
 4. 추론한 MBTI에 맞는 '나는 솔로' 이름을 아래 목록에서 선택하세요:
 
-【이름 선택 가이드】
-남성: 영수, 영호, 영식, 영철, 광수, 상철
-여성: 영숙, 정숙, 순자, 영자, 옥순, 현숙
-
-※ 중요: 줄거리에 이미 나온 이름(예: 광수, 옥순 등)은 그대로 사용하세요!
-
-【MBTI별 이름 매칭 참고】
-- 영수/영숙: ESTJ, ISTJ, ENTJ (리더형, 책임감)
-- 영호/정숙: ENFP, ESFP, ENTP (활발, 사교적)  
-- 영식/순자: ISFJ, ISFP, INFP (순수, 선량)
-- 영철/영자: ESTP, ISTP, ESTJ (강인함)
-- 광수/옥순: INTJ, ENTJ, ISTJ (엘리트) / ESFP, ENFP (매력적)
-- 상철/현숙: ISFJ, ISTJ, ESFJ (평범) / INTJ, ENTJ (세련됨)
-
-각 인물마다 3가지 다른 버전을 생성하세요:
+{NAME_SELECTION_GUIDE}각 인물마다 3가지 다른 버전을 생성하세요:
 
 1. 나이는 구체적으로 (20-60대 범위) - 각 버전마다 다르게
 2. 직업은 줄거리와 MBTI에 맞게 - 각 버전마다 다른 직업
@@ -238,8 +242,106 @@ JSON 형식으로 응답:
         
         return {
             "prompt": prompt,
+            "stage": "character",
             "references": [],  # 캐릭터 생성에는 레퍼런스 불필요
-            "selected_plot": selected_plot
+            "selected_plot": selected_plot,
+            "cacheable": True  # 같은 줄거리면 같은 프롬프트 → 캐시 재사용 가능
+        }
+    
+    def generate_cast(self, selected_plot):
+        """인물 목록 추출 프롬프트 생성 (인물별 분할 생성의 첫 단계)"""
+        plot_text = selected_plot.get('plot', '')
+        title = selected_plot.get('title', '')
+        
+        prompt = f"""선택된 줄거리에 등장하는 인물 목록을 정리해주세요.
+
+【줄거리】
+제목: {title}
+내용: {plot_text}
+
+【작업 지시사항】
+1. 줄거리에 등장하는 모든 인물을 찾아내세요
+2. 각 인물의 성별과 줄거리에서의 역할을 정리하세요
+3. 각 인물에게 어울리는 '나는 솔로' 이름을 아래 목록에서 선택하세요 (인물끼리 이름이 겹치지 않게):
+
+{NAME_SELECTION_GUIDE}JSON 형식으로 응답:
+{{
+    "cast": [
+        {{
+            "name": "이름",
+            "gender": "성별",
+            "role": "줄거리에서의 역할 (한 문장)"
+        }}
+    ]
+}}"""
+        
+        return {
+            "prompt": prompt,
+            "stage": "cast",
+            "references": [],
+            "selected_plot": selected_plot,
+            "cacheable": True,
+            "allow_dummy": False  # 실패 시 더미 캐릭터 대신 None
+        }
+    
+    def generate_character(self, selected_plot, member, cast):
+        """인물 한 명의 3가지 버전 생성 프롬프트 (인물별 분할 생성의 두 번째 단계)"""
+        plot_text = selected_plot.get('plot', '')
+        title = selected_plot.get('title', '')
+        name = member.get('name', '')
+        
+        others = "\n".join(
+            f"- {other.get('name', '')} ({other.get('gender', '')}): {other.get('role', '')}"
+            for other in cast if other.get('name') != name
+        ) or "- (없음)"
+        
+        prompt = f"""선택된 줄거리의 등장인물 '{name}'의 설정을 3가지 버전으로 생성해주세요.
+
+【줄거리】
+제목: {title}
+내용: {plot_text}
+
+【대상 인물】
+- {name} ({member.get('gender', '')}): {member.get('role', '')}
+
+【다른 등장인물】
+{others}
+
+【작업 지시사항】
+1. 인물의 행동과 상황을 분석하여 MBTI를 추론하세요
+2. 이름은 '{name}' 그대로 사용하세요
+3. 각 버전마다 나이(20-60대 범위), 직업, 고향(서울, 부산, 대구, 인천, 광주, 대전, 수원 등)을 다르게 하세요
+4. MBTI도 캐릭터에 어울리는 범위에서 다양하게
+5. 각 버전이 구별되는 특징을 가지도록
+
+JSON 형식으로 응답:
+{{
+    "versions": [
+        {{
+            "version": 1,
+            "name": "{name}",
+            "gender": "성별",
+            "age": 구체적나이,
+            "job": "직업",
+            "hometown": "고향",
+            "mbti": "MBTI",
+            "mbti_description": "MBTI 타입명과 기본 설명",
+            "personality_analysis": "성격적 특성과 행동 패턴 분석 (2-3줄)",
+            "trait": "핵심 특징 (MBTI 반영)"
+        }},
+        {{버전2}},
+        {{버전3}}
+    ]
+}}"""
+        
+        return {
+            "prompt": prompt,
+            "stage": "character_one",
+            "references": [],
+            "selected_plot": selected_plot,
+            "character_name": name,
+            "cacheable": True,
+            "allow_dummy": False
         }
 
 
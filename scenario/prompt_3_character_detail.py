@@ -1,11 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import json
+from prompt_budget import PromptBudget
+
+
+# 섹션별로 실제 참고하는 이전 섹션 (나머지 섹션과는 동시에 생성 가능)
+SECTION_DEPENDENCIES = {
+    'relationship': [],
+    'background': ['relationship'],
+    'shared_event': ['relationship', 'background'],
+    'daily_life': ['relationship'],
+    'secrets': ['background']
+}
 
 
 class CharacterDetailGen:
-    def __init__(self):
+    def __init__(self, budget=None):
+        self.budget = budget or PromptBudget()  # 이전 선택사항 분량 제한
+        
         # 섹션 타입 정의
         self.section_types = [
             'relationship',      # 관계 다이나믹스
@@ -45,12 +57,13 @@ class CharacterDetailGen:
             character_info += f"\n  특징: {char['trait']}"
             character_info += f"\n  성격: {char['personality_analysis']}\n"
         
-        # 이전 선택사항 정리
-        previous_info = ""
+        # 이전 선택사항 정리 (이 섹션이 참고하는 섹션만, 예산을 넘으면 오래된 섹션은 요약)
         if previous_selections:
-            for section, selection in previous_selections.items():
-                section_name = self.section_names.get(section, section)
-                previous_info += f"\n【{section_name}】\n{json.dumps(selection, ensure_ascii=False, indent=2)}\n"
+            previous_selections = {
+                section: selection for section, selection in previous_selections.items()
+                if section in SECTION_DEPENDENCIES.get(section_type, [])
+            }
+        previous_info = self.budget.fit_previous(previous_selections, self.section_names)
         
         # 섹션별 프롬프트 생성
         if section_type == 'relationship':
@@ -68,8 +81,10 @@ class CharacterDetailGen:
         
         return {
             "prompt": prompt,
+            "stage": "detail",
             "references": [],
-            "section_type": section_type
+            "section_type": section_type,
+            "components": {"previous_selections": previous_info}
         }
     
     def _generate_relationship_prompt(self, plot_text, title, character_info, characters_data):
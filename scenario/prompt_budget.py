@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+
+def estimate_tokens(text):
+    """
+    토큰 수 추정 (토크나이저 없이 빠르게)
+
+    한글 등 ASCII가 아닌 글자는 글자당 약 1토큰, ASCII는 약 4글자당 1토큰으로 계산
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def compact_reference(ref):
+    """프롬프트에 넣을 레퍼런스 (제목/줄거리만, 공백 없는 JSON)"""
+    return json.dumps(
+        {'title': ref.get('title', ''), 'plot': ref.get('plot', '')},
+        ensure_ascii=False, separators=(',', ':')
+    )
+
+
+class PromptBudget:
+    """
+    프롬프트 토큰 예산 관리
+
+    단계(plot, character, detail)별 목표 토큰 수 안에서 레퍼런스/이전 선택사항 양을 조정한다.
+    실제 응답 시간을 관찰해 목표치를 조정한다 (느리면 크게 줄이고, 빠르면 조금씩 늘림).
+    """
+
+    def __init__(self, target_tokens=6000, min_references=5, max_tokens=12000,
+                 min_tokens=2500, target_latency=60.0):
+        self.target_tokens = target_tokens  # 단계별 초기 목표 토큰 수
+        self.min_references = min_references  # 예산을 넘더라도 유지할 최소 레퍼런스 수
+        self.max_tokens = max_tokens  # 목표 토큰 수 상한
+        self.min_tokens = min_tokens  # 목표 토큰 수 하한
+        self.target_latency = target_latency  # 목표 응답 시간 (초)
+        self.increase_step = 250  # 빠를 때 늘리는 양 (토큰)
+        self.decrease_factor = 0.8  # 느릴 때 줄이는 비율
+        self._targets = {}  # 단계 -> 현재 목표 토큰 수
+        self._cut = {}  # 단계 -> 마지막으로 잘라낸 항목 수
+
+    def target(self, stage):
+        """단계별 현재 목표 토큰 수"""
+        return self._targets.get(stage, self.target_tokens)
+
+    def fit_references(self, stage, components, references):
+        """
+        예산 안에 들어가는 만큼 레퍼런스 선택
+
+        components: 레퍼런스를 제외한 구성 요소 (이름 -> 텍스트)
+        반환: (포함한 레퍼런스 목록, 프롬프트에 넣을 JSON 텍스트)
+        """
+        fixed = sum(estimate_tokens(text) for text in components.values())
+        available = self.target(stage) - fixed
+
+        kept = []
+        rendered = []
+        used = 2  # 대괄호
+        for ref in references:
+            text = compact_reference(ref)
+            cost = estimate_tokens(text) + 1
+            if used + cost > available and len(kept) >= self.min_references:
+                break
+            kept.append(ref)
+            rendered.append(text)
+            used += cost
+
+        cut = len(references) - len(kept)
+        self._cut[stage] = cut
+        if cut:
+            print(f"프롬프트 예산: 레퍼런스 {len(references)}개 중 {cut}개 제외 "
+                  f"(목표 {self.target(stage)} 토큰, 고정 {fixed} 토큰)")
+        return kept, "[\n" + ",\n".join(rendered) + "\n]"
+
+    def fit_previous(self, previous_selections, section_names, budget_tokens=None):
+        """
+        이전 섹션 선택사항을 예산 안의 텍스트로 정리
+
+        최근 섹션부터 전체 내용을 넣고, 예산을 넘으면 오래된 섹션은 제목/설명만 남긴다.
+        """
+        if not previous_selections:
+            return ""
+        limit = budget_tokens or self.target('detail') // 2
+
+        blocks = []
+        used = 0
+        trimmed = []
+        for section, selection in reversed(list(previous_selections.items())):
+            section_name = section_names.get(section, section)
+            body = json.dumps(selection, ensure_ascii=False, separators=(',', ':'))
+            cost = estimate_tokens(body)
+            if blocks and used + cost > limit and isinstance(selection, dict):
+                body = json.dumps(
+                    {'title': selection.get('title', ''), 'description': selection.get('description', '')},
+                    ensure_ascii=False, separators=(',', ':')
+                )
+                cost = estimate_tokens(body)
+                trimmed.append(section_name)
+            blocks.append(f"\n【{section_name}】\n{body}\n")
+            used += cost
+
+        self._cut['detail'] = len(trimmed)
+        if trimmed:
+            print(f"프롬프트 예산: 이전 선택사항 요약 ({', '.join(reversed(trimmed))})")
+        return "".join(reversed(blocks))
+
+    def breakdown(self, stage, components):
+        """구성 요소별 추정 토큰 수"""
+        result = {name: estimate_tokens(text) for name, text in components.items()}
+        result['total'] = sum(result.values())
+        result['target'] = self.target(stage)
+        result['cut'] = self._cut.get(stage, 0)
+        return result
+
+    def observe(self, stage, latency):
+        """
+        응답 시간 반영 (AIMD)
+
+        목표 응답 시간을 넘으면 목표 토큰 수를 비율로 줄이고,
+        목표의 절반보다 빠르면 조금씩 늘린다.
+        """
+        current = self.target(stage)
+        if latency > self.target_latency:
+            updated = max(self.min_tokens, int(current * self.decrease_factor))
+        elif latency < self.target_latency / 2:
+            updated = min(self.max_tokens, current + self.increase_step)
+        else:
+            return
+        if updated != current:
+            self._targets[stage] = updated
+            print(f"프롬프트 예산 조정 ({stage}): {current} → {updated} 토큰 (응답 {latency:.1f}초)")
+
+
+def dry_run():
+    """단계별 프롬프트 예산 보고 (claude 실행 없음)"""
+    from claude_interface import ClaudeInterface
+    from prompt_1_plot import PlotGen
+    from prompt_2_character import CharacterGen
+    from prompt_3_character_detail import CharacterDetailGen
+
+    claude = ClaudeInterface()
+
+    def report(label, prompt_data):
+        _, breakdown = claude.compose_command(prompt_data)
+        total = breakdown.pop('total')
+        target = breakdown.pop('target')
+        cut = breakdown.pop('cut')
+        print(f"\n[{label}] 합계 {total} / 목표 {target} 토큰" + (f" (제외 {cut}개)" if cut else ""))
+        for name, tokens in breakdown.items():
+            print(f"  {name:<22} {tokens:>6}")
+
+    plot_data = PlotGen(num=5).generate(seed=0)
+    report("plot", plot_data)
+
+    plot = plot_data['references'][0] if plot_data['references'] else {'title': '', 'plot': ''}
+    report("character", CharacterGen().generate(plot))
+
+    characters = [
+        {'name': '영수', 'gender': '남', 'age': 38, 'job': '회사원', 'mbti': 'ISTJ',
+         'trait': '무뚝뚝함', 'personality_analysis': '책임감이 강하지만 감정 표현이 서툼'},
+        {'name': '영숙', 'gender': '여', 'age': 35, 'job': '교사', 'mbti': 'ENFJ',
+         'trait': '다정함', 'personality_analysis': '주변을 잘 챙기지만 속으로 참는 편'},
+    ]
+    detail_gen = CharacterDetailGen(budget=claude.budget)
+    previous = {}
+    for section in detail_gen.section_types:
+        report(f"detail:{section}", detail_gen.generate_section(section, plot, characters, previous))
+        previous[section] = {
+            'option_number': 1,
+            'title': f'{detail_gen.section_names[section]} 예시',
+            'description': '예산 확인용 예시 선택 ' * 40
+        }
+
+
+if __name__ == "__main__":
+    dry_run()
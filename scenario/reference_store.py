@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+# 사용자 키워드 → 레퍼런스 태그 (process_references.py의 태그 기준)
+KEYWORD_TAGS = {
+    '불륜': '불륜', '외도': '불륜', '바람': '불륜', '내연': '불륜',
+    '시어머니': '고부갈등', '시댁': '고부갈등', '며느리': '고부갈등', '고부': '고부갈등',
+    '이혼': '이혼',
+    '의처증': '의처증', '의부증': '의처증', '집착': '의처증',
+}
+
+
+def episode_id(ref):
+    """에피소드의 고정 ID (제목+줄거리 해시, 파일 순서가 바뀌거나 다시 로드해도 같음)"""
+    text = f"{ref.get('title', '')}\n{ref.get('plot', '')}"
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+class _Snapshot:
+    """한 번 로드한 코퍼스와 색인 (로드할 때마다 새로 만들어 통째로 교체)"""
+
+    def __init__(self, references, keyword_cache_size):
+        self.references = references
+        self.ids = []  # 위치 -> 에피소드 ID
+        self.positions = {}  # 에피소드 ID -> 위치
+        tag_index = defaultdict(list)
+        strata = defaultdict(list)
+        bigram_index = defaultdict(set)
+        for idx, ref in enumerate(references):
+            ref_id = episode_id(ref)
+            if ref_id in self.positions:
+                # 제목과 줄거리가 같은 중복 에피소드
+                ref_id = f"{ref_id}-{idx}"
+            self.ids.append(ref_id)
+            self.positions[ref_id] = idx
+
+            tags = ref.get('tags', [])
+            for tag in tags:
+                tag_index[tag].append(idx)
+            strata[tags[0] if tags else ''].append(idx)
+
+            text = f"{ref.get('title', '')} {ref.get('plot', '')}"
+            for i in range(len(text) - 1):
+                bigram_index[text[i:i+2]].add(idx)
+
+        self.tag_index = dict(tag_index)  # 태그 -> 위치 목록
+        self.strata = list(strata.values())  # 층화 추출용 그룹 (첫 번째 태그 기준, 태그 없음 포함)
+        self.bigram_index = dict(bigram_index)  # 2글자 -> 위치 집합
+        self.keyword_cache = OrderedDict()  # 키워드 -> 일치하는 위치 목록 (최근 사용 순)
+        self.keyword_cache_size = keyword_cache_size
+        self.cache_lock = threading.Lock()
+
+
+class ReferenceStore:
+    """
+    레퍼런스 에피소드 공유 저장소 (프로세스당 파일별로 한 번만 로드)
+
+    파일이 바뀌면 다음 접근 시 다시 로드하므로 재시작 없이 코퍼스를 갱신할 수 있다.
+    로드할 때 태그 색인과 제목/줄거리 2글자 색인(역색인)을 함께 만든다.
+    에피소드는 파일 속 위치 대신 고정 ID(episode_id)로 주고받으므로
+    사용자별로 기억한 ID는 다시 로드한 뒤에도 같은 에피소드를 가리킨다.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path, check_interval=2.0, keyword_cache_size=1024):
+        self.path = path
+        self.check_interval = check_interval  # 파일 변경 확인 최소 간격 (초)
+        self.keyword_cache_size = keyword_cache_size  # 키워드 검색 결과를 기억할 최대 수
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._mtime = None
+        self._last_check = 0.0
+        self._load()
+
+    @classmethod
+    def default_path(cls):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(base_dir, 'references/processed/lovewar.json')
+
+    @classmethod
+    def get(cls, path=None):
+        """경로별 공유 인스턴스 반환"""
+        path = os.path.abspath(path or cls.default_path())
+        with cls._instances_lock:
+            store = cls._instances.get(path)
+            if store is None:
+                store = cls(path)
+                cls._instances[path] = store
+        return store
+
+    def _load(self):
+        """파일 로드 (색인을 모두 만든 뒤 한 번에 교체하므로 읽는 쪽은 항상 일관된 상태를 봄)"""
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, 'r', encoding='utf-8') as f:
+            references = json.load(f)
+        self._snapshot = _Snapshot(references, self.keyword_cache_size)
+        self._mtime = mtime
+        print(f"레퍼런스 로드: {len(references)}개 ({os.path.basename(self.path)})")
+
+    def _refresh_if_changed(self):
+        """파일이 바뀌었으면 다시 로드 (확인은 check_interval마다 한 번)"""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            if now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return
+            if mtime != self._mtime:
+                try:
+                    self._load()
+                except (OSError, ValueError) as e:
+                    # 저장 도중 읽은 경우 등: 기존 데이터 유지
+                    print(f"레퍼런스 다시 로드 실패: {e}")
+
+    def _current(self):
+        """현재 스냅샷 (한 작업 안에서는 같은 스냅샷만 사용)"""
+        self._refresh_if_changed()
+        return self._snapshot
+
+    @property
+    def references(self):
+        """현재 레퍼런스 목록 (읽기 전용으로 사용)"""
+        return self._current().references
+
+    def __len__(self):
+        return len(self.references)
+
+    def sample(self, k, rng=None):
+        """
+        레퍼런스 k개 무작위 선택
+
+        random.sample은 모집단이 k보다 충분히 크면 인덱스 집합 방식으로 동작하므로
+        코퍼스 크기와 관계없이 O(k)이며 목록을 복사하지 않는다.
+        """
+        rng = rng or random
+        references = self.references
+        return rng.sample(references, min(k, len(references)))
+
+    def ids_for_keyword(self, keyword):
+        """키워드가 제목/줄거리에 있거나 관련 태그가 붙은 에피소드 ID 목록"""
+        snapshot = self._current()
+        return [snapshot.ids[idx] for idx in self._match(snapshot, keyword)]
+
+    def _match(self, snapshot, keyword):
+        """키워드와 일치하는 위치 목록 (스냅샷별로 최근 keyword_cache_size개 기억)"""
+        keyword = keyword.strip()
+        if not keyword:
+            return []
+        with snapshot.cache_lock:
+            cached = snapshot.keyword_cache.get(keyword)
+            if cached is not None:
+                snapshot.keyword_cache.move_to_end(keyword)
+                return cached
+        
+        references = snapshot.references
+        if len(keyword) < 2:
+            # 한 글자는 색인으로 좁힐 수 없으므로 전체 확인
+            candidates = range(len(references))
+        else:
+            # 키워드의 모든 2글자를 포함하는 에피소드만 후보로 (가장 작은 목록부터 교집합)
+            postings = [snapshot.bigram_index.get(keyword[i:i+2], set()) for i in range(len(keyword) - 1)]
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        
+        ids = set(
+            idx for idx in candidates
+            if keyword in references[idx].get('title', '') or keyword in references[idx].get('plot', '')
+        )
+        tag = KEYWORD_TAGS.get(keyword)
+        if tag:
+            ids.update(snapshot.tag_index.get(tag, []))
+        
+        result = sorted(ids)
+        with snapshot.cache_lock:
+            snapshot.keyword_cache[keyword] = result
+            while len(snapshot.keyword_cache) > snapshot.keyword_cache_size:
+                snapshot.keyword_cache.popitem(last=False)
+        return result
+    
+    def sample_references(self, k, keywords=None, exclude=None, rng=None, matched_ratio=0.7):
+        """
+        레퍼런스 k개 선택 (키워드 일치 우선 + 태그별 층화 추출)
+        
+        keywords: 사용자 키워드 (일치하는 에피소드를 최대 k * matched_ratio개 우선 선택)
+        exclude: 제외할 에피소드 ID (사용자가 이미 받은 것)
+        반환: (에피소드 ID 목록, 레퍼런스 목록, exclude를 무시하고 처음부터 다시 뽑았는지 여부)
+        선택과 조회를 같은 스냅샷에서 하므로 도중에 파일이 다시 로드되어도 ID와 내용이 어긋나지 않는다.
+        """
+        rng = rng or random
+        snapshot = self._current()
+        total = len(snapshot.references)
+        k = min(k, total)
+        
+        # 지금 코퍼스에 없는 ID(삭제된 에피소드, 예전 형식의 번호)는 무시
+        exclude = set(snapshot.positions[ref_id] for ref_id in (exclude or []) if ref_id in snapshot.positions)
+        reset = False
+        if total - len(exclude) < k:
+            # 남은 에피소드가 부족하면 처음부터 다시
+            exclude = set()
+            reset = True
+        
+        chosen = []
+        chosen_set = set()
+        
+        # 1. 키워드 일치 에피소드
+        if keywords:
+            matched = set()
+            for keyword in keywords:
+                matched.update(self._match(snapshot, keyword))
+            matched = sorted(matched - exclude)
+            take = min(len(matched), int(k * matched_ratio))
+            for idx in rng.sample(matched, take):
+                chosen.append(idx)
+                chosen_set.add(idx)
+        
+        # 2. 나머지는 태그 그룹별 크기에 비례해 추출 (그룹마다 최소 1개)
+        remaining = k - len(chosen)
+        if remaining > 0:
+            chosen.extend(self._stratified(snapshot.strata, remaining, exclude, chosen_set, rng))
+        
+        return [snapshot.ids[idx] for idx in chosen], [snapshot.references[idx] for idx in chosen], reset
+    
+    def sample_ids(self, k, keywords=None, exclude=None, rng=None, matched_ratio=0.7):
+        """레퍼런스 ID k개 선택 (반환: (ID 목록, 처음부터 다시 뽑았는지 여부))"""
+        ids, _, reset = self.sample_references(k, keywords, exclude, rng, matched_ratio)
+        return ids, reset
+    
+    def _stratified(self, strata, k, blocked, picked_set, rng):
+        """
+        태그 그룹별 비례 할당 후 그룹 안에서 무작위 추출 (blocked, picked_set 제외)
+
+        picked_set: 이미 고른 에피소드 (뽑을 때마다 추가, 그룹마다 집합을 새로 만들지 않음)
+        """
+        total = sum(len(group) for group in strata)
+        if total == 0:
+            return []
+        quotas = [max(1, k * len(group) // total) for group in strata]
+        
+        # 할당 합계를 k에 맞춤 (넘치면 작은 그룹부터 줄이고, 모자라면 큰 그룹부터 늘림)
+        order = sorted(range(len(strata)), key=lambda i: -len(strata[i]))
+        i = 0
+        while sum(quotas) > k:
+            j = order[-1 - (i % len(order))]
+            if quotas[j] > 0:
+                quotas[j] -= 1
+            i += 1
+        i = 0
+        while sum(quotas) < k:
+            quotas[order[i % len(order)]] += 1
+            i += 1
+        
+        picked = []
+        shortage = 0
+        for group, quota in zip(strata, quotas):
+            got = self._draw(group, quota, blocked, picked_set, rng)
+            picked.extend(got)
+            shortage += quota - len(got)
+        
+        if shortage > 0:
+            # 일부 그룹이 부족하면 전체에서 보충
+            everything = [idx for group in strata for idx in group]
+            picked.extend(self._draw(everything, shortage, blocked, picked_set, rng))
+        
+        return picked
+    
+    def _draw(self, group, count, blocked, picked_set, rng):
+        """그룹에서 blocked와 picked_set을 피해 count개 추출 (거절 샘플링, 실패 시 전체 확인, 뽑은 것은 picked_set에 추가)"""
+        picked = []
+        attempts = 0
+        while len(picked) < count and attempts < count * 4:
+            idx = group[rng.randrange(len(group))]
+            attempts += 1
+            if idx in blocked or idx in picked_set:
+                continue
+            picked.append(idx)
+            picked_set.add(idx)
+        
+        if len(picked) < count:
+            rest = [idx for idx in group if idx not in blocked and idx not in picked_set]
+            extra = rng.sample(rest, min(len(rest), count - len(picked)))
+            picked.extend(extra)
+            picked_set.update(extra)
+        return picked
+    
+    def get_many(self, ids):
+        """에피소드 ID 목록에 해당하는 레퍼런스 (지금 코퍼스에 없는 ID는 건너뜀)"""
+        snapshot = self._current()
+        return [snapshot.references[snapshot.positions[ref_id]] for ref_id in ids if ref_id in snapshot.positions]
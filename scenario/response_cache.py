@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+
+# 매번 다른 응답을 유도하기 위해 프롬프트에 섞는 랜덤 조각 (캐시 키에서 제외)
+NONCE_PATTERNS = [
+    re.compile(r'\[시드: [^\]]*\]'),
+    re.compile(r'\(변형코드: \d+\)'),
+    re.compile(r'#버전\d+'),
+    re.compile(r'※ 고유번호: \d+'),
+    re.compile(r'∞ 변화값: [\d.]+'),
+]
+
+
+def canonical_prompt(text, ignore=()):
+    """랜덤 조각과 공백 차이를 제거한 정규화 프롬프트"""
+    for fragment in ignore:
+        text = text.replace(fragment, '')
+    for pattern in NONCE_PATTERNS:
+        text = pattern.sub('', text)
+    return ' '.join(text.split())
+
+
+def cache_key(text, seed=None, ignore=(), namespace=None):
+    """
+    정규화 프롬프트 + 시드 기반 캐시 키 (sha256)
+
+    namespace: 실제 모델이 아닌 응답(가짜/재생 백엔드)을 구분하는 이름 (같은 프롬프트라도 다른 키)
+    """
+    canonical = canonical_prompt(text, ignore)
+    digest = hashlib.sha256(canonical.encode('utf-8'))
+    digest.update(f"\0seed={seed}".encode('utf-8'))
+    if namespace:
+        digest.update(f"\0backend={namespace}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    프롬프트 응답 디스크 캐시 (TTL + 전체 크기 제한, 오래 안 쓴 항목부터 삭제)
+
+    비동기 코드에서는 디스크 접근이 이벤트 루프를 막지 않도록 스레드에서 호출하므로 스레드 안전하게 동작한다.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=50 * 1024 * 1024, ttl=7 * 24 * 3600):
+        if cache_dir is None:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+            cache_dir = os.path.join(base_dir, 'cache/responses')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes  # 캐시 전체 최대 크기
+        self.ttl = ttl  # 항목 유효 기간 (초), None이면 만료 없음
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = None  # 첫 정리 시 계산
+        self._size_lock = threading.Lock()  # 전체 크기 기록/정리 보호
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """캐시된 응답 조회 (없거나 만료되면 None)"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self.ttl is not None and time.time() - entry.get('created_at', 0) > self.ttl:
+            self._remove(path)
+            return None
+
+        # 최근 사용 시각 갱신 (LRU 정리 기준)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get('response')
+
+    def put(self, key, response):
+        """응답 저장"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        data = json.dumps({
+            'key': key,
+            'created_at': time.time(),
+            'response': response
+        }, ensure_ascii=False)
+
+        # 임시 파일에 쓴 뒤 교체 (동시 접근 시 깨진 파일 방지)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._size_lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(data.encode('utf-8'))
+            self._evict_if_needed()
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._size_lock:
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def _entries(self):
+        """(최근 사용 시각, 크기, 경로) 목록"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict_if_needed(self):
+        """크기 제한을 넘으면 오래 안 쓴 항목부터 삭제 (_size_lock을 잡은 상태에서 호출)"""
+        if self._total_bytes is not None and self._total_bytes <= self.max_bytes:
+            return
+
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            # 여유를 두고 90%까지 줄임
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+        self._total_bytes = total
+
+    def clear(self):
+        """캐시 전체 삭제"""
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._size_lock:
+            self._total_bytes = 0
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+
+from metrics import METRICS
+
+
+class RequestSuperseded(Exception):
+    """같은 사용자의 더 새로운 요청으로 대체되어 취소된 요청"""
+
+
+class GenerationScheduler:
+    """LLM 생성 작업 스케줄러 (동시 실행 수 제한 + 사용자별 라운드로빈)"""
+
+    # 우선순위 (숫자가 작을수록 먼저 처리)
+    INTERACTIVE = 0  # 사용자가 기다리는 요청
+    BACKGROUND = 1   # 미리 생성 등 백그라운드 작업
+
+    def __init__(self, max_concurrency=3, max_pending_per_user=1, max_background=None):
+        self.max_concurrency = max_concurrency  # 동시에 실행할 claude 프로세스 수
+        self.max_pending_per_user = max_pending_per_user  # 사용자별 대기 가능한 요청 수
+        # 백그라운드 작업이 동시에 쓸 수 있는 슬롯 수 (기본: 사용자 요청용으로 한 슬롯은 남겨 둠)
+        if max_background is None:
+            max_background = max(1, max_concurrency - 1)
+        self.max_background = max_background
+
+        # 우선순위별 대기열: user_id -> deque(작업)
+        # OrderedDict 순서가 곧 라운드로빈 순서
+        self._queues = {
+            self.INTERACTIVE: OrderedDict(),
+            self.BACKGROUND: OrderedDict()
+        }
+        self._running = 0
+        self._running_background = 0
+        self._wait_times = deque(maxlen=500)  # 최근 대기 시간 (초)
+        self._completed = 0
+
+    async def submit(self, user_id, job, priority=INTERACTIVE):
+        """
+        작업 제출 후 결과 대기
+
+        user_id: 공정성 기준이 되는 사용자 ID
+        job: 인자 없이 호출하면 코루틴을 반환하는 함수
+        priority: INTERACTIVE 또는 BACKGROUND
+        """
+        loop = asyncio.get_running_loop()
+        entry = {
+            'job': job,
+            'future': loop.create_future(),
+            'enqueued_at': time.monotonic(),
+            # 다른 작업이 끝난 뒤 시작되더라도 제출한 쪽의 세션으로 기록되도록 컨텍스트 보관
+            'context': contextvars.copy_context(),
+            'task': None,  # 실행 중인 작업 (슬롯을 받은 뒤 설정)
+            'user_id': user_id,
+            'priority': priority
+        }
+        # 기다리던 쪽이 취소되면 실행 중인 작업도 취소 (claude 프로세스가 슬롯을 계속 차지하지 않도록)
+        entry['future'].add_done_callback(lambda future: self._on_done(entry, future))
+
+        queue = self._queues[priority].setdefault(user_id, deque())
+
+        # 같은 사용자가 연타하면 오래된 대기 요청은 새 요청으로 대체
+        while len(queue) >= self.max_pending_per_user:
+            old = queue.popleft()
+            if not old['future'].done():
+                old['future'].set_exception(RequestSuperseded())
+
+        queue.append(entry)
+        self._dispatch()
+        return await entry['future']
+
+    def _on_done(self, entry, future):
+        """요청이 취소되면 실행 중인 작업은 취소하고 대기 중인 작업은 대기열에서 제거"""
+        if not future.cancelled():
+            return
+        if entry['task'] is not None:
+            entry['task'].cancel()
+            return
+        queues = self._queues[entry['priority']]
+        queue = queues.get(entry['user_id'])
+        if queue is not None and entry in queue:
+            queue.remove(entry)
+            if not queue:
+                del queues[entry['user_id']]
+
+    def promote(self, user_id):
+        """대기 중인 백그라운드 작업을 사용자 요청 우선순위로 올림 (이미 실행 중이면 그대로)"""
+        queue = self._queues[self.BACKGROUND].pop(user_id, None)
+        if not queue:
+            return
+        target = self._queues[self.INTERACTIVE].setdefault(user_id, deque())
+        for entry in queue:
+            entry['priority'] = self.INTERACTIVE
+            target.append(entry)
+        self._dispatch()
+
+    def _next_entry(self):
+        """우선순위 순으로, 같은 우선순위 안에서는 사용자 순환으로 다음 작업 선택"""
+        for priority in (self.INTERACTIVE, self.BACKGROUND):
+            if priority == self.BACKGROUND and self._running_background >= self.max_background:
+                # 백그라운드 작업이 모든 슬롯을 오래 차지하지 않도록 제한
+                continue
+            queues = self._queues[priority]
+            while queues:
+                user_id, queue = next(iter(queues.items()))
+                if not queue:
+                    del queues[user_id]
+                    continue
+                entry = queue.popleft()
+                # 남은 작업이 있으면 맨 뒤로 보내서 다른 사용자에게 차례를 넘김
+                if queue:
+                    queues.move_to_end(user_id)
+                else:
+                    del queues[user_id]
+                return entry
+        return None
+
+    def _dispatch(self):
+        """실행 슬롯이 남아있으면 대기 작업 시작"""
+        while self._running < self.max_concurrency:
+            entry = self._next_entry()
+            if entry is None:
+                return
+            if entry['future'].done():
+                # 대기 중 취소된 요청
+                continue
+            self._running += 1
+            # 실행 도중 promote되어도 슬롯은 시작할 때의 우선순위로 계산
+            entry['background'] = entry['priority'] == self.BACKGROUND
+            if entry['background']:
+                self._running_background += 1
+            entry['waited'] = time.monotonic() - entry['enqueued_at']
+            self._wait_times.append(entry['waited'])
+            entry['task'] = entry['context'].run(asyncio.ensure_future, self._run(entry))
+
+    async def _run(self, entry):
+        """작업 실행 후 결과 전달"""
+        try:
+            METRICS.queued(entry['waited'])
+            result = await entry['job']()
+        except Exception as e:
+            if not entry['future'].done():
+                entry['future'].set_exception(e)
+        else:
+            if not entry['future'].done():
+                entry['future'].set_result(result)
+        finally:
+            self._running -= 1
+            if entry['background']:
+                self._running_background -= 1
+            self._completed += 1
+            self._dispatch()
+
+    def queue_depth(self, priority=None):
+        """대기 중인 작업 수"""
+        priorities = [priority] if priority is not None else list(self._queues)
+        return sum(
+            len(queue)
+            for p in priorities
+            for queue in self._queues[p].values()
+        )
+
+    def stats(self):
+        """스케줄러 상태 (대기열 길이, 대기 시간)"""
+        waits = sorted(self._wait_times)
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(len(waits) * p))]
+
+        return {
+            'running': self._running,
+            'running_background': self._running_background,
+            'max_concurrency': self.max_concurrency,
+            'queued_interactive': self.queue_depth(self.INTERACTIVE),
+            'queued_background': self.queue_depth(self.BACKGROUND),
+            'completed': self._completed,
+            'wait_avg': sum(waits) / len(waits) if waits else 0.0,
+            'wait_p50': percentile(0.5),
+            'wait_p95': percentile(0.95),
+            'wait_max': waits[-1] if waits else 0.0
+        }
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+
+
+class SessionStore:
+    """
+    생성 결과 저장소 (추가 전용, SQLite 색인)
+
+    단계별 결과(artifact)를 한 행씩 추가하고, 이전 단계 결과는 복사하지 않고 번호로 참조한다.
+    사용자/단계/시간 색인으로 디렉터리를 훑지 않고 조회하며, 오래된 결과는 zlib으로 압축한다.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+            path = os.path.join(base_dir, 'state/sessions.db')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS artifact (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                compressed INTEGER NOT NULL DEFAULT 0,
+                payload BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS artifact_user_stage ON artifact (user_id, stage, created_at);
+            CREATE INDEX IF NOT EXISTS artifact_stage_time ON artifact (stage, created_at);
+            CREATE TABLE IF NOT EXISTS artifact_parent (
+                artifact_id INTEGER NOT NULL,
+                parent_id INTEGER NOT NULL,
+                PRIMARY KEY (artifact_id, parent_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS artifact_parent_rev ON artifact_parent (parent_id);
+        """)
+
+    @staticmethod
+    def _encode(payload):
+        return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def _decode(blob, compressed):
+        if compressed:
+            blob = zlib.decompress(blob)
+        return json.loads(bytes(blob).decode('utf-8'))
+
+    def append(self, user_id, stage, payload, parents=(), created_at=None):
+        """결과 추가 (반환: artifact 번호)"""
+        created_at = created_at or time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                cursor = self._conn.execute(
+                    "INSERT INTO artifact (user_id, stage, created_at, payload) VALUES (?, ?, ?, ?)",
+                    (user_id, stage, created_at, self._encode(payload))
+                )
+                artifact_id = cursor.lastrowid
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO artifact_parent (artifact_id, parent_id) VALUES (?, ?)",
+                    [(artifact_id, parent_id) for parent_id in parents]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return artifact_id
+
+    def _row(self, row):
+        artifact_id, user_id, stage, created_at, compressed, payload = row
+        parents = [r[0] for r in self._conn.execute(
+            "SELECT parent_id FROM artifact_parent WHERE artifact_id = ?", (artifact_id,)
+        )]
+        return {
+            'id': artifact_id,
+            'user_id': user_id,
+            'stage': stage,
+            'created_at': created_at,
+            'parents': parents,
+            'payload': self._decode(payload, compressed)
+        }
+
+    def get(self, artifact_id):
+        """번호로 조회 (없으면 None)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, user_id, stage, created_at, compressed, payload FROM artifact WHERE id = ?",
+                (artifact_id,)
+            ).fetchone()
+            return self._row(row) if row else None
+
+    def find(self, user_id=None, stage=None, since=None, until=None, limit=50):
+        """사용자/단계/기간으로 조회 (최신순)"""
+        where = []
+        params = []
+        for column, op, value in (
+            ('user_id', '=', user_id), ('stage', '=', stage),
+            ('created_at', '>=', since), ('created_at', '<', until)
+        ):
+            if value is not None:
+                where.append(f"{column} {op} ?")
+                params.append(value)
+        sql = "SELECT id, user_id, stage, created_at, compressed, payload FROM artifact"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [self._row(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def latest(self, user_id, stage):
+        """사용자의 해당 단계 최신 결과"""
+        found = self.find(user_id=user_id, stage=stage, limit=1)
+        return found[0] if found else None
+
+    def lineage(self, artifact_id):
+        """결과와 그 상위 단계 결과 전체 (자신부터 위로)"""
+        result = []
+        seen = set()
+        queue = [artifact_id]
+        while queue:
+            current = queue.pop(0)
+            if current in seen:
+                continue
+            seen.add(current)
+            artifact = self.get(current)
+            if artifact is None:
+                continue
+            result.append(artifact)
+            queue.extend(artifact['parents'])
+        return result
+
+    def compact(self, older_than=7 * 24 * 3600, batch=500):
+        """오래된 결과 압축 (반환: 압축한 개수)"""
+        cutoff = time.time() - older_than
+        total = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, payload FROM artifact WHERE compressed = 0 AND created_at < ? LIMIT ?",
+                    (cutoff, batch)
+                ).fetchall()
+                if not rows:
+                    break
+                self._conn.execute("BEGIN")
+                try:
+                    self._conn.executemany(
+                        "UPDATE artifact SET payload = ?, compressed = 1 WHERE id = ?",
+                        [(zlib.compress(bytes(payload), 9), artifact_id) for artifact_id, payload in rows]
+                    )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            total += len(rows)
+        return total
+
+    def import_outputs(self, outputs_dir):
+        """예전 outputs/user_<id>/plots_*.json, characters_*.json 파일 가져오기 (반환: 가져온 개수)"""
+        pattern = re.compile(r'(plots|characters)_(\d{8}_\d{6})\.json$')
+        imported = 0
+        for entry in sorted(os.listdir(outputs_dir)):
+            match = re.match(r'user_(\d+)$', entry)
+            if not match:
+                continue
+            user_id = int(match.group(1))
+            user_dir = os.path.join(outputs_dir, entry)
+
+            # 시간순으로 넣어서 캐릭터 결과가 직전 줄거리 결과를 참조하도록 함
+            files = []
+            for name in os.listdir(user_dir):
+                found = pattern.match(name)
+                if found:
+                    files.append((found.group(2), found.group(1), name))
+            last_plots = None
+            for timestamp, stage, name in sorted(files):
+                with open(os.path.join(user_dir, name), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                created_at = datetime.strptime(timestamp, "%Y%m%d_%H%M%S").timestamp()
+                if stage == 'plots':
+                    last_plots = self.append(user_id, 'plots', data, created_at=created_at)
+                else:
+                    self.append(user_id, 'characters', data,
+                                parents=[last_plots] if last_plots else [], created_at=created_at)
+                imported += 1
+        return imported
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    # 사용법: python session_store.py import <outputs 디렉터리> | compact [일수]
+    store = SessionStore()
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'import' and len(sys.argv) > 2:
+        print(f"가져온 결과: {store.import_outputs(sys.argv[2])}개")
+    elif command == 'compact':
+        days = float(sys.argv[2]) if len(sys.argv) > 2 else 7
+        print(f"압축한 결과: {store.compact(older_than=days * 24 * 3600)}개")
+    else:
+        print("사용법: python session_store.py import <outputs 디렉터리> | compact [일수]")
+    store.close()
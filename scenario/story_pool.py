@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+
+from prompt_1_plot import PlotGen
+from plot_batcher import PlotBatcher
+from scheduler import GenerationScheduler
+
+
+TONES = ['기본', '자극적', '현실적', '충격적', '선정적']
+
+
+class StoryPool:
+    """
+    미리 생성해 둔 줄거리 풀 (톤 + 키워드 조합별)
+
+    재생성 요청은 풀에서 바로 꺼내 쓰고, 줄어든 만큼은 백그라운드 우선순위로 다시 채운다.
+    톤만 있는 기본 조합은 항상 채우고, 키워드 조합은 min_requests번 이상 요청된(인기 있는) 것만 채운다.
+    키워드 조합은 최근에 요청된 것만 유지하고, 오래된 스토리는 버린다.
+    """
+
+    def __init__(self, claude, scheduler, capacity=10, refill_size=5, max_profiles=12, ttl=3600,
+                 min_requests=3, max_tracked=256):
+        self.claude = claude
+        self.scheduler = scheduler
+        self.capacity = capacity  # 조합별 최대 보관 수
+        self.refill_size = refill_size  # 한 번에 채우는 수
+        self.max_profiles = max_profiles  # 유지할 조합 수 (톤만 있는 기본 조합 포함)
+        self.ttl = ttl  # 스토리 유효 기간 (초)
+        self.min_requests = min_requests  # 키워드 조합을 풀로 만들기 전까지 필요한 요청 수
+        self.max_tracked = max_tracked  # 요청 수를 기억할 최대 키워드 조합 수
+        self._requests = OrderedDict()  # 아직 풀이 없는 키워드 조합 -> 요청 수, 최근 요청 순
+        self._pools = OrderedDict()  # (톤, 키워드) -> deque((생성 시각, 스토리)), 최근 사용 순
+        self._refilling = set()  # 채우는 중인 조합
+        self.hits = 0
+        self.misses = 0
+
+    def _pool(self, key):
+        """조합별 풀 (없으면 만들고, 조합 수를 넘으면 오래 안 쓴 키워드 조합부터 삭제)"""
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = deque()
+            self._pools[key] = pool
+            while len(self._pools) > self.max_profiles:
+                victim = next((k for k in self._pools if k[1] and k != key), None)
+                if victim is None:
+                    break
+                del self._pools[victim]
+        self._pools.move_to_end(key)
+        return pool
+
+    def _expire(self, pool):
+        """유효 기간이 지난 스토리 제거"""
+        now = time.time()
+        while pool and now - pool[0][0] > self.ttl:
+            pool.popleft()
+
+    def take(self, tone, keywords, count):
+        """풀에서 스토리를 최대 count개 꺼냄 (부족한 만큼은 호출한 쪽에서 생성) 후 다시 채우기 예약"""
+        key = PlotBatcher.batch_key(tone, keywords)
+        if key not in self._pools and not self._popular(key):
+            # 한두 번 쓰고 마는 키워드 조합은 미리 생성하지 않음
+            self.misses += count
+            return []
+        pool = self._pool(key)
+        self._expire(pool)
+
+        stories = []
+        while pool and len(stories) < count:
+            stories.append(pool.popleft()[1])
+        self.hits += len(stories)
+        self.misses += count - len(stories)
+
+        self.refill(key)
+        return stories
+
+    def _popular(self, key):
+        """키워드 조합의 요청 수를 세고 풀을 만들 만큼 요청되었는지 확인 (톤만 있는 조합은 항상 True)"""
+        if not key[1]:
+            return True
+        count = self._requests.pop(key, 0) + 1
+        if count >= self.min_requests:
+            return True
+        self._requests[key] = count
+        while len(self._requests) > self.max_tracked:
+            self._requests.popitem(last=False)
+        return False
+
+    def refill(self, key):
+        """풀이 가득 차지 않았으면 백그라운드로 채우기 (조합별로 한 번에 하나만)"""
+        if key in self._refilling or key not in self._pools:
+            return
+        if len(self._pools[key]) >= self.capacity:
+            return
+        self._refilling.add(key)
+        # 요청한 사용자와 무관한 백그라운드 작업이므로 빈 컨텍스트에서 시작 (사용자 세션 추적에서 제외)
+        contextvars.Context().run(asyncio.ensure_future, self._refill(key))
+
+    async def _refill(self, key):
+        tone, keywords = key
+        try:
+            plot_gen = await asyncio.to_thread(PlotGen, num=self.refill_size, keywords=list(keywords))
+            prompt_data = plot_gen.generate()
+            prompt_data['tone'] = tone
+            response = await self.scheduler.submit(
+                ('pool', key), lambda: self.claude.execute_prompt_async(prompt_data),
+                GenerationScheduler.BACKGROUND
+            )
+        except Exception as e:
+            print(f"줄거리 풀 채우기 실패 ({tone}, {', '.join(keywords) or '키워드 없음'}): {e}")
+            return
+        finally:
+            self._refilling.discard(key)
+
+        pool = self._pools.get(key)
+        if pool is None:
+            # 채우는 동안 조합이 삭제됨
+            return
+        now = time.time()
+        added = 0
+        for story in (response or {}).get('stories', []):
+            # 실패 시 반환되는 더미 스토리는 보관하지 않음
+            if story.get('title') and story.get('plot') and not story['title'].startswith('임시 제목'):
+                pool.append((now, story))
+                added += 1
+        while len(pool) > self.capacity:
+            pool.popleft()
+
+        # 아직 부족하면 이어서 채움 (생성에 실패했으면 다음 요청 때 다시 시도)
+        if added:
+            self.refill(key)
+
+    def warm(self, tones=TONES):
+        """톤별 기본 조합(키워드 없음) 채우기 시작"""
+        for tone in tones:
+            key = PlotBatcher.batch_key(tone, [])
+            self._pool(key)
+            self.refill(key)
+
+    def stats(self):
+        """풀 상태 (조합별 보관 수, 적중률)"""
+        total = self.hits + self.misses
+        return {
+            'profiles': {f"{tone}/{','.join(keywords)}": len(pool) for (tone, keywords), pool in self._pools.items()},
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
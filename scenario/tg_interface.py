@@ -1,40 +1,128 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import json
-import os
 import asyncio
-from datetime import datetime
+import functools
+import os
+import time
+import weakref
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 
-from prompt_1_plot import PlotGen
 from prompt_2_character import CharacterGen
 from claude_interface import ClaudeInterface
+from scheduler import GenerationScheduler, RequestSuperseded
+from response_cache import ResponseCache
+from plot_batcher import PlotBatcher
+from story_pool import StoryPool
+from user_state_store import UserStateStore
+from tg_render import MessageRenderer
+from session_store import SessionStore
+from character_fanout import CharacterFanout
+from metrics import METRICS
+from diagnostics import Diagnostics
+
+
+def user_update(handler):
+    """
+    사용자 업데이트 핸들러 공통 처리
+
+    - 이 업데이트에서 생기는 구간은 사용자 세션 추적에 기록
+    - 같은 사용자의 업데이트는 하나씩 처리 (다른 사용자의 업데이트는 동시에 처리)
+    - 처리 중에는 상태를 캐시에서 제거하지 않고, 끝나면 저장 대상으로 표시 (도중에 수정한 것도 저장되도록)
+    """
+    @functools.wraps(handler)
+    async def wrapped(self, update, context):
+        user_id = update.effective_user.id
+        METRICS.bind_session(user_id)
+        self.user_states.hold(user_id)
+        try:
+            async with self._user_lock(user_id):
+                return await handler(self, update, context)
+        finally:
+            self.user_states.release(user_id)
+    return wrapped
 
 
 class TelegramScenarioBot:
-    def __init__(self, token):
+    def __init__(self, token, max_concurrency=3, state_path=None, character_fanout=True, session_path=None):
         self.token = token
-        self.claude = ClaudeInterface()
+        # 같은 줄거리의 캐릭터 프롬프트 등은 캐시에서 바로 응답
+        self.claude = ClaudeInterface(cache=ResponseCache())
+        
+        # claude 프로세스 동시 실행 수 제한 및 사용자 간 공정한 순서 보장
+        self.scheduler = GenerationScheduler(max_concurrency=max_concurrency)
+        
+        # 동시에 들어온 줄거리 요청을 묶어서 claude 호출 횟수 절감
+        self.plot_batcher = PlotBatcher(self.claude, self.scheduler)
+        
+        # 캐릭터는 인물별로 나눠 동시에 생성 (실패한 인물만 다시 생성 가능)
+        self.character_fanout = CharacterFanout(self.claude, self.scheduler) if character_fanout else None
+        
+        # 단계별 생성 결과 저장 (이전 단계 결과는 번호로 참조)
+        self.sessions = SessionStore(path=session_path)
+        
+        # 화면 메시지 전송/수정 (바뀐 부분만 수정, 긴 내용은 페이지로)
+        self.renderer = MessageRenderer()
+        
+        # 톤/키워드별로 미리 생성해 둔 줄거리 (재생성 시 바로 사용)
+        self.story_pool = StoryPool(self.claude, self.scheduler)
+        
+        # 사용자별 상태 저장 (SQLite, 바뀐 필드만 주기적으로 저장)
+        self.user_states = UserStateStore(path=state_path)
+        self.state_flush_interval = 5.0  # 상태 저장 주기 (초)
+        self._flush_task = None
         
-        # 사용자별 상태 저장
-        self.user_states = {}
+        # 사용자별 업데이트 처리 잠금 (쓰는 핸들러가 없으면 자동 삭제)
+        self._user_locks = weakref.WeakValueDictionary()
         
+        # SCENARIO_METRICS_PORT를 지정하면 /metrics(Prometheus), /trace/<사용자 ID>를 HTTP로 제공
+        self.metrics_port = os.environ.get('SCENARIO_METRICS_PORT')
+        self._metrics_server = None
+        
+        # 관리자 전용 진단 명령 (/profile, /memsnap, /tasks, SCENARIO_ADMIN_IDS로 관리자 지정)
+        self.diagnostics = Diagnostics()
+        
+    def _user_lock(self, user_id):
+        """사용자별 잠금 (같은 사용자 상태를 동시에 수정하지 않도록)"""
+        lock = self._user_locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._user_locks[user_id] = lock
+        return lock
+    
+    def _new_user_state(self):
+        """새 사용자 기본 상태"""
+        import random
+        return {
+            'selected_stories': {},
+            'current_stories': [],
+            'keywords': [],
+            'tone': random.choice(['기본', '자극적', '현실적', '충격적', '선정적']),
+            'num_stories': 5,
+            'stage': 'plot'  # plot, character, detail, narrative, structure, scene
+        }
+    
     def get_user_state(self, user_id):
-        """사용자 상태 가져오기"""
-        if user_id not in self.user_states:
-            import random
-            self.user_states[user_id] = {
-                'selected_stories': {},
-                'current_stories': [],
-                'keywords': [],
-                'tone': random.choice(['기본', '자극적', '현실적', '충격적', '선정적']),
-                'num_stories': 5,
-                'stage': 'plot'  # plot, character, detail, narrative, structure, scene
-            }
-        return self.user_states[user_id]
+        """사용자 상태 가져오기 (메모리에 없으면 저장소에서 읽음)"""
+        return self.user_states.get(user_id, self._new_user_state)
+    
+    def _queue_notice(self):
+        """생성 대기열 안내 문구"""
+        queued = self.scheduler.queue_depth(GenerationScheduler.INTERACTIVE)
+        if queued > 0:
+            return f" (대기 {queued}건)"
+        return ""
+    
+    async def _delete_message(self, message):
+        """메시지 삭제 (실패 무시)"""
+        if message:
+            try:
+                await message.delete()
+            except:
+                pass
     
+    @user_update
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """봇 시작"""
         user_id = update.effective_user.id
@@ -71,28 +159,51 @@ class TelegramScenarioBot:
             await self.show_current_stories(update, context)
             return
         
-        # 생성 중 메시지
-        generating_msg = await update.effective_chat.send_message("🔄 줄거리 생성 중...")
+        # 미리 생성해 둔 줄거리가 있으면 먼저 채움 (부족한 만큼만 새로 생성)
+        pooled = self.story_pool.take(state['tone'], state['keywords'], len(positions_to_generate))
+        for pos, story in zip(positions_to_generate, pooled):
+            self._place_story(state, pos, story)
+        positions_to_generate = positions_to_generate[len(pooled):]
         
-        # 필요한 만큼만 생성
-        plot_gen = PlotGen(num=len(positions_to_generate))
-        prompt_data = plot_gen.generate()
+        if not positions_to_generate:
+            await self.show_current_stories(update, context)
+            return
         
-        # 프롬프트 콘솔 출력
-        print("\n" + "="*60)
-        print("[1단계 줄거리 생성 프롬프트]")
-        print("="*60)
-        print(prompt_data['prompt'])
-        print("="*60 + "\n")
+        # 생성 중 메시지 (대기열이 있으면 대기 건수 표시)
+        generating_msg = await update.effective_chat.send_message(
+            "🔄 줄거리 생성 중..." + self._queue_notice()
+        )
         
-        # Claude 실행
+        # 완성된 스토리가 도착할 때마다 생성 중 메시지에 미리 보여줌
+        on_story, on_reset = self._make_story_progress(generating_msg, positions_to_generate, state)
+        
+        # 비슷한 시점의 같은 톤/키워드 요청과 묶어서 생성
+        # 키워드 일치 레퍼런스 우선, 이 사용자에게 이미 보낸 레퍼런스는 제외
+        seen_references = state.setdefault('seen_references', [])
         try:
-            response = self.claude.execute_prompt(prompt_data)
+            response = await self.plot_batcher.request(
+                user_id,
+                len(positions_to_generate),
+                keywords=state['keywords'],
+                tone=state['tone'],
+                exclude=seen_references,
+                on_story=on_story,
+                on_reset=on_reset
+            )
+        except RequestSuperseded:
+            # 같은 사용자의 새 요청이 대신 처리됨
+            await self._delete_message(generating_msg)
+            return
         except Exception as e:
             await generating_msg.edit_text(f"❌ 오류 발생: {str(e)}")
             print(f"Claude 실행 오류: {e}")
             response = None
         
+        if response:
+            if response['references_reset']:
+                seen_references.clear()
+            seen_references.extend(response['reference_ids'])
+        
         # 생성 메시지 삭제
         if generating_msg:
             try:
@@ -100,18 +211,68 @@ class TelegramScenarioBot:
             except:
                 pass
         
-        if response and 'stories' in response:
-            # 생성된 스토리를 빈 위치에 채우기
-            new_stories = response['stories']
-            for idx, pos in enumerate(positions_to_generate):
-                if idx < len(new_stories):
-                    if pos <= len(state['current_stories']):
-                        state['current_stories'][pos-1] = new_stories[idx]
-                    else:
-                        state['current_stories'].append(new_stories[idx])
+        new_stories = (response or {}).get('stories', [])
+        # 생성된 스토리를 빈 위치에 채우기
+        for idx, pos in enumerate(positions_to_generate):
+            if idx < len(new_stories):
+                self._place_story(state, pos, new_stories[idx])
+        
+        if len(new_stories) < len(positions_to_generate):
+            # 재시도까지 실패 (임시 줄거리 대신 실패 안내)
+            await update.effective_chat.send_message(
+                "❌ 줄거리 생성에 실패했습니다. 잠시 후 다시 시도해주세요."
+                + ("" if state['current_stories'] else " (/start)")
+            )
+            if not state['current_stories']:
+                return
         
         await self.show_current_stories(update, context)
     
+    def _place_story(self, state, pos, story):
+        """스토리를 지정 위치에 채우기"""
+        if pos <= len(state['current_stories']):
+            state['current_stories'][pos-1] = story
+        else:
+            state['current_stories'].append(story)
+    
+    def _make_story_progress(self, generating_msg, positions_to_generate, state, min_interval=1.5):
+        """스트리밍으로 도착한 스토리를 생성 중 메시지에 반영하는 콜백 생성 (on_story, on_reset 반환)"""
+        arrived = []
+        last_edit = [0.0]
+        original = list(state['current_stories'])
+        
+        async def on_story(story, path):
+            if path != ('stories',) or len(arrived) >= len(positions_to_generate):
+                return
+            self._place_story(state, positions_to_generate[len(arrived)], story)
+            arrived.append(story)
+            
+            # 텔레그램 수정 제한을 고려해 일정 간격으로만 수정 (첫 스토리는 즉시)
+            now = time.monotonic()
+            if now - last_edit[0] < min_interval and len(arrived) < len(positions_to_generate):
+                return
+            last_edit[0] = now
+            
+            text = f"🔄 줄거리 생성 중... ({len(arrived)}/{len(positions_to_generate)})\n\n"
+            for pos, item in zip(positions_to_generate, arrived):
+                text += f"✨ {pos}. {item['title']}\n{item['plot']}\n\n"
+            try:
+                await generating_msg.edit_text(text[:4000])
+            except Exception as e:
+                print(f"진행 메시지 수정 실패: {e}")
+        
+        async def on_reset():
+            # 실패한 시도가 채운 스토리는 되돌리고 재시도 결과를 처음부터 다시 받음
+            state['current_stories'][:] = original
+            arrived.clear()
+            last_edit[0] = 0.0
+            try:
+                await generating_msg.edit_text("🔄 줄거리 생성 중... (다시 시도하는 중)")
+            except Exception as e:
+                print(f"진행 메시지 수정 실패: {e}")
+        
+        return on_story, on_reset
+    
     async def show_current_stories(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """현재 스토리 목록 표시"""
         user_id = update.effective_user.id
@@ -120,18 +281,16 @@ class TelegramScenarioBot:
         # 선택 상태 확인
         selected_count = len([k for k, v in state['selected_stories'].items() if v is not None])
         
-        # 메시지 구성
-        message = f"📚 **생성된 줄거리** ({selected_count}/{state['num_stories']} 선택됨)\n\n"
+        # 메시지 구성 (선택 상태는 버튼에만 표시 → 선택/해제 시 버튼만 수정)
+        message = f"📚 **생성된 줄거리** ({state['num_stories']}개 중 선택하세요)\n\n"
         
         for i, story in enumerate(state['current_stories'], 1):
             if i in state['selected_stories'] and state['selected_stories'][i] is not None:
-                status = "✅"
                 display_story = state['selected_stories'][i]
             else:
-                status = "❌"
                 display_story = story
             
-            message += f"{status} **{i}. {display_story['title']}**\n"
+            message += f"**{i}. {display_story['title']}**\n"
             message += f"{display_story['plot']}\n\n"
         
         # 인라인 키보드 생성
@@ -181,20 +340,10 @@ class TelegramScenarioBot:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        # 메시지 전송 또는 업데이트
-        if update.callback_query:
-            await update.callback_query.message.edit_text(
-                message, 
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        else:
-            await update.effective_chat.send_message(
-                message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
+        # 메시지 전송 또는 업데이트 (바뀐 부분만)
+        await self.renderer.show(update, 'stories', message, reply_markup)
     
+    @user_update
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """버튼 콜백 처리"""
         query = update.callback_query
@@ -212,7 +361,20 @@ class TelegramScenarioBot:
                 state['selected_stories'][story_num] = None
             else:
                 state['selected_stories'][story_num] = state['current_stories'][story_num-1]
-            await self.show_current_stories(update, context)
+            # 연속 클릭은 마지막 상태로 한 번만 수정
+            self.renderer.debounce(update.effective_chat.id, lambda: self.show_current_stories(update, context))
+        
+        # 긴 화면 페이지 이동
+        elif data.startswith("page_"):
+            _, view, page = data.rsplit("_", 2)
+            views = {
+                'stories': self.show_current_stories,
+                'plots': self.show_plot_selection,
+                'characters': self.show_characters
+            }
+            if view in views:
+                self.renderer.set_page(update.effective_chat.id, view, int(page))
+                self.renderer.debounce(update.effective_chat.id, lambda: views[view](update, context))
         
         # 선택 안 된 것만 재생성
         elif data == "regen_unselected":
@@ -262,14 +424,9 @@ class TelegramScenarioBot:
                     final_stories.append(state['selected_stories'][i])
             
             # 결과 저장
-            output_dir = f"outputs/user_{user_id}"
-            os.makedirs(output_dir, exist_ok=True)
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = os.path.join(output_dir, f"plots_{timestamp}.json")
-            
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump({"stories": final_stories}, f, ensure_ascii=False, indent=2)
+            state['plots_artifact'] = await asyncio.to_thread(
+                self.sessions.append, user_id, 'plots', {"stories": final_stories}
+            )
             
             # 하나의 스토리 선택 (첫 번째 것으로 시작)
             state['selected_plot'] = final_stories[0]
@@ -284,13 +441,13 @@ class TelegramScenarioBot:
         elif data == "prev_plot":
             state['current_plot_index'] = max(0, state['current_plot_index'] - 1)
             state['selected_plot'] = state['final_plots'][state['current_plot_index']]
-            await self.show_plot_selection(update, context)
+            self.renderer.debounce(update.effective_chat.id, lambda: self.show_plot_selection(update, context))
         
         elif data == "next_plot":
             max_index = len(state['final_plots']) - 1
             state['current_plot_index'] = min(max_index, state['current_plot_index'] + 1)
             state['selected_plot'] = state['final_plots'][state['current_plot_index']]
-            await self.show_plot_selection(update, context)
+            self.renderer.debounce(update.effective_chat.id, lambda: self.show_plot_selection(update, context))
         
         # 캐릭터 생성 시작
         elif data == "select_plot_for_character":
@@ -306,12 +463,16 @@ class TelegramScenarioBot:
                 state['selected_character_versions'] = {}
             
             state['selected_character_versions'][char_name] = version
-            await self.show_characters(update, context)
+            self.renderer.debounce(update.effective_chat.id, lambda: self.show_characters(update, context))
+        
+        # 인물 한 명만 재생성
+        elif data.startswith("regen_char_"):
+            await self.regenerate_character(update, context, data[len("regen_char_"):])
         
         # 캐릭터 재생성
         elif data == "regenerate_characters":
             state['selected_character_versions'] = {}  # 선택 초기화
-            await self.generate_characters(update, context)
+            await self.generate_characters(update, context, refresh=True)
         
         # 다른 줄거리 선택
         elif data == "change_plot":
@@ -330,18 +491,17 @@ class TelegramScenarioBot:
                 if char:
                     final_characters.append(char)
             
-            # 캐릭터 저장
-            output_dir = f"outputs/user_{user_id}"
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = os.path.join(output_dir, f"characters_{timestamp}.json")
-            
-            character_data = {
-                "plot": state['selected_plot'],
-                "characters": final_characters
-            }
-            
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(character_data, f, ensure_ascii=False, indent=2)
+            # 캐릭터 저장 (줄거리는 복사하지 않고 줄거리 결과 번호 + 위치로 참조)
+            plots_artifact = state.get('plots_artifact')
+            character_data = {"characters": final_characters}
+            if plots_artifact:
+                character_data["plot_index"] = state.get('current_plot_index', 0)
+            else:
+                character_data["plot"] = state['selected_plot']
+            state['characters_artifact'] = await asyncio.to_thread(
+                self.sessions.append, user_id, 'characters', character_data,
+                [plots_artifact] if plots_artifact else []
+            )
             
             state['final_characters'] = final_characters
             
@@ -352,6 +512,7 @@ class TelegramScenarioBot:
             
             state['stage'] = 'character_detail'
     
+    @user_update
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """일반 메시지 처리"""
         user_id = update.effective_user.id
@@ -369,6 +530,7 @@ class TelegramScenarioBot:
             # 다시 스토리 목록 표시
             await self.show_current_stories(update, context)
     
+    @user_update
     async def clear_keywords(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """키워드 초기화"""
         user_id = update.effective_user.id
@@ -380,6 +542,65 @@ class TelegramScenarioBot:
         await update.message.reply_text("✅ 키워드가 초기화되었습니다.")
         await self.show_current_stories(update, context)
     
+    def _memory_sizes(self):
+        """메모리 스냅샷에 함께 기록할 구조별 크기"""
+        user_states = self.user_states.stats()
+        renderer = self.renderer.stats()
+        return {
+            'user_states 메모리 캐시 (명)': user_states['cached'],
+            'user_states 저장 기록 (명)': user_states['saved'],
+            'renderer 기억 중인 메시지': renderer['tracked_messages'],
+            'renderer 페이지 기록': renderer['tracked_pages'],
+            'renderer 대기/진행 중 렌더링': renderer['pending_renders'] + renderer['active_renders'],
+            'scheduler 대기 작업': self.scheduler.queue_depth(),
+            'story_pool 조합': len(self.story_pool.stats()['profiles']),
+            'metrics 추적 세션': len(METRICS.sessions()),
+            'asyncio 작업': len(asyncio.all_tasks())
+        }
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/profile [N|status]: 다음 N번의 핸들러 실행 동안 CPU 샘플링 (관리자 전용)"""
+        if not self.diagnostics.is_admin(update.effective_user.id):
+            return
+        args = context.args or []
+        if args and args[0] == 'status':
+            await update.message.reply_text(self.diagnostics.profile_status())
+            return
+        try:
+            count = int(args[0]) if args else 20
+        except ValueError:
+            await update.message.reply_text("사용법: /profile [핸들러 수|status]")
+            return
+        remaining = self.diagnostics.profile_handlers(count)
+        await update.message.reply_text(
+            f"🔬 다음 핸들러 {remaining}건 동안 CPU 샘플링합니다.\n"
+            f"결과: {self.diagnostics.out_dir}/cpu_*.txt (.folded는 flamegraph용)"
+        )
+    
+    async def memory_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/memsnap [stop]: tracemalloc 스냅샷과 상위 할당 위치 저장 (관리자 전용)"""
+        if not self.diagnostics.is_admin(update.effective_user.id):
+            return
+        if context.args and context.args[0] == 'stop':
+            self.diagnostics.memory_stop()
+            await update.message.reply_text("메모리 추적을 종료했습니다.")
+            return
+        # 스냅샷 비교는 수 초 걸릴 수 있으므로 스레드에서 처리 (크기는 루프에서 먼저 수집)
+        sizes = self._memory_sizes()
+        path, summary = await asyncio.to_thread(self.diagnostics.memory_snapshot, 25, sizes)
+        sizes_text = '\n'.join(f"• {name}: {size}" for name, size in sizes.items())
+        message = f"🧠 {summary}\n\n{sizes_text}"
+        if path:
+            message += f"\n\n결과: {path}"
+        await update.message.reply_text(message)
+    
+    async def tasks_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/tasks: 이벤트 루프의 asyncio 작업 목록과 스택 저장 (관리자 전용)"""
+        if not self.diagnostics.is_admin(update.effective_user.id):
+            return
+        path, summary = self.diagnostics.dump_tasks()
+        await update.message.reply_text(f"{summary[:3500]}\n\n결과: {path}")
+    
     async def show_plot_selection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """최종 선택된 줄거리 중 하나 선택"""
         user_id = update.effective_user.id
@@ -422,21 +643,10 @@ class TelegramScenarioBot:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        if update.callback_query:
-            await update.callback_query.message.edit_text(
-                message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        else:
-            await update.effective_chat.send_message(
-                message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
+        await self.renderer.show(update, 'plots', message, reply_markup)
     
-    async def generate_characters(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """캐릭터 생성"""
+    async def generate_characters(self, update: Update, context: ContextTypes.DEFAULT_TYPE, refresh=False):
+        """캐릭터 생성 (refresh=True면 캐시를 건너뛰고 새로 생성)"""
         user_id = update.effective_user.id
         state = self.get_user_state(user_id)
         
@@ -445,23 +655,38 @@ class TelegramScenarioBot:
             await update.effective_chat.send_message("선택된 줄거리가 없습니다.")
             return
         
-        # 생성 중 메시지
-        generating_msg = await update.effective_chat.send_message("🎭 캐릭터 생성 중...")
-        
-        # CharacterGen 사용
-        char_gen = CharacterGen()
-        prompt_data = char_gen.generate(selected_plot)
-        
-        # 프롬프트 콘솔 출력
-        print("\n" + "="*60)
-        print("[2단계 캐릭터 생성 프롬프트]")
-        print("="*60)
-        print(prompt_data['prompt'])
-        print("="*60 + "\n")
+        # 생성 중 메시지 (대기열이 있으면 대기 건수 표시)
+        generating_msg = await update.effective_chat.send_message(
+            "🎭 캐릭터 생성 중..." + self._queue_notice()
+        )
         
         # Claude 실행
         try:
-            response = self.claude.execute_prompt(prompt_data)
+            response = None
+            if self.character_fanout:
+                # 인물 목록 추출 후 인물별로 동시에 생성
+                response = await self.character_fanout.generate(user_id, selected_plot, refresh)
+            
+            if response is None:
+                # 한 번에 전체 생성 (분할 생성을 끄거나 인물 목록 추출에 실패한 경우)
+                char_gen = CharacterGen()
+                prompt_data = char_gen.generate(selected_plot)
+                prompt_data['refresh'] = refresh
+                
+                # 프롬프트 콘솔 출력
+                print("\n" + "="*60)
+                print("[2단계 캐릭터 생성 프롬프트]")
+                print("="*60)
+                print(prompt_data['prompt'])
+                print("="*60 + "\n")
+                
+                response = await self.scheduler.submit(
+                    user_id, lambda: self.claude.execute_prompt_async(prompt_data)
+                )
+        except RequestSuperseded:
+            # 같은 사용자의 새 요청이 대신 처리됨
+            await self._delete_message(generating_msg)
+            return
         except Exception as e:
             await generating_msg.edit_text(f"❌ 오류 발생: {str(e)}")
             return
@@ -473,12 +698,52 @@ class TelegramScenarioBot:
             except:
                 pass
         
-        if response and 'characters' in response:
+        if response and response.get('characters'):
             state['current_characters'] = response['characters']
+            state['character_cast'] = response.get('cast', [])
+            state['failed_characters'] = response.get('failed', [])
             await self.show_characters(update, context)
         else:
             await update.effective_chat.send_message("캐릭터 생성에 실패했습니다.")
     
+    async def regenerate_character(self, update: Update, context: ContextTypes.DEFAULT_TYPE, name):
+        """인물 한 명만 다시 생성 (분할 생성 모드)"""
+        user_id = update.effective_user.id
+        state = self.get_user_state(user_id)
+        
+        cast = state.get('character_cast', [])
+        selected_plot = state.get('selected_plot')
+        if not self.character_fanout or not cast or not selected_plot:
+            await self.generate_characters(update, context, refresh=True)
+            return
+        
+        generating_msg = await update.effective_chat.send_message(
+            f"🎭 {name} 다시 생성 중..." + self._queue_notice()
+        )
+        try:
+            versions = await self.character_fanout.regenerate(user_id, selected_plot, cast, name)
+        except RequestSuperseded:
+            await self._delete_message(generating_msg)
+            return
+        except Exception as e:
+            print(f"캐릭터 재생성 오류: {e}")
+            versions = None
+        await self._delete_message(generating_msg)
+        
+        if not versions:
+            await update.effective_chat.send_message(f"{name} 생성에 실패했습니다. 다시 시도해주세요.")
+            return
+        
+        # 인물 목록 순서 유지
+        characters = dict(state.get('current_characters', {}))
+        characters[name] = versions
+        state['current_characters'] = {
+            m['name']: characters[m['name']] for m in cast if m['name'] in characters
+        }
+        state['failed_characters'] = [n for n in state.get('failed_characters', []) if n != name]
+        state.get('selected_character_versions', {}).pop(name, None)
+        await self.show_characters(update, context)
+    
     async def show_characters(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """생성된 캐릭터 표시 (인물별 선택 가능)"""
         user_id = update.effective_user.id
@@ -508,6 +773,10 @@ class TelegramScenarioBot:
                 message += f"{check} **{version_num}번**: {ver.get('age')}세, {ver.get('job')}, {ver.get('hometown')}, {ver.get('mbti')}\n"
             message += "\n"
         
+        failed_names = state.get('failed_characters', [])
+        if failed_names:
+            message += f"⚠️ 생성 실패: {', '.join(failed_names)} (아래 버튼으로 다시 생성)\n\n"
+        
         # 선택된 캐릭터 상세 정보 표시
         message += "---\n**선택된 캐릭터 상세:**\n\n"
         for char_name, selected_ver in selected_versions.items():
@@ -535,13 +804,20 @@ class TelegramScenarioBot:
                 row.append(InlineKeyboardButton(btn_text, callback_data=f"char_{char_name}_{i}"))
             keyboard.append(row)
         
+        # 생성에 실패한 인물은 따로 다시 생성
+        failed = state.get('failed_characters', [])
+        for char_name in failed:
+            keyboard.append([
+                InlineKeyboardButton(f"🔁 {char_name} 다시 생성", callback_data=f"regen_char_{char_name}")
+            ])
+        
         # 액션 버튼들
         keyboard.append([
             InlineKeyboardButton("🔄 전체 재생성", callback_data="regenerate_characters")
         ])
         
         # 모든 캐릭터가 선택되었는지 확인
-        if len(selected_versions) == len(characters_data):
+        if len(selected_versions) == len(characters_data) and not failed:
             keyboard.append([
                 InlineKeyboardButton("✅ 확정하고 다음 단계로", callback_data="confirm_characters")
             ])
@@ -552,29 +828,61 @@ class TelegramScenarioBot:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        if update.callback_query:
-            await update.callback_query.message.edit_text(
-                message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        else:
-            await update.effective_chat.send_message(
-                message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
+        # 등장인물이 많아 4096자를 넘으면 페이지로 나눠 표시
+        await self.renderer.show(update, 'characters', message, reply_markup)
+    
+    async def _post_init(self, application):
+        """이벤트 루프 시작 후 LLM 워커 준비, 톤별 줄거리 풀 채우기, 상태 정기 저장 및 지표 서버 시작"""
+        await self.claude.backend.start()
+        self.story_pool.warm()
+        self._flush_task = asyncio.ensure_future(self._flush_states())
+        if self.metrics_port:
+            self._metrics_server = await METRICS.serve(port=int(self.metrics_port))
+    
+    async def _flush_states(self):
+        """사용자 상태 정기 저장"""
+        while True:
+            await asyncio.sleep(self.state_flush_interval)
+            try:
+                await self.user_states.flush_dirty()
+            except Exception as e:
+                print(f"사용자 상태 저장 실패: {e}")
+    
+    async def _post_shutdown(self, application):
+        """종료 시 남은 상태 저장, LLM 워커 종료"""
+        if self._flush_task:
+            self._flush_task.cancel()
+        await self.claude.backend.close()
+        if self._metrics_server:
+            self._metrics_server.close()
+        self.user_states.close()
+        self.sessions.close()
     
     def run(self):
         """봇 실행"""
         # 애플리케이션 생성
-        application = Application.builder().token(self.token).build()
-        
-        # 핸들러 추가
-        application.add_handler(CommandHandler("start", self.start))
-        application.add_handler(CommandHandler("clear_keywords", self.clear_keywords))
-        application.add_handler(CallbackQueryHandler(self.button_callback))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        # 생성 대기 중에도 다른 사용자의 업데이트를 처리하도록 동시 처리 활성화
+        # (같은 사용자의 업데이트는 user_update의 사용자별 잠금으로 순서대로 처리)
+        application = (
+            Application.builder()
+            .token(self.token)
+            .concurrent_updates(True)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
+        
+        # 핸들러 추가 (/profile 요청 시 CPU 샘플링 대상이 되도록 감쌈)
+        wrap = self.diagnostics.wrap
+        application.add_handler(CommandHandler("start", wrap("start", self.start)))
+        application.add_handler(CommandHandler("clear_keywords", wrap("clear_keywords", self.clear_keywords)))
+        application.add_handler(CallbackQueryHandler(wrap("button_callback", self.button_callback)))
+        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, wrap("handle_message", self.handle_message)))
+        
+        # 관리자 전용 진단 명령
+        application.add_handler(CommandHandler("profile", self.profile_command))
+        application.add_handler(CommandHandler("memsnap", self.memory_command))
+        application.add_handler(CommandHandler("tasks", self.tasks_command))
         
         # 봇 실행
         print("🤖 텔레그램 봇이 시작되었습니다...")
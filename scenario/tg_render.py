@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+from metrics import METRICS
+
+
+# 텔레그램 메시지 최대 길이는 4096자 (페이지 버튼/마크다운 여유분 제외)
+PAGE_LIMIT = 3800
+
+
+def paginate(text, limit=PAGE_LIMIT):
+    """
+    긴 텍스트를 페이지로 나눔
+
+    빈 줄(문단) 경계에서 나누므로 같은 내용이면 항상 같은 페이지가 나오고,
+    문단 하나가 너무 길면 줄 단위, 그래도 길면 글자 단위로 나눈다.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    pages = []
+    current = ""
+    for block in text.split("\n\n"):
+        pieces = [block]
+        if len(block) > limit:
+            pieces = []
+            for line in block.split("\n"):
+                while len(line) > limit:
+                    pieces.append(line[:limit])
+                    line = line[limit:]
+                pieces.append(line)
+        for i, piece in enumerate(pieces):
+            sep = "\n\n" if i == 0 else "\n"
+            candidate = current + sep + piece if current else piece
+            if len(candidate) > limit:
+                pages.append(current)
+                current = piece
+            else:
+                current = candidate
+    if current:
+        pages.append(current)
+    return pages
+
+
+def _markup_key(reply_markup):
+    """버튼 비교용 키"""
+    if reply_markup is None:
+        return None
+    return json.dumps(reply_markup.to_dict(), ensure_ascii=False, sort_keys=True)
+
+
+class MessageRenderer:
+    """
+    화면 메시지 전송/수정 (마지막으로 보낸 내용을 기억해 바뀐 부분만 수정)
+
+    - 텍스트와 버튼이 모두 같으면 수정하지 않음
+    - 버튼만 바뀌면 edit_message_reply_markup만 호출
+    - 4096자를 넘는 내용은 페이지로 나누고 이동 버튼(page_<화면>_<번호>)을 붙임
+    - 연속 클릭은 debounce로 마지막 한 번만 렌더링
+    """
+
+    def __init__(self, page_limit=PAGE_LIMIT, max_tracked=5000, quiet_window=0.4):
+        self.page_limit = page_limit
+        self.max_tracked = max_tracked  # 기억할 최대 메시지 수
+        self.quiet_window = quiet_window  # 마지막 클릭 후 렌더링까지 대기 시간 (초)
+        self._pending = {}  # chat_id -> 대기 중인 렌더링 작업
+        self._rendering = {}  # chat_id -> 실행 중인 렌더링 작업
+        self.renders_coalesced = 0
+        self._sent = OrderedDict()  # (chat_id, message_id) -> (텍스트, 버튼 키)
+        self._pages = {}  # (chat_id, 화면) -> 현재 페이지
+        self.edits_skipped = 0
+        self.markup_only_edits = 0
+
+    def debounce(self, chat_id, render):
+        """
+        렌더링 예약 (quiet_window 안에 다시 호출되면 이전 예약은 취소되고 새 것으로 대체)
+
+        상태 변경은 호출 전에 이미 반영되어 있으므로 마지막 렌더링이 최종 상태를 그린다.
+        render: 인자 없이 호출하면 코루틴을 반환하는 함수
+        """
+        pending = self._pending.get(chat_id)
+        if pending is not None and not pending.done():
+            pending.cancel()
+            self.renders_coalesced += 1
+        self._pending[chat_id] = asyncio.ensure_future(self._render_later(chat_id, render))
+
+    async def _render_later(self, chat_id, render):
+        await asyncio.sleep(self.quiet_window)
+        task = asyncio.current_task()
+        if self._pending.get(chat_id) is task:
+            del self._pending[chat_id]
+
+        # 같은 채팅의 이전 렌더링이 진행 중이면 끝난 뒤 실행 (수정 순서 보장)
+        previous = self._rendering.get(chat_id)
+        self._rendering[chat_id] = task
+        try:
+            if previous is not None and not previous.done():
+                await asyncio.wait([previous])
+            await render()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"화면 렌더링 실패: {e}")
+        finally:
+            if self._rendering.get(chat_id) is task:
+                del self._rendering[chat_id]
+
+    def set_page(self, chat_id, view, page):
+        """페이지 이동 버튼 처리"""
+        self._pages[(chat_id, view)] = max(0, page)
+
+    def stats(self):
+        """렌더러 상태 (기억 중인 메시지/페이지 수, 대기/진행 중 렌더링 수, 수정 절감 횟수)"""
+        return {
+            'tracked_messages': len(self._sent),
+            'tracked_pages': len(self._pages),
+            'pending_renders': len(self._pending),
+            'active_renders': len(self._rendering),
+            'renders_coalesced': self.renders_coalesced,
+            'edits_skipped': self.edits_skipped,
+            'markup_only_edits': self.markup_only_edits
+        }
+
+    def _remember(self, message, text, markup_key):
+        key = (message.chat_id, message.message_id)
+        self._sent[key] = (text, markup_key)
+        self._sent.move_to_end(key)
+        while len(self._sent) > self.max_tracked:
+            self._sent.popitem(last=False)
+
+    def _with_page_buttons(self, view, page, total, reply_markup):
+        """여러 페이지면 이동 버튼 줄 추가"""
+        if total <= 1:
+            return reply_markup
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀️", callback_data=f"page_{view}_{page - 1}"))
+        nav.append(InlineKeyboardButton(f"{page + 1}/{total}", callback_data=f"page_{view}_{page}"))
+        if page < total - 1:
+            nav.append(InlineKeyboardButton("▶️", callback_data=f"page_{view}_{page + 1}"))
+        rows = [list(row) for row in reply_markup.inline_keyboard] if reply_markup else []
+        return InlineKeyboardMarkup(rows + [nav])
+
+    async def show(self, update, view, text, reply_markup=None, parse_mode='Markdown'):
+        """
+        화면 표시 (버튼 콜백이면 해당 메시지 수정, 아니면 새 메시지 전송)
+
+        view: 화면 이름 (페이지 번호 저장 및 이동 버튼에 사용)
+        """
+        chat_id = update.effective_chat.id
+        # 다른 화면을 바로 그리면 대기 중인 예전 화면 렌더링은 필요 없음
+        pending = self._pending.pop(chat_id, None)
+        if pending is not None and not pending.done():
+            pending.cancel()
+            self.renders_coalesced += 1
+        # 이미 진행 중인 렌더링은 끝난 뒤 그림 (예전 화면이 새 화면을 덮어쓰지 않도록)
+        rendering = self._rendering.get(chat_id)
+        if rendering is not None and rendering is not asyncio.current_task() and not rendering.done():
+            await asyncio.wait([rendering])
+
+        pages = paginate(text, self.page_limit)
+        page = min(self._pages.get((chat_id, view), 0), len(pages) - 1)
+        self._pages[(chat_id, view)] = page
+        text = pages[page]
+        reply_markup = self._with_page_buttons(view, page, len(pages), reply_markup)
+
+        # 텔레그램 전송/수정 시간 (세션 추적에서 LLM/파서 시간과 구분)
+        with METRICS.span('render', view=view):
+            return await self._deliver(update, text, reply_markup, parse_mode)
+
+    async def _deliver(self, update, text, reply_markup, parse_mode):
+        """새 메시지 전송 또는 콜백 메시지 수정 (바뀐 부분만)"""
+        markup_key = _markup_key(reply_markup)
+        query = update.callback_query
+        if not query or not query.message:
+            message = await update.effective_chat.send_message(
+                text, reply_markup=reply_markup, parse_mode=parse_mode
+            )
+            self._remember(message, text, markup_key)
+            return message
+
+        message = query.message
+        # 기록이 없으면 (재시작 등) 전체 수정
+        last = self._sent.get((message.chat_id, message.message_id))
+
+        try:
+            if last == (text, markup_key):
+                self.edits_skipped += 1
+            elif last is not None and last[0] == text:
+                await message.edit_reply_markup(reply_markup=reply_markup)
+                self.markup_only_edits += 1
+            else:
+                await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        except BadRequest as e:
+            # 같은 내용으로 수정한 경우 (다른 경로로 이미 반영됨)
+            if 'not modified' not in str(e).lower():
+                raise
+        self._remember(message, text, markup_key)
+        return message
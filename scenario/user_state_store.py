@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+def _int_keys(value):
+    """JSON에서 문자열이 된 번호 키를 정수로 복원"""
+    return {int(k): v for k, v in value.items()}
+
+
+# 필드별 복원 함수 (JSON으로 바뀌는 타입만)
+FIELD_DECODERS = {
+    'selected_stories': _int_keys,
+}
+
+
+class UserStateStore:
+    """
+    사용자 상태 저장소 (SQLite WAL + 메모리 캐시, 나중에 모아서 저장)
+
+    상태는 (사용자, 필드)별 행으로 저장하므로 바뀐 필드만 다시 쓴다.
+    사용자 상태는 처음 접근할 때 읽어오고, 캐시는 최근 사용 순으로 max_cached명까지만 유지한다
+    (넘친 사용자는 정기 저장(flush_dirty) 때 저장 후 제거하므로 잠시 넘칠 수 있음).
+    핸들러가 상태 dict를 직접 수정하므로 get()으로 가져갔거나 mark_dirty()로 표시한 사용자만
+    저장 시점에 직렬화해 마지막으로 저장한 값과 비교한다.
+    hold()~release() 사이(핸들러 실행 중)인 사용자는 캐시에서 제거하지 않는다
+    (제거하면 핸들러가 들고 있는 dict의 이후 수정이 저장되지 않음).
+    """
+
+    def __init__(self, path=None, max_cached=2000):
+        if path is None:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+            path = os.path.join(base_dir, 'state/user_states.db')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_cached = max_cached  # 메모리에 유지할 최대 사용자 수
+
+        self._lock = threading.RLock()  # 캐시/저장 기록 보호
+        self._db_lock = threading.Lock()  # DB 연결 보호 (쓰기는 스레드에서 실행)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")  # 다른 프로세스가 쓰는 중이면 대기
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_state (
+                user_id INTEGER NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (user_id, field)
+            ) WITHOUT ROWID
+        """)
+
+        self._states = OrderedDict()  # user_id -> 상태 dict (최근 사용 순)
+        self._saved = {}  # user_id -> {필드: 마지막으로 저장한 JSON}
+        self._dirty = set()  # 다음 저장 때 확인할 사용자
+        self._held = Counter()  # 사용자 -> 실행 중인 핸들러 수
+
+    def get(self, user_id, factory):
+        """사용자 상태 (캐시에 없으면 DB에서 읽고, DB에도 없으면 factory()로 생성)"""
+        with self._lock:
+            # 가져간 쪽이 수정할 수 있으므로 다음 저장 대상
+            self._dirty.add(user_id)
+            state = self._states.get(user_id)
+            if state is not None:
+                self._states.move_to_end(user_id)
+                return state
+
+            with self._db_lock:
+                rows = self._conn.execute(
+                    "SELECT field, value FROM user_state WHERE user_id = ?", (user_id,)
+                ).fetchall()
+            if rows:
+                state = {}
+                for field, value in rows:
+                    decoded = json.loads(value)
+                    decoder = FIELD_DECODERS.get(field)
+                    state[field] = decoder(decoded) if decoder else decoded
+                # 새로 추가된 기본 필드 보충
+                for field, value in factory().items():
+                    state.setdefault(field, value)
+                self._saved[user_id] = dict(rows)
+            else:
+                state = factory()
+                self._saved[user_id] = {}
+
+            self._states[user_id] = state
+            return state
+
+    def mark_dirty(self, user_id):
+        """상태를 수정한 사용자 표시 (다음 저장 때 바뀐 필드 확인)"""
+        with self._lock:
+            if user_id in self._states:
+                self._dirty.add(user_id)
+
+    def hold(self, user_id):
+        """핸들러 시작 (끝날 때까지 캐시에서 제거하지 않음)"""
+        with self._lock:
+            self._held[user_id] += 1
+
+    def release(self, user_id):
+        """핸들러 종료 (도중에 수정한 것도 저장되도록 저장 대상으로 표시)"""
+        with self._lock:
+            self._held[user_id] -= 1
+            if self._held[user_id] <= 0:
+                del self._held[user_id]
+            if user_id in self._states:
+                self._dirty.add(user_id)
+
+    def _victims(self):
+        """캐시에서 제거할 사용자 (오래 안 쓴 순, 핸들러 실행 중인 사용자 제외)"""
+        excess = len(self._states) - self.max_cached
+        victims = []
+        for user_id in self._states:
+            if len(victims) >= excess:
+                break
+            if user_id not in self._held:
+                victims.append(user_id)
+        return victims
+
+    def _evict(self, victims):
+        """저장을 마친 사용자를 캐시에서 제거 (저장하는 동안 다시 사용된 사용자는 유지)"""
+        with self._lock:
+            for user_id in victims:
+                if user_id in self._held or user_id in self._dirty or user_id not in self._states:
+                    continue
+                del self._states[user_id]
+                self._saved.pop(user_id, None)
+
+    def _changes(self, user_id):
+        """(바뀐 필드 목록, 삭제된 필드 목록)"""
+        state = self._states[user_id]
+        saved = self._saved.setdefault(user_id, {})
+        changed = []
+        for field, value in state.items():
+            encoded = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+            if saved.get(field) != encoded:
+                changed.append((field, encoded))
+        removed = [field for field in saved if field not in state]
+        return changed, removed
+
+    def _collect(self, user_ids):
+        """저장할 변경사항 (반환: (upserts, deletes))"""
+        now = time.time()
+        upserts = []
+        deletes = []
+        for user_id in user_ids:
+            if user_id not in self._states:
+                continue
+            changed, removed = self._changes(user_id)
+            for field, encoded in changed:
+                upserts.append((user_id, field, encoded, now))
+            for field in removed:
+                deletes.append((user_id, field))
+        return upserts, deletes
+
+    def _write(self, upserts, deletes):
+        """변경사항을 한 트랜잭션으로 저장"""
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO user_state (user_id, field, value, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (user_id, field) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                    upserts
+                )
+                self._conn.executemany(
+                    "DELETE FROM user_state WHERE user_id = ? AND field = ?", deletes
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _written(self, upserts, deletes):
+        """저장에 성공한 값만 기록"""
+        with self._lock:
+            for user_id, field, encoded, _ in upserts:
+                if user_id in self._saved:
+                    self._saved[user_id][field] = encoded
+            for user_id, field in deletes:
+                if user_id in self._saved:
+                    self._saved[user_id].pop(field, None)
+        return len(upserts) + len(deletes)
+
+    def flush(self, user_ids=None):
+        """바뀐 필드만 DB에 저장 (반환: 저장한 필드 수)"""
+        with self._lock:
+            if user_ids is None:
+                user_ids = list(self._states)
+            upserts, deletes = self._collect(user_ids)
+            self._dirty.difference_update(user_ids)
+            if not upserts and not deletes:
+                return 0
+            try:
+                self._write(upserts, deletes)
+            except Exception:
+                self._dirty.update(user_id for user_id, *_ in upserts + deletes)
+                raise
+            return self._written(upserts, deletes)
+
+    async def flush_dirty(self):
+        """
+        표시된 사용자와 캐시에서 제거할 사용자만 저장 (정기 저장용)
+
+        직렬화는 핸들러가 상태를 수정하지 않는 이벤트 루프에서 하고, SQLite 쓰기는 스레드에서 한다.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            victims = self._victims()
+            upserts, deletes = self._collect(dirty.union(victims))
+        if not upserts and not deletes:
+            self._evict(victims)
+            return 0
+        try:
+            await asyncio.to_thread(self._write, upserts, deletes)
+        except Exception:
+            # 다음 저장 때 다시 시도
+            with self._lock:
+                self._dirty.update(user_id for user_id, *_ in upserts + deletes)
+            raise
+        written = self._written(upserts, deletes)
+        self._evict(victims)
+        return written
+
+    def __contains__(self, user_id):
+        return user_id in self._states
+
+    def __len__(self):
+        return len(self._states)
+
+    def stats(self):
+        """저장소 상태 (캐시 사용자 수, 저장 기록 사용자 수, 저장 대기/핸들러 실행 중 사용자 수)"""
+        with self._lock:
+            return {
+                'cached': len(self._states),
+                'saved': len(self._saved),
+                'dirty': len(self._dirty),
+                'held': len(self._held)
+            }
+
+    def close(self):
+        """남은 변경사항 저장 후 연결 종료"""
+        with self._lock:
+            self.flush()
+            with self._db_lock:
+                self._conn.close()